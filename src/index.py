@@ -13,17 +13,17 @@
 #   limitations under the License.
 
 import os
-from enum import Enum
+from collections import Counter
 
-from logs import input_records_decoder, main
-from logs.input_records_decoder import BadSchemaError
-from logs.logs_sender import CallThrottlingException, DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH
-from logs.models.batch_metadata import BatchMetadata
+from logs import event_sources, input_records_decoder, main, transformation_processes
+from logs.input_records_decoder import BadSchemaError, DEFAULT_DECODE_CONCURRENCY
+from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH, DEFAULT_UPLOAD_CONCURRENCY, \
+    DEFAULT_GZIP_COMPRESSION_LEVEL
+from logs.models.transformation_result import TransformationResult
 from util.context import Context
 from util.logging import log_error_with_stacktrace, log_multiline_message
 
 
-
 def handler(event, lambda_context):
 
     try:
@@ -37,29 +37,30 @@ def handler(event, lambda_context):
 
     context = get_context(lambda_context)
 
+    # Firehose, Kinesis Data Streams, SQS or CloudWatch Logs subscription
+    event_source = event_sources.find_event_source(event)
     try:
-        records = event['records']
-    except KeyError as exc:
+        records = event_source.read_records(event)
+    except (KeyError, TypeError, ValueError) as exc:
         raise BadSchemaError('records') from exc
 
     try:
-        is_logs, plaintext_records = input_records_decoder.check_records_list_if_logs_end_decode(records, context)
-
-        if not is_logs:
+        if not input_records_decoder.check_records_list_if_logs(records, context):
             raise Exception("Input not recognized as logs")
 
-        main.process_log_request(plaintext_records, context, read_batch_metadata(event))
-        result = TransformationResult.Ok
-
-    except CallThrottlingException:
-        log_multiline_message("Call Throttling Exception, Kinesis batch will be marked as OK, but some data is dropped",
-                              "call-throttling-exception")
-        result = TransformationResult.Ok
+        # records are decoded one by one, as the logs extracted from them are sent
+        plaintext_records = input_records_decoder.decode_records(records, context)
+        processes_count = transformation_processes.transformation_processes_count(len(records), context)
+        batch_metadata = event_source.read_batch_metadata(event, lambda_context)
+        results = main.process_log_request(plaintext_records, context, batch_metadata, processes_count)
 
     except Exception as e:
         log_error_with_stacktrace(e, "Exception caught in top-level handler",
                                   "top-level-handler-exception")
-        result = TransformationResult.ProcessingFailed
+        results = [TransformationResult.ProcessingFailed] * len(records)
+
+    for result, count in Counter(results).items():
+        context.sfm.records_with_result(result.name, count)
 
     try:
         context.sfm.push_sfm_to_cloudwatch()
@@ -67,7 +68,7 @@ def handler(event, lambda_context):
         log_error_with_stacktrace(e, "SelfMonitoring push to Cloudwatch failed",
                                    "sfm-push-exception")
 
-    return kinesis_data_transformation_response(records, result)
+    return event_source.response(records, results, context)
 
 
 def get_context(lambda_context):
@@ -78,56 +79,31 @@ def get_context(lambda_context):
     cloud_log_forwarder = os.environ.get('CLOUD_LOG_FORWARDER', "")
     max_log_content_length = \
         int(os.environ.get("MAX_LOG_CONTENT_LENGTH", DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH))
+    upload_concurrency = int(os.environ.get("UPLOAD_CONCURRENCY", DEFAULT_UPLOAD_CONCURRENCY))
+    decode_concurrency = int(os.environ.get("DECODE_CONCURRENCY", DEFAULT_DECODE_CONCURRENCY))
+    # chosen automatically when not set
+    configured_transformation_processes = int(os.environ["TRANSFORMATION_PROCESSES"]) \
+        if os.environ.get("TRANSFORMATION_PROCESSES") else None
+    use_gzip_compression = os.environ.get("USE_GZIP_COMPRESSION", "false") == "true"
+    gzip_compression_level = \
+        int(os.environ.get("GZIP_COMPRESSION_LEVEL", DEFAULT_GZIP_COMPRESSION_LEVEL)) if use_gzip_compression else None
+
+    minimal_firehose_response = os.environ.get("MINIMAL_FIREHOSE_RESPONSE", "false") == "true"
 
     ensure_credentials_provided(dt_token, dt_url)
 
     context = Context(function_name=lambda_context.function_name, dt_url=dt_url, dt_token=dt_token, debug=debug_flag,
                       verify_SSL=verify_SSL, cloud_log_forwarder=cloud_log_forwarder,
-                      max_log_content_length=max_log_content_length)
+                      max_log_content_length=max_log_content_length, upload_concurrency=upload_concurrency,
+                      gzip_compression_level=gzip_compression_level,
+                      get_remaining_time_in_millis=getattr(lambda_context, "get_remaining_time_in_millis", None),
+                      minimal_firehose_response=minimal_firehose_response, decode_concurrency=decode_concurrency,
+                      transformation_processes=configured_transformation_processes)
     return context
 
 
-def read_batch_metadata(event):
-    # example: arn:aws:firehose:us-east-1:444652832050:deliverystream/b-FirehoseLogStreams-lbcTAGyNE8hz
-    arn = event['deliveryStreamArn']
-    arn_parts = arn.split(':')
-
-    partition = arn_parts[1]
-    account_id = arn_parts[4]
-    region = event['region']
-
-    batch_metadata = BatchMetadata(account_id, region, partition)
-    return batch_metadata
-
-
 def ensure_credentials_provided(dt_token, dt_url):
     if not dt_url:
         raise Exception("DYNATRACE_ENV_URL not provided")
     if not dt_token:
         raise Exception("DYNATRACE_API_KEY not provided")
-
-
-class TransformationResult(Enum):
-    # Kinesis Firehose Data Transformation Result (per record)
-    Ok = 0
-    Dropped = 1
-    ProcessingFailed = 2
-
-
-def kinesis_data_transformation_response(input_records, result_for_all_records: TransformationResult):
-    print("Kinesis Data Transformation Result for all records is", result_for_all_records)
-
-    output_records = []
-
-    for input_record in input_records:
-        output_records.append(
-            {
-                "recordId": input_record["recordId"],
-                "result": result_for_all_records.name,
-                "data": input_record["data"],
-            }
-        )
-
-    return {
-        "records": output_records
-    }
@@ -0,0 +1,226 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Lambda events the forwarder can be invoked with. Each source reads records from its event in the shape of
+# Firehose records, which the rest of the forwarder works on:
+# {"recordId": ..., "approximateArrivalTimestamp": ms (optional), "data": base64 of gzipped CloudWatch Logs payload}
+# and answers the invocation in its own way, telling which records failed.
+
+import base64
+import json
+from collections import Counter
+from typing import Dict, List, Optional
+
+from logs.input_records_decoder import BadSchemaError
+from logs.models.batch_metadata import BatchMetadata
+from logs.models.transformation_result import TransformationResult
+from util.context import Context
+
+# returned instead of the original data of records successfully forwarded to Dynatrace, when enabled by
+# MINIMAL_FIREHOSE_RESPONSE - keeps the Lambda response and what Firehose backs up to S3 small
+FORWARDED_RECORD_PLACEHOLDER_DATA = base64.b64encode(b'{"forwarded_to_dynatrace":true}\n').decode()
+
+
+class RecordsProcessingFailedError(Exception):
+    # raised for sources which retry the whole invocation, as the only way to tell them it failed
+    pass
+
+
+class EventSource:
+    name = ""
+
+    def matches(self, event: Dict) -> bool:
+        raise NotImplementedError
+
+    def read_records(self, event: Dict) -> List[Dict]:
+        raise NotImplementedError
+
+    def read_batch_metadata(self, event: Dict, lambda_context) -> BatchMetadata:
+        raise NotImplementedError
+
+    def response(self, records: List[Dict], results: List[TransformationResult], context: Context):
+        raise NotImplementedError
+
+
+class FirehoseEventSource(EventSource):
+    # Firehose data transformation, every record is returned with its result (and data, for Firehose to back up
+    # the ones which failed)
+    name = "Firehose"
+
+    def matches(self, event):
+        return "records" in event
+
+    def read_records(self, event):
+        return event["records"]
+
+    def read_batch_metadata(self, event, lambda_context):
+        return read_batch_metadata(event)
+
+    def response(self, records, results, context):
+        return kinesis_data_transformation_response(records, results, context.minimal_firehose_response)
+
+
+class KinesisEventSource(EventSource):
+    # Kinesis Data Streams event source mapping, the stream being the destination of subscription filters.
+    # Failed records are reported with ReportBatchItemFailures, the stream is read again from the first of them.
+    name = "Kinesis Data Streams"
+
+    def matches(self, event):
+        return _records_event_source(event) == "aws:kinesis"
+
+    def read_records(self, event):
+        return [{
+            "recordId": record["kinesis"]["sequenceNumber"],
+            # in seconds, with a fraction
+            "approximateArrivalTimestamp": record["kinesis"]["approximateArrivalTimestamp"] * 1000,
+            "data": record["kinesis"]["data"],
+        } for record in event["Records"]]
+
+    def read_batch_metadata(self, event, lambda_context):
+        # example: arn:aws:kinesis:us-east-1:444652832050:stream/dynatrace-logs
+        return _read_batch_metadata_from_arn(event["Records"][0]["eventSourceARN"])
+
+    def response(self, records, results, context):
+        return batch_item_failures_response(records, results)
+
+
+class SqsEventSource(EventSource):
+    # SQS event source mapping, messages with the CloudWatch Logs payload as sent to a subscribed Lambda
+    # ({"awslogs": {"data": ...}}) or the base64 data only. Failed messages are reported with
+    # ReportBatchItemFailures and become visible in the queue again.
+    name = "SQS"
+
+    def matches(self, event):
+        return _records_event_source(event) == "aws:sqs"
+
+    def read_records(self, event):
+        return [{
+            "recordId": record["messageId"],
+            "approximateArrivalTimestamp": int(record["attributes"]["SentTimestamp"]),
+            "data": _read_sqs_message_data(record["body"]),
+        } for record in event["Records"]]
+
+    def read_batch_metadata(self, event, lambda_context):
+        # example: arn:aws:sqs:us-east-1:444652832050:dynatrace-logs
+        return _read_batch_metadata_from_arn(event["Records"][0]["eventSourceARN"])
+
+    def response(self, records, results, context):
+        return batch_item_failures_response(records, results)
+
+
+class CloudWatchLogsEventSource(EventSource):
+    # Lambda subscribed to log groups directly, invoked asynchronously with a single payload.
+    # There's no response to tell a failure with, so it's raised for Lambda to retry the invocation.
+    name = "CloudWatch Logs subscription"
+
+    def matches(self, event):
+        return "awslogs" in event
+
+    def read_records(self, event):
+        return [{"recordId": None, "data": event["awslogs"]["data"]}]
+
+    def read_batch_metadata(self, event, lambda_context):
+        # example: arn:aws:lambda:us-east-1:444652832050:function:dynatrace-aws-logs
+        return _read_batch_metadata_from_arn(lambda_context.invoked_function_arn)
+
+    def response(self, records, results, context):
+        if TransformationResult.ProcessingFailed in results:
+            raise RecordsProcessingFailedError("Logs failed to be processed, the invocation is to be retried")
+
+
+EVENT_SOURCES: List[EventSource] = [
+    FirehoseEventSource(),
+    KinesisEventSource(),
+    SqsEventSource(),
+    CloudWatchLogsEventSource(),
+]
+
+
+def find_event_source(event) -> EventSource:
+    for event_source in EVENT_SOURCES:
+        if event_source.matches(event):
+            print(f"Invoked with {event_source.name} event")
+            return event_source
+    raise BadSchemaError('records')
+
+
+def read_batch_metadata(event):
+    # example: arn:aws:firehose:us-east-1:444652832050:deliverystream/b-FirehoseLogStreams-lbcTAGyNE8hz
+    arn = event['deliveryStreamArn']
+    arn_parts = arn.split(':')
+
+    partition = arn_parts[1]
+    account_id = arn_parts[4]
+    region = event['region']
+
+    batch_metadata = BatchMetadata(account_id, region, partition)
+    return batch_metadata
+
+
+def kinesis_data_transformation_response(input_records, results: List[TransformationResult],
+                                         minimal_payload_for_forwarded: bool = False):
+    print("Kinesis Data Transformation Results:",
+          ", ".join(f"{result.name}: {count}" for result, count in Counter(results).items()))
+
+    output_records = []
+
+    for input_record, result in zip(input_records, results):
+        data = input_record["data"]
+        if minimal_payload_for_forwarded and result == TransformationResult.Ok:
+            data = FORWARDED_RECORD_PLACEHOLDER_DATA
+
+        output_records.append(
+            {
+                "recordId": input_record["recordId"],
+                "result": result.name,
+                "data": data,
+            }
+        )
+
+    return {
+        "records": output_records
+    }
+
+
+def batch_item_failures_response(input_records, results: List[TransformationResult]):
+    # partial batch response of event source mappings, dropped records (control messages) are done with
+    batch_item_failures = [{"itemIdentifier": input_record["recordId"]}
+                           for input_record, result in zip(input_records, results)
+                           if result == TransformationResult.ProcessingFailed]
+    print(f"Batch item failures: {len(batch_item_failures)} of {len(input_records)} records")
+    return {
+        "batchItemFailures": batch_item_failures
+    }
+
+
+def _records_event_source(event) -> Optional[str]:
+    records = event.get("Records")
+    if not records:
+        return None
+    return records[0].get("eventSource")
+
+
+def _read_batch_metadata_from_arn(arn: str) -> BatchMetadata:
+    arn_parts = arn.split(':')
+    return BatchMetadata(account_id=arn_parts[4], region=arn_parts[3], partition=arn_parts[1])
+
+
+def _read_sqs_message_data(body: str) -> str:
+    if body.lstrip().startswith("{"):
+        try:
+            return json.loads(body)["awslogs"]["data"]
+        except (ValueError, KeyError, TypeError):
+            # fails to decode as a record of its own
+            return body
+    return body
@@ -13,52 +13,114 @@
 #   limitations under the License.
 
 import base64
-import gzip
+import binascii
 import time
-from typing import Tuple, List
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
 from util.context import Context
 from util.logging import log_error_with_stacktrace
 
+# records decoded at the same time, 1 means one after another (still ahead of the transformation of records)
+DEFAULT_DECODE_CONCURRENCY = 1
+DECODE_AHEAD_RECORDS_PER_THREAD = 2
+# wbits for zlib reading gzip framing (header and trailer)
+GZIP_WBITS = 16 + zlib.MAX_WBITS
 
-def check_records_list_if_logs_end_decode(records, context: Context) -> Tuple[bool, List[str]]:
-    # returns: True, Records_list if content matches expected encoding
+
+def check_records_list_if_logs_end_decode(records, context: Context) -> Tuple[bool, List[Optional[bytes]]]:
+    # returns: True, Records_list if content matches expected encoding, with None for records which failed to decode
     # else returns: False, []
-    # we expect following structure: [{"data": "BASE64_GZIPPED_LOGS"}, {"data": "BASE64_GZIPPED..."}]
+    if not check_records_list_if_logs(records, context):
+        return False, []
+    return True, list(decode_records(records, context))
 
-    records_data = [record['data'] for record in records]
 
+def check_records_list_if_logs(records, context: Context) -> bool:
+    # we expect following structure: [{"data": "BASE64_GZIPPED_LOGS"}, {"data": "BASE64_GZIPPED..."}]
     sfm_report_kinesis_records_age(records, context)
 
-    if is_base64_with_gzip_header(records_data[0]):
+    if is_base64_with_gzip_header(records[0]['data']):
         print("Recognized gzip record based on first two bytes")
+        return True
+    return False
+
+
+def decode_records(records, context: Context) -> Iterator[Optional[bytes]]:
+    # decoded as consumed and in order, with None for records which failed to decode
+    if len(records) > 1:
+        yield from decode_records_concurrently(records, context)
+    else:
+        for record in records:
+            yield decode_and_unzip_single_record_data_or_none(record['data'], context)
+    print("Fully decoded logs payloads (base64 decode + ungzip)")
+
+
+def decode_records_concurrently(records, context: Context) -> Iterator[Optional[bytes]]:
+    # Records are decoded ahead by a pool of threads, zlib releases the GIL while decompressing. Only a few records
+    # per thread are decoded ahead of the one consumed, so memory stays bounded.
+    records_iterator = iter(records)
+    decoding_records = deque()
 
-        try:
-            records_data_plaintext = [
-                decode_and_unzip_single_record_data(record_data, context) for record_data in records_data
-            ]
-            print("Fully decoded logs payloads (base64 decode + ungzip)")
-            return True, records_data_plaintext
-        except Exception as e:
-            log_error_with_stacktrace(e, "Ungzip failed",
-                                      "ungzip-failed-exception")
-            return False, []
+    decode_concurrency = max(1, context.decode_concurrency)
+    with ThreadPoolExecutor(max_workers=decode_concurrency) as executor:
+        def decode_next_record():
+            record = next(records_iterator, None)
+            if record is not None:
+                decoding_records.append(
+                    executor.submit(decode_and_unzip_single_record_data_or_none, record['data'], context))
 
-    return False, []
+        for _ in range(decode_concurrency * DECODE_AHEAD_RECORDS_PER_THREAD):
+            decode_next_record()
 
+        while decoding_records:
+            decoded_record = decoding_records.popleft().result()
+            decode_next_record()
+            yield decoded_record
 
-def decode_and_unzip_single_record_data(record_data: str, context) -> str:
-    data_binary = base64.b64decode(record_data)
-    decoded_record_data = gzip.decompress(data_binary).decode("utf-8")
 
-    len_incoming = len(record_data.encode("UTF-8"))
-    len_decoded = len(decoded_record_data.encode("UTF-8"))
+def decode_and_unzip_single_record_data_or_none(record_data: str, context) -> Optional[bytes]:
+    # a single malformed record fails only itself, not the whole Firehose batch
+    try:
+        return decode_and_unzip_single_record_data(record_data, context)
+    except Exception as e:
+        context.sfm.issue("record_decoding_failed")
+        log_error_with_stacktrace(e, "Ungzip failed", "ungzip-failed-exception")
+        return None
+
+
+def decode_and_unzip_single_record_data(record_data: str, context) -> bytes:
+    # decoded record is kept as UTF-8 JSON bytes, json.loads takes them as they are
+    data_binary = binascii.a2b_base64(record_data)
+    decoded_record_data = gunzip(data_binary)
 
-    context.sfm.kinesis_record_decoded(len_incoming, len_decoded)
+    # base64 is ASCII, so the length of the string is its size in bytes
+    context.sfm.kinesis_record_decoded(len(record_data), len(decoded_record_data))
 
     return decoded_record_data
 
 
+def gunzip(data: bytes) -> bytes:
+    # same as gzip.decompress, which zlib alone is only for single-member data without padding
+    decompressed_members = []
+    while True:
+        decompressor = zlib.decompressobj(GZIP_WBITS)
+        decompressed_members.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+        # members can be followed by another one or zero padding
+        data = decompressor.unused_data.lstrip(b"\x00")
+        if not data:
+            break
+
+    if len(decompressed_members) == 1:
+        return decompressed_members[0]
+    return b"".join(decompressed_members)
+
+
 def is_base64_with_gzip_header(record_data: str) -> bool:
     if len(record_data) < 4:
         return False
@@ -75,7 +137,10 @@ def sfm_report_kinesis_records_age(records, context):
         timestamp_now_sec = time.time()
 
         for record in records:
-            kinesis_record_timestamp_ms = record['approximateArrivalTimestamp']
+            # not known for logs sent to the Lambda directly by CloudWatch Logs
+            kinesis_record_timestamp_ms = record.get('approximateArrivalTimestamp')
+            if kinesis_record_timestamp_ms is None:
+                continue
             kinesis_record_timestamp_sec = int(kinesis_record_timestamp_ms / 1000)
             age_sec = timestamp_now_sec - kinesis_record_timestamp_sec
             context.sfm.kinesis_record_age(age_sec)
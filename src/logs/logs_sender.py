@@ -13,14 +13,18 @@
 #   limitations under the License.
 
 import json
+import random
+import time
+import zlib
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Union
 
+from logs.models.log_entry import LogEntry, serialize_log_entry
 from util import http_client, logging
 from util.context import Context
 
-ENCODING = "utf-8"
-
 LOGS_API_PATH = "/api/v2/logs/ingest"
 
 DYNATRACE_LOG_INGEST_CONTENT_MARK_TRIMMED = "[TRUNCATED]"
@@ -30,20 +34,52 @@ DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE = 1048576  # 1MB
 DYNATRACE_LOG_INGEST_MAX_RECORD_AGE = 86340  # 1 day
 DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT = 5000
 
+# batches sent at the same time, 1 means one after another
+DEFAULT_UPLOAD_CONCURRENCY = 1
+# compression level used when gzip is enabled, favouring speed as logs JSON compresses well anyway
+DEFAULT_GZIP_COMPRESSION_LEVEL = 5
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY_SEC = 0.5
+RETRY_MAX_DELAY_SEC = 8
+# left after the last attempt for pushing SFM and returning the response to Firehose
+RETRY_SAFETY_MARGIN_MS = 5000
+# throttling and temporary unavailability, 413 is not here as sending the same payload again won't help
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+# wbits for zlib producing gzip framing (header and trailer) instead of zlib one
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
 @dataclass
 class Batch:
-    serialized_json: str
+    # encoded JSON array of the entries, handed to the HTTP client without copying
+    serialized_json: bytearray
     data_volume: int
     log_entries_count: int
+    # index of the batch's first entry in the list of logs it was prepared from
+    first_log_entry_index: int = 0
+
+
+@dataclass
+class DeliveryOutcome:
+    # batches which failed or were not sent at all, because an earlier one failed
+    undelivered_batches: List[Batch]
+    # raised for the first failed batch
+    exception: Optional[Exception] = None
+    # index of the first log entry not put into any batch, as batches are no longer prepared after a failure
+    unbatched_log_entries_start_index: Optional[int] = None
 
 
-def push_logs_to_dynatrace(logs: List[Dict], context: Context):
-    batches = prepare_batches(logs, context)
+def push_logs_to_dynatrace(logs: Iterable[Dict], context: Context):
+    delivery_outcome = deliver_logs_to_dynatrace(logs, context)
+    if delivery_outcome.exception is not None:
+        raise delivery_outcome.exception
 
-    print(f"Prepared {len(batches)} batches")
 
-    for batch in batches:
-        context.sfm.batch_prepared(batch.log_entries_count, batch.data_volume)
+def deliver_logs_to_dynatrace(logs: Iterable[Union[Dict, bytes]], context: Context) -> DeliveryOutcome:
+    # Same as push_logs_to_dynatrace, but tells which batches weren't delivered instead of raising.
+    # Logs are consumed as batches are sent, so only the batch being prepared and the ones being sent are kept
+    # in memory.
+    batches = generate_batches(logs, context)
 
     full_url = prepare_full_url(context.dt_url, LOGS_API_PATH)
     verify_SSL = context.verify_SSL
@@ -52,22 +88,175 @@ def push_logs_to_dynatrace(logs: List[Dict], context: Context):
         "Authorization": f"Api-Token {context.dt_token}",
         "Content-Type": "application/json; charset=utf-8",
     }
+    if context.gzip_compression_level is not None:
+        headers["Content-Encoding"] = "gzip"
+
+    # batches are sent from upload threads, also when sent one after another, so that sending a batch overlaps with
+    # decoding and transforming the records for the next one
+    return push_batches_concurrently(batches, full_url, headers, verify_SSL, context)
+
+
+def push_batches_concurrently(batches: Iterable[Batch], full_url, headers, verify_SSL: bool,
+                              context: Context) -> DeliveryOutcome:
+    # Same outcome as pushing one after another: no more batches are prepared once any batch failed,
+    # and the exception of the first failed batch is reported. Batches already in flight can't be stopped though.
+    # The next batch is prepared while the previous ones are sent, and started once one of them is done.
+    delivery_outcome = DeliveryOutcome([])
+    batches_in_flight: Dict[Future, Batch] = {}
+
+    def collect_finished(finished_futures):
+        for future in finished_futures:
+            batch = batches_in_flight.pop(future)
+            batch_exception = future.exception()
+            if batch_exception is not None:
+                delivery_outcome.undelivered_batches.append(batch)
+                if delivery_outcome.exception is None:
+                    delivery_outcome.exception = batch_exception
+
+    with ThreadPoolExecutor(max_workers=context.upload_concurrency) as executor:
+        for batch_index, batch in enumerate(batches):
+            collect_finished([future for future in batches_in_flight if future.done()])
+            if len(batches_in_flight) >= context.upload_concurrency:
+                collect_finished(wait(batches_in_flight, return_when=FIRST_COMPLETED).done)
+
+            if delivery_outcome.exception is not None:
+                delivery_outcome.undelivered_batches.append(batch)
+                delivery_outcome.unbatched_log_entries_start_index = \
+                    batch.first_log_entry_index + batch.log_entries_count
+                break
+
+            future = executor.submit(push_batch, batch, batch_index, full_url, headers, verify_SSL, context)
+            batches_in_flight[future] = batch
+
+        collect_finished(wait(batches_in_flight).done)
+
+    return delivery_outcome
+
+
+def push_batch(batch: Batch, batch_index: int, full_url, headers, verify_SSL: bool, context: Context):
+    print(f"Pushing batch {batch_index + 1} with {batch.log_entries_count} log entries")
+    deliver_batch(batch, full_url, headers, verify_SSL, context)
+
+
+def deliver_batch(batch: Batch, full_url, headers, verify_SSL: bool, context: Context):
+    request_body = batch.serialized_json
+    if context.gzip_compression_level is not None:
+        # request size limit applies to the uncompressed payload, it's already ensured when preparing batches
+        uncompressed_size = len(request_body)
+        request_body = gzip_compress(request_body, context.gzip_compression_level)
+        context.sfm.request_body_compressed(uncompressed_size, len(request_body))
+
+    resp_status = send_with_retries(full_url, request_body, headers, verify_SSL, context)
+
+    if resp_status == 413:
+        # the tenant may accept smaller requests than DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE, halves are sent instead
+        if batch.log_entries_count > 1:
+            context.sfm.batch_split()
+            for half_batch in split_batch(batch):
+                deliver_batch(half_batch, full_url, headers, verify_SSL, context)
+        else:
+            context.sfm.issue("log_entry_too_large_dropped")
+            logging.log_multiline_message(f"Dropping entry of size {batch.data_volume}, rejected by DT API "
+                                          f"with status code {resp_status}", "entry-rejected-too-large")
+        return
+
+    if resp_status == 429:
+        context.sfm.issue("throttle_response_code")
+        raise CallThrottlingException(f"DT API throttling response, status code {resp_status}")
+    elif resp_status > 299:
+        context.sfm.issue("bad_response_code")
+        raise CallOtherException(f"DT API bad response, status code {resp_status}")
+
+    context.sfm.batch_delivered(batch.log_entries_count, batch.data_volume)
+
+
+def split_batch(batch: Batch) -> List[Batch]:
+    # only done for rejected batches, so entries are deserialized again instead of being kept with every batch
+    log_entries = json.loads(batch.serialized_json)
+    half = len(log_entries) // 2
+    return [serialize_batch(log_entries[:half], batch.first_log_entry_index),
+            serialize_batch(log_entries[half:], batch.first_log_entry_index + half)]
+
+
+def serialize_batch(log_entries: List[Dict], first_log_entry_index: int = 0) -> Batch:
+    batch_buffer = bytearray(b"[")
+    batch_buffer += b",".join(serialize_log_entry(log_entry) for log_entry in log_entries)
+    return _close_batch(batch_buffer, len(log_entries), first_log_entry_index)
+
+
+def send_with_retries(full_url, request_body: Union[bytes, bytearray], headers, verify_SSL: bool,
+                      context: Context) -> int:
+    # Retries throttled, unavailable and failed requests with exponential backoff (or as long as the server asked for
+    # in Retry-After), as long as the attempt can still finish within the Lambda time limit.
+    # Returns the last response status code, or raises the last exception if no response was received at all.
+    attempt = 1
+    while True:
+        try:
+            resp_status, _resp_body, resp_headers = http_client.perform_http_request_for_json(
+                full_url, request_body, "POST", headers, verify_SSL, context
+            )
+            request_exception = None
+        except Exception as e:
+            resp_status, resp_headers, request_exception = None, {}, e
+
+        if request_exception is None and resp_status not in RETRYABLE_STATUS_CODES:
+            return resp_status
+
+        retry_reason = str(resp_status) if request_exception is None else "request_failed_without_status_code"
+        delay_sec = get_retry_delay_sec(attempt, resp_headers.get("Retry-After"))
+
+        if attempt >= RETRY_MAX_ATTEMPTS:
+            context.sfm.issue("retries_exhausted")
+        elif not retry_fits_in_remaining_time(delay_sec, context):
+            context.sfm.issue("retry_exceeding_remaining_time")
+        else:
+            context.sfm.request_retried(retry_reason, delay_sec)
+            logging.log_multiline_message(f"Request attempt {attempt} failed ({retry_reason}), "
+                                          f"retrying in {delay_sec:.2f}s", "request-retry")
+            time.sleep(delay_sec)
+            attempt += 1
+            continue
+
+        if request_exception is not None:
+            raise request_exception
+        return resp_status
+
+
+def get_retry_delay_sec(attempt: int, retry_after: Optional[str]) -> float:
+    retry_after_sec = parse_retry_after_sec(retry_after)
+    if retry_after_sec is not None:
+        return retry_after_sec
 
-    for i, batch in enumerate(batches):
-        print(f"Pushing batch {i + 1} out of {len(batches)}")
+    # exponential backoff with jitter, so retries from many concurrent invocations get spread over time
+    backoff_sec = min(RETRY_MAX_DELAY_SEC, RETRY_BASE_DELAY_SEC * 2 ** (attempt - 1))
+    return backoff_sec / 2 + random.uniform(0, backoff_sec / 2)
 
-        resp_status, _resp_body = http_client.perform_http_request_for_json(
-            full_url, batch.serialized_json.encode(ENCODING), "POST", headers, verify_SSL, context
-        )
 
-        if resp_status == 413 or resp_status == 429:
-            context.sfm.issue("throttle_response_code")
-            raise CallThrottlingException(f"DT API throttling response, status code {resp_status}")
-        elif resp_status > 299:
-            context.sfm.issue("bad_response_code")
-            raise CallOtherException(f"DT API bad response, status code {resp_status}")
+def parse_retry_after_sec(retry_after: Optional[str]) -> Optional[float]:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
 
-        context.sfm.batch_delivered(batch.log_entries_count, batch.data_volume)
+
+def retry_fits_in_remaining_time(delay_sec: float, context: Context) -> bool:
+    if context.get_remaining_time_in_millis is None:
+        return True
+    # the retried request may take up to the full timeout
+    required_ms = (delay_sec + http_client.TIMEOUT_SEC) * 1000 + RETRY_SAFETY_MARGIN_MS
+    return context.get_remaining_time_in_millis() >= required_ms
+
+
+def gzip_compress(data: bytes, compression_level: int) -> bytes:
+    compressor = zlib.compressobj(compression_level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
 
 
 def prepare_full_url(dynatrace_url, path):
@@ -83,24 +272,29 @@ def prepare_full_url(dynatrace_url, path):
     return dynatrace_url + path
 
 
-def prepare_batches(logs: List[Dict], context: Context) -> List[Batch]:
-    batches: List[Batch] = []
+def prepare_batches(logs: Iterable[Dict], context: Context) -> List[Batch]:
+    return list(generate_batches(logs, context))
 
-    logs_for_next_batch: List[str] = []
-    logs_for_next_batch_total_len = 0
 
-    new_batch_len = 0
+def generate_batches(logs: Iterable[Union[Dict, bytes]], context: Context) -> Iterator[Batch]:
+    # Every entry is serialized and encoded once, straight into the buffer of its batch, which is then sent as is.
+    # Batches are prepared as logs are consumed, the next one only when asked for.
+    batches_count = 0
 
-    for log_entry in logs:
-        brackets_len = 2
-        commas_len = len(logs_for_next_batch) - 1
+    batch_buffer = bytearray(b"[")
+    batch_entries_count = 0
+    batch_first_log_entry_index = 0
 
-        new_batch_len = logs_for_next_batch_total_len + brackets_len + commas_len
-
-        ensure_fields_length(log_entry, context)
+    for log_entry_index, log_entry in enumerate(logs):
+        if isinstance(log_entry, bytes):
+            # already trimmed and serialized in a transformation process
+            next_entry_serialized = log_entry
+        else:
+            ensure_fields_length(log_entry, context)
+            next_entry_serialized = serialize_log_entry(log_entry)
 
-        next_entry_serialized = json.dumps(log_entry)
-        next_entry_serialized_len = len(next_entry_serialized.encode(ENCODING))
+        # size of the encoded entry, as the content passed through from the record can have non-ASCII characters
+        next_entry_serialized_len = len(next_entry_serialized)
 
         if next_entry_serialized_len > DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE:
             # shouldn't happen as we are already truncating the content field, but just for safety
@@ -108,27 +302,42 @@ def prepare_batches(logs: List[Dict], context: Context) -> List[Batch]:
                                           f"bigger than max entry size: {DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE}",
                                           "entry-bigger-than-max-size")
 
-        batch_length_if_added_entry = new_batch_len + 1 + next_entry_serialized_len  # +1 is for comma
-        batch_entries_if_added_entry = len(logs_for_next_batch) + 1
+        comma_len = 1 if batch_entries_count else 0
+        closing_bracket_len = 1
+        batch_length_if_added_entry = len(batch_buffer) + comma_len + next_entry_serialized_len + closing_bracket_len
+        batch_entries_if_added_entry = batch_entries_count + 1
 
-        if batch_length_if_added_entry > DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE or \
-                batch_entries_if_added_entry > DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT:
+        if batch_entries_count and (batch_length_if_added_entry > DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE or
+                                    batch_entries_if_added_entry > DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT):
             # would overflow limit, close batch and prepare new
-            serialized_batch = "[" + ",".join(logs_for_next_batch) + "]"
-            batches.append(Batch(serialized_batch, new_batch_len, len(logs_for_next_batch)))
+            yield _prepared_batch(_close_batch(batch_buffer, batch_entries_count, batch_first_log_entry_index), context)
+            batches_count += 1
 
-            logs_for_next_batch = []
-            logs_for_next_batch_total_len = 0
+            batch_buffer = bytearray(b"[")
+            batch_entries_count = 0
+            batch_first_log_entry_index = log_entry_index
 
-        logs_for_next_batch.append(next_entry_serialized)
-        logs_for_next_batch_total_len += next_entry_serialized_len
+        if batch_entries_count:
+            batch_buffer += b","
+        batch_buffer += next_entry_serialized
+        batch_entries_count += 1
 
-    if len(logs_for_next_batch) >= 1:
+    if batch_entries_count >= 1:
         # finalize last batch
-        serialized_batch = "[" + ",".join(logs_for_next_batch) + "]"
-        batches.append(Batch(serialized_batch, new_batch_len, len(logs_for_next_batch)))
+        yield _prepared_batch(_close_batch(batch_buffer, batch_entries_count, batch_first_log_entry_index), context)
+        batches_count += 1
+
+    print(f"Prepared {batches_count} batches")
+
+
+def _prepared_batch(batch: Batch, context: Context) -> Batch:
+    context.sfm.batch_prepared(batch.log_entries_count, batch.data_volume)
+    return batch
+
 
-    return batches
+def _close_batch(batch_buffer: bytearray, entries_count: int, first_log_entry_index: int) -> Batch:
+    batch_buffer += b"]"
+    return Batch(batch_buffer, len(batch_buffer), entries_count, first_log_entry_index)
 
 
 def ensure_fields_length(log_entry, context):
@@ -157,6 +366,9 @@ def ensure_attribute_length(log_entry, key, value, context):
     if attribute_value_len > DYNATRACE_LOG_INGEST_ATTRIBUTE_MAX_LENGTH:
         context.sfm.log_attr_trimmed()
         log_entry[key] = value[0: DYNATRACE_LOG_INGEST_ATTRIBUTE_MAX_LENGTH]
+        if isinstance(log_entry, LogEntry):
+            # the trimmed value differs from the one serialized for all entries from the record
+            log_entry.record_attributes = None
 
 
 class CallThrottlingException(Exception):
@@ -11,49 +11,147 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
-import statistics
 import time
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
-from logs.logs_sender import push_logs_to_dynatrace
+from logs.logs_sender import DeliveryOutcome, deliver_logs_to_dynatrace
 from logs.models.batch_metadata import BatchMetadata
+from logs.models.transformation_result import TransformationResult
 from logs.transformation import extract_dt_logs_from_single_record
+from logs.transformation_processes import TransformedRecord, transform_records_in_processes
+from util import lru_cache
 from util.context import Context
-from util.logging import debug_log_multiline_message
+from util.logging import debug_log_multiline_message, log_error_with_stacktrace, log_multiline_message
 
 
-def process_log_request(decoded_records: List[str], context: Context, batch_metadata: BatchMetadata):
-    all_logs: List[Dict] = []
+def process_log_request(decoded_records: Iterable[Optional[bytes]], context: Context,
+                        batch_metadata: BatchMetadata, transformation_processes: int = 1) -> List[TransformationResult]:
+    # Returns the result for each record, decoded records are None for the ones which failed to decode.
+    # Records are transformed one by one as their logs are batched and sent, so memory used doesn't depend on the
+    # number of records, apart from the results. With more than one transformation process, records are transformed
+    # in worker processes, a few at a time.
+    records_results: List[TransformationResult] = []
+    # [first, last + 1) indices of entries extracted from the record, in all logs sent
+    records_logs_ranges: List[Tuple[int, int]] = []
+    logs_timestamps_statistics = LogsTimestampsStatistics()
 
-    for record in decoded_records:
-        all_logs.extend(extract_dt_logs_from_single_record(record, batch_metadata, context))
+    if transformation_processes > 1:
+        transformed_records = transform_records_in_processes(decoded_records, batch_metadata, context,
+                                                             transformation_processes)
+    else:
+        transformed_records = transform_records(decoded_records, batch_metadata, context)
 
-    print(f"Extracted {len(all_logs)} log entries from {len(decoded_records)} records given")
+    def extract_logs_from_records() -> Iterator[Union[Dict, bytes]]:
+        logs_count = 0
+        for logs, logs_timestamps in transformed_records:
+            if logs is None:
+                records_results.append(TransformationResult.ProcessingFailed)
+            elif not logs:
+                # control messages carry no log events
+                records_results.append(TransformationResult.Dropped)
+            else:
+                records_results.append(TransformationResult.Ok)
 
-    debug_log_multiline_message("Log entries to be sent to DT: " + str(all_logs), context,
-                                "logs-send-details")
+            record_logs = logs or []
+            records_logs_ranges.append((logs_count, logs_count + len(record_logs)))
+            logs_count += len(record_logs)
 
-    sfm_report_logs_age(all_logs, context)
+            debug_log_multiline_message("Log entries to be sent to DT: " + str(record_logs), context,
+                                        "logs-send-details")
+            logs_timestamps_statistics.add(logs_timestamps)
 
-    push_logs_to_dynatrace(all_logs, context)
+            yield from record_logs
 
+        print(f"Extracted {logs_count} log entries from {len(records_results)} records given")
 
-def sfm_report_logs_age(logs, context):
-    timestamp_now_ms = round(time.time() * 1000)
+    logs_to_send = extract_logs_from_records()
+    delivery_outcome = deliver_logs_to_dynatrace(logs_to_send, context)
 
-    log_ages_sec = []
+    if delivery_outcome.exception is not None:
+        log_multiline_message(f"Delivery of {len(delivery_outcome.undelivered_batches)} batches failed: "
+                              f"'{delivery_outcome.exception}', records with entries in them failed processing",
+                              "batches-delivery-failed")
 
-    for log in logs:
-        try:
-            log_timestamp_ms = log['timestamp']
-            log_age_ms = int(timestamp_now_ms) - log_timestamp_ms
-            log_age_sec = log_age_ms / 1000
-            log_ages_sec.append(log_age_sec)
-        except Exception:
+        # logs after the failure are no longer sent, the records are still transformed to tell their results
+        for _ in logs_to_send:
             pass
 
-    if len(log_ages_sec) >= 1:
-        log_age_min = min(log_ages_sec)
-        log_age_avg = statistics.mean(log_ages_sec)
-        log_age_max = max(log_ages_sec)
+        fail_records_with_undelivered_logs(records_results, records_logs_ranges, delivery_outcome)
+
+    logs_timestamps_statistics.report_logs_age(context)
+    sfm_report_caches_statistics(context)
+
+    return records_results
+
+
+def fail_records_with_undelivered_logs(records_results: List[TransformationResult],
+                                       records_logs_ranges: List[Tuple[int, int]], delivery_outcome: DeliveryOutcome):
+    logs_count = records_logs_ranges[-1][1] if records_logs_ranges else 0
+    undelivered_logs = bytearray(logs_count)
+    for batch in delivery_outcome.undelivered_batches:
+        batch_logs_end = batch.first_log_entry_index + batch.log_entries_count
+        undelivered_logs[batch.first_log_entry_index:batch_logs_end] = b"\x01" * batch.log_entries_count
+    if delivery_outcome.unbatched_log_entries_start_index is not None:
+        unbatched_start = delivery_outcome.unbatched_log_entries_start_index
+        undelivered_logs[unbatched_start:] = b"\x01" * (logs_count - unbatched_start)
+
+    for record_index, (logs_start, logs_end) in enumerate(records_logs_ranges):
+        if undelivered_logs.find(1, logs_start, logs_end) != -1:
+            records_results[record_index] = TransformationResult.ProcessingFailed
+
+
+def transform_records(decoded_records: Iterable[Optional[bytes]], batch_metadata: BatchMetadata,
+                      context: Context) -> Iterator[TransformedRecord]:
+    for record in decoded_records:
+        logs = extract_dt_logs_from_single_record_or_none(record, batch_metadata, context)
+        yield TransformedRecord(logs, [log.get('timestamp') for log in logs or []])
+
+
+def extract_dt_logs_from_single_record_or_none(record: Optional[bytes], batch_metadata: BatchMetadata,
+                                                context: Context) -> Optional[List[Dict]]:
+    if record is None:
+        return None
+    try:
+        return extract_dt_logs_from_single_record(record, batch_metadata, context)
+    except Exception as e:
+        context.sfm.issue("record_transformation_failed")
+        log_error_with_stacktrace(e, "Failed to extract log entries from record", "record-transformation-exception")
+        return None
+
+
+class LogsTimestampsStatistics:
+    # timestamps of logs gathered as they are processed, for the logs age reported once all are sent
+
+    def __init__(self):
+        self.min_timestamp_ms = None
+        self.max_timestamp_ms = None
+        self.timestamps_sum_ms = 0
+        self.timestamps_count = 0
+
+    def add(self, logs_timestamps: List):
+        for log_timestamp_ms in logs_timestamps:
+            if type(log_timestamp_ms) not in (int, float):
+                continue
+            if self.timestamps_count == 0:
+                self.min_timestamp_ms = self.max_timestamp_ms = log_timestamp_ms
+            else:
+                self.min_timestamp_ms = min(self.min_timestamp_ms, log_timestamp_ms)
+                self.max_timestamp_ms = max(self.max_timestamp_ms, log_timestamp_ms)
+            self.timestamps_sum_ms += log_timestamp_ms
+            self.timestamps_count += 1
+
+    def report_logs_age(self, context):
+        if self.timestamps_count == 0:
+            return
+        timestamp_now_ms = round(time.time() * 1000)
+        log_age_min = (timestamp_now_ms - self.max_timestamp_ms) / 1000
+        log_age_avg = (timestamp_now_ms - self.timestamps_sum_ms / self.timestamps_count) / 1000
+        log_age_max = (timestamp_now_ms - self.min_timestamp_ms) / 1000
         context.sfm.logs_age(log_age_min, log_age_avg, log_age_max)
+
+
+def sfm_report_caches_statistics(context):
+    for cache in lru_cache.all_caches():
+        hits, misses = cache.pop_statistics()
+        if hits or misses:
+            context.sfm.cache_statistics(cache.name, hits, misses)
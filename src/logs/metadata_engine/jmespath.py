@@ -20,6 +20,12 @@ import jmespath
 from jmespath import functions
 
 from logs.metadata_engine import me_id
+from util.lru_cache import LruCache
+
+REPLACE_REGEX_CACHE_MAX_SIZE = 1024
+
+# compiled regex and processed replacement by (regex, replacement) given to replace_regex
+replace_regex_cache = LruCache("jmespath_replace_regex", REPLACE_REGEX_CACHE_MAX_SIZE)
 
 def format_required(pattern, values):
     if values == None or None in values:
@@ -39,15 +45,19 @@ def format(pattern, values):
             output = output.replace("{}", value, 1)
     return output
 
+def _compile_regex_replacement(regex, replacement):
+    # replace java capture group sign ($) to python one (\)
+    processed_replacement = re.sub(r'\$(\d+)+', '\\\\\\1', replacement)
+    return re.compile(regex), processed_replacement
+
 class MappingCustomFunctions(functions.Functions):
 
     @functions.signature({'types': ['string', 'null']},
                          {'types': ['string', 'null']},
                          {'types': ['string', 'null']})
     def _func_replace_regex(self, subject, regex, replacement):
-        # replace java capture group sign ($) to python one (\)
-        processed_replacement = re.sub(r'\$(\d+)+', '\\\\\\1', replacement)
-        compiled_regex = re.compile(regex)
+        compiled_regex, processed_replacement = replace_regex_cache.get_or_compute(
+            (regex, replacement), lambda: _compile_regex_replacement(regex, replacement))
         result = compiled_regex.sub(processed_replacement, subject)
         return result
 
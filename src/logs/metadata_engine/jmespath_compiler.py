@@ -0,0 +1,304 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Compiles parsed JMESPath expressions into plain Python closures, replicating the behaviour of
+# jmespath.visitor.TreeInterpreter (including function argument type checks) without walking the tree on every call.
+# Expressions using anything not supported here are left to the interpreter.
+
+from typing import Any, Callable, Dict, Optional
+
+from jmespath import exceptions, functions
+from jmespath.visitor import TreeInterpreter, _equals, _is_comparable
+
+Closure = Callable[[Any], Any]
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+def compile_expression(parsed: Dict, custom_functions: functions.Functions) -> Optional[Closure]:
+    try:
+        return _ExpressionCompiler(custom_functions).compile(parsed)
+    except UnsupportedExpression:
+        return None
+
+
+def _is_false(value) -> bool:
+    # same as in TreeInterpreter, truth values in jmespath differ from the python ones
+    return value == '' or value == [] or value == {} or value is None or value is False
+
+
+class _ExpressionCompiler:
+
+    def __init__(self, custom_functions: functions.Functions):
+        self._functions = custom_functions
+
+    def compile(self, node: Dict) -> Closure:
+        method = getattr(self, f"_compile_{node['type']}", None)
+        if method is None:
+            raise UnsupportedExpression(node['type'])
+        return method(node)
+
+    @staticmethod
+    def _compile_field(node):
+        name = node['value']
+
+        def field(value):
+            try:
+                return value.get(name)
+            except AttributeError:
+                return None
+        return field
+
+    def _compile_chain(self, node):
+        compiled_children = [self.compile(child) for child in node['children']]
+        if len(compiled_children) == 2:
+            first, second = compiled_children
+            return lambda value: second(first(value))
+
+        def chain(value):
+            for child in compiled_children:
+                value = child(value)
+            return value
+        return chain
+
+    _compile_subexpression = _compile_chain
+    _compile_index_expression = _compile_chain
+    _compile_pipe = _compile_chain
+
+    @staticmethod
+    def _compile_literal(node):
+        literal = node['value']
+        return lambda value: literal
+
+    @staticmethod
+    def _compile_current(_node):
+        return lambda value: value
+
+    _compile_identity = _compile_current
+
+    @staticmethod
+    def _compile_index(node):
+        index = node['value']
+
+        def index_(value):
+            if not isinstance(value, list):
+                return None
+            try:
+                return value[index]
+            except IndexError:
+                return None
+        return index_
+
+    @staticmethod
+    def _compile_slice(node):
+        slice_ = slice(*node['children'])
+
+        def slice_values(value):
+            if not isinstance(value, list):
+                return None
+            return value[slice_]
+        return slice_values
+
+    def _compile_comparator(self, node):
+        left, right = [self.compile(child) for child in node['children']]
+        operator = node['value']
+        if operator == 'eq':
+            return lambda value: _equals(left(value), right(value))
+        if operator == 'ne':
+            return lambda value: not _equals(left(value), right(value))
+
+        comparator_function = TreeInterpreter.COMPARATOR_FUNC[operator]
+
+        def ordering_comparator(value):
+            left_value = left(value)
+            right_value = right(value)
+            if not (_is_comparable(left_value) and _is_comparable(right_value)):
+                return None
+            return comparator_function(left_value, right_value)
+        return ordering_comparator
+
+    def _compile_multi_select_list(self, node):
+        compiled_children = [self.compile(child) for child in node['children']]
+
+        def multi_select_list(value):
+            if value is None:
+                return None
+            return [child(value) for child in compiled_children]
+        return multi_select_list
+
+    def _compile_multi_select_dict(self, node):
+        compiled_children = [(child['value'], self.compile(child['children'][0])) for child in node['children']]
+
+        def multi_select_dict(value):
+            if value is None:
+                return None
+            return {key: child(value) for key, child in compiled_children}
+        return multi_select_dict
+
+    def _compile_projection(self, node):
+        base, projected = [self.compile(child) for child in node['children']]
+
+        def projection(value):
+            base_value = base(value)
+            if not isinstance(base_value, list):
+                return None
+            return [current for current in map(projected, base_value) if current is not None]
+        return projection
+
+    def _compile_value_projection(self, node):
+        base, projected = [self.compile(child) for child in node['children']]
+
+        def value_projection(value):
+            try:
+                base_values = base(value).values()
+            except AttributeError:
+                return None
+            return [current for current in map(projected, base_values) if current is not None]
+        return value_projection
+
+    def _compile_filter_projection(self, node):
+        base, projected, condition = [self.compile(child) for child in node['children']]
+
+        def filter_projection(value):
+            base_value = base(value)
+            if not isinstance(base_value, list):
+                return None
+            collected = []
+            for element in base_value:
+                if not _is_false(condition(element)):
+                    current = projected(element)
+                    if current is not None:
+                        collected.append(current)
+            return collected
+        return filter_projection
+
+    def _compile_flatten(self, node):
+        base = self.compile(node['children'][0])
+
+        def flatten(value):
+            base_value = base(value)
+            if not isinstance(base_value, list):
+                return None
+            merged = []
+            for element in base_value:
+                if isinstance(element, list):
+                    merged.extend(element)
+                else:
+                    merged.append(element)
+            return merged
+        return flatten
+
+    def _compile_or_expression(self, node):
+        left, right = [self.compile(child) for child in node['children']]
+
+        def or_expression(value):
+            matched = left(value)
+            if _is_false(matched):
+                matched = right(value)
+            return matched
+        return or_expression
+
+    def _compile_and_expression(self, node):
+        left, right = [self.compile(child) for child in node['children']]
+
+        def and_expression(value):
+            matched = left(value)
+            if _is_false(matched):
+                return matched
+            return right(value)
+        return and_expression
+
+    def _compile_not_expression(self, node):
+        child = self.compile(node['children'][0])
+
+        def not_expression(value):
+            original = child(value)
+            # exactly int, bool is excluded as in TreeInterpreter
+            if type(original) is int and original == 0:  # pylint: disable=unidiomatic-typecheck
+                return False
+            return not original
+        return not_expression
+
+    def _compile_function_expression(self, node):
+        name = node['value']
+        spec = self._functions.FUNCTION_TABLE.get(name)
+        if spec is None:
+            raise UnsupportedExpression(name)
+
+        signature = spec['signature']
+        arguments = node['children']
+        if (signature and signature[-1].get('variadic')) or len(arguments) != len(signature):
+            # arity errors are left to the interpreter
+            raise UnsupportedExpression(name)
+
+        if name == 'if':
+            return self._compile_if(arguments)
+
+        function = spec['function']
+        compiled_arguments = [self.compile(argument) for argument in arguments]
+        type_checks = [_compile_type_check(self._functions, name, argument_spec['types'])
+                       for argument_spec in signature]
+        custom_functions = self._functions
+
+        def function_call(value):
+            resolved_arguments = [argument(value) for argument in compiled_arguments]
+            for type_check, resolved_argument in zip(type_checks, resolved_arguments):
+                if type_check:
+                    type_check(resolved_argument)
+            return function(custom_functions, *resolved_arguments)
+        return function_call
+
+    def _compile_if(self, arguments):
+        # custom if(condition, &when_true, &when_false, scope) - expression references are evaluated against scope
+        condition_node, when_true_node, when_false_node, scope_node = arguments
+        if when_true_node['type'] != 'expref' or when_false_node['type'] != 'expref':
+            raise UnsupportedExpression('if')
+
+        condition = self.compile(condition_node)
+        when_true = self.compile(when_true_node['children'][0])
+        when_false = self.compile(when_false_node['children'][0])
+        scope = self.compile(scope_node)
+
+        def if_(value):
+            if condition(value):
+                return when_true(scope(value))
+            return when_false(scope(value))
+        return if_
+
+
+def _compile_type_check(custom_functions: functions.Functions, function_name,
+                        types) -> Optional[Callable[[Any], None]]:
+    # the type checks of jmespath.functions.Functions are private API, used only here so that compiled functions
+    # fail exactly as interpreted ones (jmespath version pinned in requirements.txt)
+    # pylint: disable=protected-access
+    if not types:
+        return None
+    if 'expref' in types:
+        # expression references are supported only in if()
+        raise UnsupportedExpression(function_name)
+
+    allowed_types, allowed_subtypes = custom_functions._get_allowed_pytypes(types)
+    if allowed_subtypes:
+        return lambda argument: custom_functions._type_check_single(argument, types, function_name)
+
+    allowed_type_names = frozenset(allowed_types)
+
+    def type_check(argument):
+        actual_type_name = type(argument).__name__
+        if actual_type_name not in allowed_type_names:
+            raise exceptions.JMESPathTypeError(function_name, argument,
+                                               custom_functions._convert_to_jmespath_type(actual_type_name), types)
+    return type_check
@@ -12,39 +12,49 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
-import ctypes
 import hashlib
 import struct
+from typing import List
 
-int64 = ctypes.c_int64
+from util.lru_cache import LruCache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MEID_CACHE_MAX_SIZE = 4096
+MURMURHASH_DEFAULT_SEED = 0xe17a1465
+#APM-226544: 0xe17a1465 as default but with casting to int used
+MURMURHASH_AWS_SEED = -512093083
+
+# entity ids by (entity type, hashing input, seed), seed is None for md5 based ids
+meid_cache = LruCache("me_id", MEID_CACHE_MAX_SIZE)
 
 
 def meid_md5(entity_type: str, hashing_input: str):
     if hashing_input is None:
         return None
 
-    long_id = _legacy_entity_id_md5(hashing_input)
-    identifier = _encode_me_identifier(entity_type, long_id)
-    return identifier
+    return meid_cache.get_or_compute(
+        (entity_type, hashing_input, None),
+        lambda: _encode_me_identifier(entity_type, _legacy_entity_id_md5(hashing_input)))
 
 
 def meid_murmurhash(entity_type: str, hashing_input: str) -> str:
-    if hashing_input is None:
-        return None
-
-    long_id = _murmurhash2_64A(hashing_input)
-    identifier = _encode_me_identifier(entity_type, long_id)
-    return identifier
+    return _meid_murmurhash_with_seed(entity_type, hashing_input, MURMURHASH_DEFAULT_SEED)
 
 def meid_murmurhash_awsseed(entity_type: str, hashing_input: str) -> str:
+    return _meid_murmurhash_with_seed(entity_type, hashing_input, MURMURHASH_AWS_SEED)
+
+
+def _meid_murmurhash_with_seed(entity_type: str, hashing_input: str, seed: int) -> str:
     if hashing_input is None:
         return None
 
-    #APM-226544: 0xe17a1465 as default but with casting to int used
-    long_id = _murmurhash2_64A(hashing_input, seed = -512093083)
-
-    identifier = _encode_me_identifier(entity_type, long_id)
-    return identifier
+    return meid_cache.get_or_compute(
+        (entity_type, hashing_input, seed),
+        lambda: _encode_me_identifier(entity_type, _murmurhash2_64A(hashing_input, seed=seed)))
 
 
 def _legacy_entity_id_md5(hash_input: str) -> int:
@@ -57,57 +67,82 @@ def _legacy_entity_id_md5(hash_input: str) -> int:
     return l1 ^ l2
 
 
-def _zfrs(num, shift):
-    # Zero fill right shift.
-    return int64((num & 0xFFFFFFFFFFFFFFFF) >> shift).value
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+_MURMURHASH_M = 0xc6a4a7935bd1e995
+_MURMURHASH_R = 47
+
 
+def _to_signed_64(num: int) -> int:
+    return num - 0x10000000000000000 if num & 0x8000000000000000 else num
 
-def _murmurhash2_64A(data: str, seed=0xe17a1465) -> int:
+
+def _murmurhash2_64A(data: str, seed=MURMURHASH_DEFAULT_SEED) -> int:
+    # arithmetic on unsigned 64 bit values (masked python ints), converted to signed long only for the result
     assert data is not None
 
-    buf = bytearray(data.encode("UTF-8"))
-    m = int64(0xc6a4a7935bd1e995).value
-    r = 47
-    offset = 0
+    buf = data.encode("UTF-8")
+    m = _MURMURHASH_M
+    r = _MURMURHASH_R
     length = len(buf)
+    blocks_length = length & ~7
+
+    h = (seed ^ (length * m)) & _MASK_64
+
+    for (k,) in struct.iter_unpack('<Q', buf[:blocks_length]):
+        k = (k * m) & _MASK_64
+        k ^= k >> r
+        k = (k * m) & _MASK_64
+
+        h ^= k
+        h = (h * m) & _MASK_64
+
+    if length > blocks_length:
+        h ^= int.from_bytes(buf[blocks_length:], "little")
+        h = (h * m) & _MASK_64
 
-    h = int64(seed ^ ((length - offset) * m)).value
+    h ^= h >> r
+    h = (h * m) & _MASK_64
+    h ^= h >> r
+    return _to_signed_64(h)
 
-    k = 0
 
-    while (length - offset) >= 8:
-        k = struct.unpack_from('<q', buf, offset)[0]
-        offset += 8
+def murmurhash2_64A_batch(data_list: List[str], seed=MURMURHASH_DEFAULT_SEED) -> List[int]:
+    # same results as _murmurhash2_64A for each input, vectorised with NumPy when available
+    if numpy is None or not data_list:
+        return [_murmurhash2_64A(data, seed) for data in data_list]
+    return _murmurhash2_64A_numpy(data_list, seed)
 
-        k = int64(k * m).value
-        k = int64(k ^ _zfrs(k, r)).value
-        k = int64(k * m).value
 
-        h = int64(h ^ k).value
-        h = int64(h * m).value
+def _murmurhash2_64A_numpy(data_list: List[str], seed: int) -> List[int]:
+    buffers = [data.encode("UTF-8") for data in data_list]
+    lengths = numpy.array([len(buf) for buf in buffers], dtype=numpy.uint64)
+    blocks_counts = lengths // 8
+    # one row per input, padded with zeros to the same number of 8 byte words, with room for the remaining tail
+    words_per_row = int(blocks_counts.max()) + 1
+    row_length = words_per_row * 8
+    words = numpy.frombuffer(b"".join(buf.ljust(row_length, b"\0") for buf in buffers), dtype="<u8")
+    words = words.reshape(len(buffers), words_per_row)
 
-    remaining = length - offset
-    if remaining > 0:
-        finish = bytearray(8)
-        finish[:remaining] = buf[offset:]
+    m = numpy.uint64(_MURMURHASH_M)
+    r = numpy.uint64(_MURMURHASH_R)
 
-        h = int64(h ^ struct.unpack_from('<q', finish)[0]).value
-        h = int64(h * m).value
+    h = numpy.uint64(seed & _MASK_64) ^ (lengths * m)
 
-    h = int64(h ^ _zfrs(h, r)).value
-    h = int64(h * m).value
-    h = int64(h ^ _zfrs(h, r)).value
-    return h
+    for block_index in range(words_per_row - 1):
+        k = words[:, block_index] * m
+        k ^= k >> r
+        k *= m
+        mixed = (h ^ k) * m
+        h = numpy.where(blocks_counts > block_index, mixed, h)
 
+    tails = words[numpy.arange(len(buffers)), blocks_counts.astype(numpy.intp)]
+    h = numpy.where(lengths % 8 > 0, (h ^ tails) * m, h)
 
-HEX_DIGITS = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9', 'A', 'B', 'C', 'D', 'E', 'F']
+    h ^= h >> r
+    h *= m
+    h ^= h >> r
+    return [_to_signed_64(int(value)) for value in h]
 
 
 def _encode_me_identifier(type_name: str, identifier: int) -> str:
-    string_id = type_name + "-"
-    i = 60
-    while i >= 0:
-        hex_digit_index = _zfrs(identifier, i) & 0xF
-        string_id += HEX_DIGITS[hex_digit_index]
-        i -= 4
-    return string_id
+    return type_name + "-" + format(identifier & _MASK_64, "016X")
@@ -21,37 +21,59 @@ from dataclasses import dataclass
 from math import inf
 from os import listdir
 from os.path import isfile
-from typing import Dict, List, Optional, Any
-from pygrok import Grok
+from typing import Dict, List, Optional, Any, Callable, Pattern, Set, Tuple
 
 import jmespath
+from jmespath.exceptions import JMESPathError, UnknownFunctionError
+from jmespath.parser import ParsedResult
 
 from util import logging
+from util.lru_cache import LruCache
 from .jmespath import JMESPATH_OPTIONS, jmespath_parser
+from .jmespath_compiler import compile_expression
+from .rule_index import RuleIndex, EQ, PREFIX, CONTAINS
 
 _CONDITION_COMPARATOR_MAP = {
-    "$eq".casefold(): lambda x, y: str(x).casefold() == str(y).casefold(),
-    "$prefix".casefold(): lambda x, y: str(x).casefold().startswith(str(y).casefold()),
-    "$contains".casefold(): lambda x, y: str(y).casefold() in str(x).casefold(),
+    EQ: lambda x, y: str(x).casefold() == str(y).casefold(),
+    PREFIX: lambda x, y: str(x).casefold().startswith(str(y).casefold()),
+    CONTAINS: lambda x, y: str(y).casefold() in str(x).casefold(),
 }
 
 _SOURCE_VALUE_EXTRACTOR_MAP = {
     "log_group".casefold(): lambda record, parsed_record: record.get("log_group", ""),
 }
 
-Grok.DEFAULT_PATTERNS_DIRS = []
+# expressions are compiled to python closures where possible, with the jmespath interpreter used for the rest
+COMPILED_EXPRESSIONS_ENABLED = os.environ.get("METADATA_ENGINE_COMPILED_EXPRESSIONS", "true") == "true"
+
+RULE_CACHE_MAX_SIZE = 4096
+LOGGROUP_VALUES_CACHE_MAX_SIZE = 4096
+
+# grok patterns used in log group patterns, translated to native regex. Definitions match the ones from pygrok
+_GROK_PATTERNS_AS_REGEX = {
+    "DATA": r".*?",
+    "GREEDYDATA": r".*",
+    "WORD": r"\b\w+\b",
+    "NOTSPACE": r"\S+",
+    "INT": r"(?:[+-]?(?:[0-9]+))",
+    "USERNAME": r"[a-zA-Z0-9._-]+",
+    "UUID": r"[A-Fa-f0-9]{8}-(?:[A-Fa-f0-9]{4}-){3}[A-Fa-f0-9]{12}",
+}
 
 @dataclass(frozen=True)
 class Attribute:
     key: str
     priority: int
     pattern: str
+    expression: ParsedResult
+    compiled_expression: Optional[Callable[[Dict], Any]] = None
 
 
 class SourceMatcher:
     source: str
     condition: str
     valid = True
+    comparator = None
 
     _evaluator = None
     _operand = None
@@ -62,6 +84,7 @@ class SourceMatcher:
         self.condition = condition
         for key in _CONDITION_COMPARATOR_MAP.keys():
             if condition.startswith(key):
+                self.comparator = key
                 self._evaluator = _CONDITION_COMPARATOR_MAP[key]
                 break
         operands = re.findall(r"'(.*?)'", condition, re.DOTALL)
@@ -77,6 +100,10 @@ class SourceMatcher:
                             "metadata-condition-parsing-failure")
             self.valid = False
 
+    @property
+    def operand(self):
+        return self._operand
+
     def match(self, record: Dict, parsed_record: Dict) -> bool:
         value = self._extract_value(record, parsed_record)
         return self._evaluator(value, self._operand)
@@ -92,6 +119,18 @@ class ConfigRule:
     attributes: List[Attribute]
     aws_loggroup_pattern: Optional[str]
     log_content_parse_type: Optional[str]
+    # attributes split by whether they depend on log content, the rest only needs evaluation once per record
+    record_attributes: List[Attribute]
+    event_attributes: List[Attribute]
+
+
+@dataclass(frozen=True)
+class PreparedRule:
+    rule: ConfigRule
+    # values extracted from the log group and priority attributes calculated once per record - input for the rest
+    record_values: Dict
+    # attributes calculated once per record, added to every log entry
+    attributes: Dict
 
 
 class MetadataEngine:
@@ -100,7 +139,9 @@ class MetadataEngine:
 
     def __init__(self):
         self.rules = []
+        self._rule_by_log_group = LruCache("metadata_engine_rule_by_log_group", RULE_CACHE_MAX_SIZE)
         self._load_configs()
+        self._rule_index = RuleIndex(self.rules)
 
     def _load_configs(self):
         working_directory = os.path.dirname(os.path.realpath(__file__))
@@ -123,15 +164,37 @@ class MetadataEngine:
                 logging.exception(f"Failed to load configuration file: '{config_file_path}'",
                                   "config-load-exception")
 
-    def apply(self, record: Dict, parsed_record: Dict):
+    def resolve_rule(self, record: Dict) -> Optional[ConfigRule]:
+        # all supported rule sources depend only on the log group, so it's enough to match the rules once per log group
+        log_group = record.get("log_group", "")
+        return self._rule_by_log_group.get_or_compute(log_group, lambda: self._find_rule(record))
+
+    def _find_rule(self, record: Dict) -> Optional[ConfigRule]:
+        # the index gives the same result as checking self.rules in order, with the first matching one applied
+        rule = self._rule_index.find_first_matching_rule(record.get("log_group", ""))
+        if rule:
+            return rule
+        # No matching rule has been found, applying the default rule
+        return self.default_rule
+
+    def prepare_rule(self, record: Dict) -> Optional[PreparedRule]:
+        # record given here must not contain log content, it's the input shared by all log entries from a record
         try:
-            for rule in self.rules:
-                if _check_if_rule_applies(rule, record, parsed_record):
-                    _apply_rule(rule, record, parsed_record)
-                    return
-            # No matching rule has been found, applying the default rule
-            if self.default_rule:
-                _apply_rule(self.default_rule, record, parsed_record)
+            rule = self.resolve_rule(record)
+            if rule:
+                return _prepare_rule(rule, record)
+        except Exception as ex:
+            logging.exception(f"Encountered exception when preparing rule in Rule Engine. ",
+                              "rule-engine-prepare-exception")
+        return None
+
+    def apply(self, record: Dict, parsed_record: Dict, prepared_rule: Optional[PreparedRule] = None):
+        # rule can be prepared upfront with prepare_rule, when applying it to many log entries from the same record
+        try:
+            if prepared_rule is None:
+                prepared_rule = self.prepare_rule(record)
+            if prepared_rule:
+                _apply_rule(prepared_rule, record, parsed_record)
         except Exception as ex:
             logging.exception(f"Encountered exception when running Rule Engine. ",
                               "rule-engine-exception")
@@ -141,10 +204,36 @@ def _check_if_rule_applies(rule: ConfigRule, record: Dict, parsed_record: Dict):
     return all([matcher.match(record, parsed_record) for matcher in rule.source_matchers])
 
 
-def _apply_rule(rule, record, parsed_record):
+def _prepare_rule(rule: ConfigRule, record: Dict) -> PreparedRule:
+    record_values = {}
     if rule.aws_loggroup_pattern and "log_group" in record:
-        extracted_values = parse_aws_loggroup_with_grok_pattern(record["log_group"], rule.aws_loggroup_pattern)
-        record.update(extracted_values)
+        record_values.update(parse_aws_loggroup_with_grok_pattern(record["log_group"], rule.aws_loggroup_pattern))
+
+    evaluation_record = dict(record)
+    evaluation_record.update(record_values)
+    attributes = {}
+
+    for attribute in rule.record_attributes:
+        value = _evaluate_attribute(rule, attribute, evaluation_record)
+        if value:
+            attributes[attribute.key] = value
+
+            # attributes with priority are available for the calculation of further attributes
+            if attribute.priority is not None:
+                evaluation_record[attribute.key] = value
+                record_values[attribute.key] = value
+
+    return PreparedRule(rule=rule, record_values=record_values, attributes=attributes)
+
+
+def _apply_rule(prepared_rule: PreparedRule, record, parsed_record):
+    rule = prepared_rule.rule
+    record.update(prepared_rule.record_values)
+    parsed_record.update(prepared_rule.attributes)
+
+    if not rule.event_attributes:
+        return
+
     if rule.log_content_parse_type == "json":
         try:
             record["log_content"] = json.loads(parsed_record.get("content", {}))
@@ -154,41 +243,96 @@ def _apply_rule(rule, record, parsed_record):
     else:
         record["log_content"] = parsed_record.get("content", "")
 
-    for attribute in rule.attributes:
-        try:
-            value = jmespath_parser.parse(attribute.pattern).search(record, JMESPATH_OPTIONS)
-            if value:
-                parsed_record[attribute.key] = value
+    for attribute in rule.event_attributes:
+        value = _evaluate_attribute(rule, attribute, record)
+        if value:
+            parsed_record[attribute.key] = value
 
-                # attributes with priority are available for the calculation of further attributes
-                if attribute.priority is not None:
-                    record[attribute.key] = value
-        except Exception as ex:
-            logging.log_error_without_stacktrace(f"Encountered exception when evaluating attribute {attribute} of rule for {rule.entity_type_name}",
-                                                 "rule-attribute-evaluation-exception")
+            # attributes with priority are available for the calculation of further attributes
+            if attribute.priority is not None:
+                record[attribute.key] = value
 
     record.pop("log_content", {})
 
+
+def _evaluate_attribute(rule: ConfigRule, attribute: Attribute, record: Dict):
+    try:
+        if attribute.compiled_expression:
+            return attribute.compiled_expression(record)
+        return attribute.expression.search(record, JMESPATH_OPTIONS)
+    except Exception as ex:
+        logging.log_error_without_stacktrace(f"Encountered exception when evaluating attribute {attribute} of rule for {rule.entity_type_name}",
+                                             "rule-attribute-evaluation-exception")
+        return None
+
+native_regex_by_grok_pattern: Dict[str, Optional[Pattern]] = {}
+loggroup_values_cache = LruCache("metadata_engine_loggroup_values", LOGGROUP_VALUES_CACHE_MAX_SIZE)
 grok_by_pattern = {}
 
+
+def get_native_regex(pattern: str) -> Optional[Pattern]:
+    if pattern not in native_regex_by_grok_pattern:
+        native_regex_by_grok_pattern[pattern] = _translate_grok_pattern_to_native_regex(pattern)
+    return native_regex_by_grok_pattern[pattern]
+
+
+def _translate_grok_pattern_to_native_regex(pattern: str) -> Optional[Pattern]:
+    # returns None for patterns using grok features not covered here (unknown pattern names, type conversions),
+    # those are matched with pygrok
+    unsupported = False
+
+    def replace_grok_pattern(match):
+        nonlocal unsupported
+        pattern_name, field_name, field_type = match.group(1), match.group(2), match.group(3)
+        regex = _GROK_PATTERNS_AS_REGEX.get(pattern_name)
+        if regex is None or field_type:
+            unsupported = True
+            return match.group(0)
+        if field_name:
+            return f"(?P<{field_name}>{regex})"
+        return f"({regex})"
+
+    regex_pattern = re.sub(r"%{(\w+)(?::(\w+))?(?::(\w+))?}", replace_grok_pattern, pattern)
+    # named groups syntax accepted by the regex module used by pygrok, but not by re
+    regex_pattern = re.sub(r"\(\?<([A-Za-z_]\w*)>", r"(?P<\1>", regex_pattern)
+
+    if unsupported:
+        return None
+    try:
+        return re.compile(regex_pattern)
+    except re.error:
+        return None
+
+
 def get_grok(pattern):
     grok = grok_by_pattern.get(pattern, None)
     if grok == None:
+        # imported only when needed, as it's expensive and patterns from the configs don't need it
+        from pygrok import Grok
         grok = Grok(pattern)
         grok_by_pattern[pattern] = grok
     return grok
 
 
 def parse_aws_loggroup_with_grok_pattern(loggroup, pattern) -> dict:
-    grok = get_grok(pattern)
-    extracted_values = grok.match(loggroup)
+    extracted_values = loggroup_values_cache.get_or_compute(
+        (pattern, loggroup), lambda: _match_loggroup_with_grok_pattern(loggroup, pattern))
 
     if not extracted_values:
         logging.warning(f"Failed to match logGroup '{loggroup}' against the pattern '{pattern}'",
                         "loggroup-pattern-matching-failure")
         return {}
 
-    return extracted_values
+    return dict(extracted_values)
+
+
+def _match_loggroup_with_grok_pattern(loggroup, pattern) -> Optional[dict]:
+    native_regex = get_native_regex(pattern)
+    if native_regex is None:
+        return get_grok(pattern).match(loggroup)
+
+    match = native_regex.search(loggroup)
+    return match.groupdict() if match else None
 
 
 def _create_sources(sources_json: List[Dict]) -> List[SourceMatcher]:
@@ -220,17 +364,112 @@ def _create_attributes(attributes_json: List[Dict]) -> List[Attribute]:
         priority = source_json.get("priority", None)
         pattern = source_json.get("pattern", None)
 
-        if key and pattern:
-            result.append(Attribute(key, priority, pattern))
-        else:
+        if not key or not pattern:
             logging.warning(f"Encountered invalid rule attribute with missing parameter, parameters were: key = {key}, pattern = {pattern}",
                             "metadata-attribute-missing-parameter")
+            continue
+
+        try:
+            expression = _compile_pattern(pattern)
+        except JMESPathError as ex:
+            logging.warning(f"Encountered invalid rule attribute pattern, parameters were: key = {key}, pattern = {pattern}, error = {ex}",
+                            "metadata-attribute-invalid-pattern")
+            continue
+
+        compiled_expression = None
+        if COMPILED_EXPRESSIONS_ENABLED:
+            compiled_expression = compile_expression(expression.parsed, JMESPATH_OPTIONS.custom_functions)
+
+        result.append(Attribute(key, priority, pattern, expression, compiled_expression))
 
     # attributes without priority are executed last
     result.sort(key= lambda attribute: attribute.priority if attribute.priority is not None else inf)
     return result
 
 
+def _compile_pattern(pattern: str) -> ParsedResult:
+    # parsing once at load time - evaluation of the compiled expression is all that's left per log event
+    expression = jmespath_parser.parse(pattern)
+    _ensure_functions_known(expression.parsed)
+    return expression
+
+
+def _ensure_functions_known(node: Dict):
+    # jmespath resolves function names only during evaluation, catch typos in configs early instead
+    if node.get("type") == "function_expression" and node["value"] not in JMESPATH_OPTIONS.custom_functions.FUNCTION_TABLE:
+        raise UnknownFunctionError(f"Unknown function: {node['value']}()")
+    for child in node.get("children", []):
+        if isinstance(child, dict):
+            _ensure_functions_known(child)
+
+
+def _split_attributes_by_log_content_dependency(attributes: List[Attribute]) -> Tuple[List[Attribute], List[Attribute]]:
+    # log content is the only input that differs between log entries from one record.
+    # Attributes not reading it (directly, nor through priority attributes calculated from it) are record attributes.
+    # Order of evaluation visible to any attribute must stay as if all of them were evaluated one by one per entry.
+    record_attributes = []
+    event_attributes = []
+
+    fields_differing_per_event = {"log_content"}
+    fields_read_by_event_attributes = set()
+    whole_record_read_by_event_attributes = False
+    keys_set_by_event_attributes = set()
+
+    for attribute in attributes:
+        referenced_fields = _referenced_fields(attribute.expression.parsed)
+
+        is_event_attribute = referenced_fields is None \
+            or not referenced_fields.isdisjoint(fields_differing_per_event) \
+            or attribute.key in keys_set_by_event_attributes \
+            or (attribute.priority is not None
+                and (whole_record_read_by_event_attributes or attribute.key in fields_read_by_event_attributes))
+
+        if is_event_attribute:
+            event_attributes.append(attribute)
+            keys_set_by_event_attributes.add(attribute.key)
+            if attribute.priority is not None:
+                fields_differing_per_event.add(attribute.key)
+            if referenced_fields is None:
+                whole_record_read_by_event_attributes = True
+            else:
+                fields_read_by_event_attributes.update(referenced_fields)
+        else:
+            record_attributes.append(attribute)
+
+    return record_attributes, event_attributes
+
+
+# for these nodes only the first child is evaluated against the record, the following ones work on its result
+_NODES_EVALUATING_FURTHER_CHILDREN_ON_RESULT = {
+    "subexpression", "index_expression", "projection", "filter_projection", "value_projection", "pipe"
+}
+
+
+def _referenced_fields(node: Dict) -> Optional[Set[str]]:
+    # returns names of the record fields read by the expression, None if it may read the whole record
+    node_type = node.get("type")
+    if node_type == "field":
+        return {node["value"]}
+    if node_type in ("current", "identity"):
+        return None
+
+    children = [child for child in node.get("children", []) if isinstance(child, dict)]
+    if node_type in _NODES_EVALUATING_FURTHER_CHILDREN_ON_RESULT:
+        children = children[:1]
+    elif node_type == "function_expression" and node["value"] == "if" \
+            and len(children) == 4 and children[3].get("type") == "current":
+        # current node is passed to if() only as the scope of its expression references, which are checked anyway
+        children = children[:3]
+
+    fields = set()
+    for child in children:
+        child_fields = _referenced_fields(child)
+        if child_fields is None:
+            return None
+        fields.update(child_fields)
+    return fields
+
+
 def _create_config_rule(entity_name: str, rule_json: Dict) -> Optional[ConfigRule]:
     sources_json = rule_json.get("sources", [])
     if entity_name != "default" and not sources_json:
@@ -243,12 +482,17 @@ def _create_config_rule(entity_name: str, rule_json: Dict) -> Optional[ConfigRul
                         "metadata-rule-invalid-sources")
         return None
     attributes = _create_attributes(rule_json.get("attributes", []))
+    record_attributes, event_attributes = _split_attributes_by_log_content_dependency(attributes)
 
     aws_loggroup_pattern = rule_json.get("aws", {}).get("logGroup", None)
+    if aws_loggroup_pattern and not get_native_regex(aws_loggroup_pattern):
+        logging.warning(f"Log group pattern '{aws_loggroup_pattern}' for config entry named {entity_name} can't be translated to native regex, falling back to grok",
+                        "metadata-loggroup-pattern-grok-fallback")
     log_content_parse_type = rule_json.get("aws", {}).get("logContentParseAs", None)
 
     return ConfigRule(entity_type_name=entity_name, source_matchers=sources, attributes=attributes,
-                      aws_loggroup_pattern=aws_loggroup_pattern, log_content_parse_type=log_content_parse_type)
+                      aws_loggroup_pattern=aws_loggroup_pattern, log_content_parse_type=log_content_parse_type,
+                      record_attributes=record_attributes, event_attributes=event_attributes)
 
 
 def _create_config_rules(config_json: Dict) -> List[ConfigRule]:
@@ -0,0 +1,140 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set
+
+PREFIX = "$prefix"
+EQ = "$eq"
+CONTAINS = "$contains"
+
+
+class _TrieNode:
+    __slots__ = ("children", "outputs", "fail")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.outputs: List[int] = []
+        self.fail: Optional["_TrieNode"] = None
+
+
+class _Trie:
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def add(self, word: str, output: int):
+        node = self.root
+        for char in word:
+            node = node.children.setdefault(char, _TrieNode())
+        node.outputs.append(output)
+
+
+class PrefixTrie(_Trie):
+
+    def matches(self, value: str) -> Iterable[int]:
+        # outputs of all words being a prefix of the value
+        node = self.root
+        for char in value:
+            node = node.children.get(char)
+            if node is None:
+                return
+            yield from node.outputs
+
+
+class AhoCorasickAutomaton(_Trie):
+    # all words are searched in a single pass over the value, build() is required after adding them
+
+    def build(self):
+        self.root.fail = self.root
+        queue = deque()
+        for child in self.root.children.values():
+            child.fail = self.root
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in node.children.items():
+                fail = node.fail
+                while fail is not self.root and char not in fail.children:
+                    fail = fail.fail
+                child.fail = fail.children.get(char, self.root)
+                # words ending at the fail node are suffixes of this one, so they are found here as well
+                child.outputs = child.outputs + child.fail.outputs
+                queue.append(child)
+
+    def matches(self, value: str) -> Iterable[int]:
+        # outputs of all words contained in the value, an output can be repeated if its word occurs many times
+        node = self.root
+        for char in value:
+            while node is not self.root and char not in node.children:
+                node = node.fail
+            node = node.children.get(char, self.root)
+            yield from node.outputs
+
+
+class RuleIndex:
+    # Finds the first rule (in the order given) for which all source matchers match the value,
+    # without checking the rules one by one. Operands and the value are casefolded, same as in SourceMatcher.
+
+    def __init__(self, rules: List):
+        self._rules = rules
+        self._matcher_rule_indices: List[int] = []
+        self._matchers_count_by_rule: List[int] = []
+
+        self._prefix_trie = PrefixTrie()
+        self._contains_automaton = AhoCorasickAutomaton()
+        self._eq_matchers: Dict[str, List[int]] = {}
+
+        for rule_index, rule in enumerate(rules):
+            self._matchers_count_by_rule.append(len(rule.source_matchers))
+            for matcher in rule.source_matchers:
+                self._add_matcher(rule_index, matcher)
+
+        self._contains_automaton.build()
+
+    def _add_matcher(self, rule_index: int, matcher):
+        matcher_id = len(self._matcher_rule_indices)
+        self._matcher_rule_indices.append(rule_index)
+        operand = str(matcher.operand).casefold()
+
+        if matcher.comparator == PREFIX:
+            self._prefix_trie.add(operand, matcher_id)
+        elif matcher.comparator == EQ:
+            self._eq_matchers.setdefault(operand, []).append(matcher_id)
+        elif matcher.comparator == CONTAINS:
+            self._contains_automaton.add(operand, matcher_id)
+        else:
+            raise ValueError(f"Unsupported condition comparator: '{matcher.comparator}'")
+
+    def find_first_matching_rule(self, value) -> Optional[object]:
+        value = str(value).casefold()
+
+        matched_matcher_ids: Set[int] = set(self._prefix_trie.matches(value))
+        matched_matcher_ids.update(self._eq_matchers.get(value, ()))
+        matched_matcher_ids.update(self._contains_automaton.matches(value))
+
+        matched_count_by_rule: Dict[int, int] = {}
+        for matcher_id in matched_matcher_ids:
+            rule_index = self._matcher_rule_indices[matcher_id]
+            matched_count_by_rule[rule_index] = matched_count_by_rule.get(rule_index, 0) + 1
+
+        fully_matched_rule_indices = [
+            rule_index for rule_index, matched_count in matched_count_by_rule.items()
+            if matched_count == self._matchers_count_by_rule[rule_index]
+        ]
+
+        if not fully_matched_rule_indices:
+            return None
+        return self._rules[min(fully_matched_rule_indices)]
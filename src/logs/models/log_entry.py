@@ -0,0 +1,120 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+from itertools import islice
+from json.encoder import encode_basestring_ascii
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+# keys serialized separately for each log entry, as rules can overwrite their values
+CONTENT = "content"
+SEVERITY = "severity"
+TIMESTAMP = "timestamp"
+
+ENCODING = "utf-8"
+
+
+class RecordAttributes:
+    # Attributes shared by all log entries from a record, JSON-escaped once per record. Log entries from the record
+    # are built in the order: content, leading attributes, severity, trailing attributes, timestamp (if present),
+    # rule attributes and then attributes set by the rule per log entry.
+
+    def __init__(self, leading_attributes: Dict, trailing_attributes: Dict, rule_attributes: Dict,
+                 event_attribute_keys: Iterable[str]):
+        self.leading_attributes = leading_attributes
+        self.trailing_attributes = trailing_attributes
+        self.rule_attributes = rule_attributes
+
+        # overwriting content or severity doesn't change the order of keys, those values are read from each entry
+        new_rule_attributes = {key: value for key, value in rule_attributes.items() if key not in (CONTENT, SEVERITY)}
+        self._serialized_leading_attributes = _serialize_attributes(leading_attributes)
+        self._serialized_trailing_attributes = _serialize_attributes(trailing_attributes)
+        self._serialized_rule_attributes = _serialize_attributes(new_rule_attributes)
+        self._keys_count_without_timestamp = 2 + len(leading_attributes) + len(trailing_attributes) + \
+            len(new_rule_attributes)
+
+        # serialized values can't be spliced in if a rule overwrites them, the key would keep its former position
+        base_keys = set(leading_attributes) | set(trailing_attributes)
+        base_keys.add(TIMESTAMP)
+        keys_with_shared_values = base_keys | set(new_rule_attributes)
+        self.serialized_attributes_valid = base_keys.isdisjoint(new_rule_attributes) and \
+            keys_with_shared_values.isdisjoint(event_attribute_keys)
+
+    def serialize(self, log_entry: "LogEntry") -> bytes:
+        serialized_parts = [b'{"content": ', log_entry.serialized_content(),
+                            self._serialized_leading_attributes,
+                            b', "severity": ', _serialize_value(log_entry[SEVERITY]),
+                            self._serialized_trailing_attributes]
+        keys_count = self._keys_count_without_timestamp
+
+        if TIMESTAMP in log_entry:
+            serialized_parts.append(b', "timestamp": ')
+            serialized_parts.append(_serialize_value(log_entry[TIMESTAMP]))
+            keys_count += 1
+
+        serialized_parts.append(self._serialized_rule_attributes)
+
+        if len(log_entry) > keys_count:
+            event_attributes = dict(islice(log_entry.items(), keys_count, None))
+            serialized_parts.append(_serialize_attributes(event_attributes))
+
+        serialized_parts.append(b"}")
+        return b"".join(serialized_parts)
+
+
+class LogEntry(dict):
+    # log entry keeping a reference to the attributes it shares with other entries from the same record,
+    # until any of them is changed
+
+    __slots__ = ("record_attributes", "escaped_content")
+
+    def __init__(self, record_attributes: Optional[RecordAttributes] = None):
+        super().__init__()
+        self.record_attributes = record_attributes
+        # (content, the content JSON-escaped as found in the record - a view of the record bytes), used as long as
+        # the content is not replaced
+        self.escaped_content: Optional[Tuple[str, Union[bytes, memoryview]]] = None
+
+    def serialized_content(self) -> Union[bytes, memoryview]:
+        content = self[CONTENT]
+        escaped_content = self.escaped_content
+        if escaped_content is not None and escaped_content[0] is content:
+            return escaped_content[1]
+        return _serialize_value(content)
+
+
+def serialize_log_entry(log_entry: Dict) -> bytes:
+    # same output as json.dumps(log_entry) encoded, apart from content passed through as escaped in the record,
+    # which can differ in the escaping style only
+    record_attributes = getattr(log_entry, "record_attributes", None)
+    if record_attributes is not None and record_attributes.serialized_attributes_valid:
+        return record_attributes.serialize(log_entry)
+    return json.dumps(log_entry).encode(ENCODING)
+
+
+def _serialize_attributes(attributes: Dict) -> bytes:
+    # ", "-prefixed key-value pairs, to be put after other pairs of a JSON object
+    if not attributes:
+        return b""
+    return b", " + json.dumps(attributes)[1:-1].encode(ENCODING)
+
+
+def _serialize_value(value) -> bytes:
+    # json.dumps escapes all non-ASCII characters, so the values serialized are ASCII.
+    # Exact types on purpose: faster than isinstance, and bool (an int) or str subclasses are left to json.dumps.
+    if type(value) is str:  # pylint: disable=unidiomatic-typecheck
+        return encode_basestring_ascii(value).encode("ascii")
+    if type(value) is int:  # pylint: disable=unidiomatic-typecheck
+        return int.__repr__(value).encode("ascii")
+    return json.dumps(value).encode("ascii")
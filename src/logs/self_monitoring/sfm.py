@@ -12,6 +12,7 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import threading
 from collections import defaultdict
 from typing import Union
 
@@ -23,8 +24,11 @@ class SelfMonitoringContext:
 
     def __init__(self, function_name):
         self._function_name = function_name
+        # batches can be uploaded from many threads, methods called during the upload update the counters under it
+        self._lock = threading.Lock()
 
         self._kinesis_records_age = []
+        self._records_count_by_result = defaultdict(lambda: 0)
         self._record_data_compressed_size = []
         self._record_data_decompressed_size = []
 
@@ -33,6 +37,7 @@ class SelfMonitoringContext:
         self._data_volume_prepared = 0
 
         self._batches_delivered = 0
+        self._batches_split = 0
         self._log_entries_delivered = 0
         self._data_volume_delivered = 0
 
@@ -49,12 +54,29 @@ class SelfMonitoringContext:
         self._requests_durations_ms = []
         self._requests_count_by_status_code = defaultdict(lambda: 0)
 
+        self._requests_retried_by_reason = defaultdict(lambda: 0)
+        self._requests_retry_delays_sec = []
+
+        self._request_bodies_uncompressed_size = 0
+        self._request_bodies_compressed_size = 0
+
+        self._connections_reused = 0
+        self._connections_handshake_durations_ms = []
+        self._connections_tls_session_resumed = 0
+
+        self._cache_hits_by_name = defaultdict(lambda: 0)
+        self._cache_misses_by_name = defaultdict(lambda: 0)
+
     def kinesis_record_age(self, age_sec):
         self._kinesis_records_age.append(age_sec)
 
     def kinesis_record_decoded(self, record_data_compressed_size, record_data_decompressed_size):
-        self._record_data_compressed_size.append(record_data_compressed_size)
-        self._record_data_decompressed_size.append(record_data_decompressed_size)
+        with self._lock:
+            self._record_data_compressed_size.append(record_data_compressed_size)
+            self._record_data_decompressed_size.append(record_data_decompressed_size)
+
+    def records_with_result(self, result_name, records_count):
+        self._records_count_by_result[result_name] += records_count
 
     def batch_prepared(self, log_entries_count, data_volume):
         self._batches_prepared += 1
@@ -62,19 +84,29 @@ class SelfMonitoringContext:
         self._data_volume_prepared += data_volume
 
     def batch_delivered(self, log_entries_count, data_volume):
-        self._batches_delivered += 1
-        self._log_entries_delivered += log_entries_count
-        self._data_volume_delivered += data_volume
+        with self._lock:
+            self._batches_delivered += 1
+            self._log_entries_delivered += log_entries_count
+            self._data_volume_delivered += data_volume
+
+    def batch_split(self):
+        with self._lock:
+            self._batches_split += 1
 
     def issue(self, what_issue):
-        self._issue_count_by_type[what_issue] += 1
-        print("SFM: issue registered, type " + what_issue)
+        with self._lock:
+            self._issue_count_by_type[what_issue] += 1
+            print("SFM: issue registered, type " + what_issue)
+
+    def log_content_trimmed(self, count=1):
+        self._log_content_trimmed += count
 
-    def log_content_trimmed(self):
-        self._log_content_trimmed += 1
+    def log_attr_trimmed(self, count=1):
+        self._log_attr_trimmed += count
 
-    def log_attr_trimmed(self):
-        self._log_attr_trimmed += 1
+    def logs_trimmed_counts(self):
+        # for entries trimmed in transformation processes, counted in the context of each record
+        return self._log_content_trimmed, self._log_attr_trimmed
 
     def logs_age(self, logs_age_min_sec, logs_age_avg_sec, logs_age_max_sec):
         self._logs_age_min_sec = logs_age_min_sec
@@ -82,11 +114,37 @@ class SelfMonitoringContext:
         self._logs_age_max_sec = logs_age_max_sec
 
     def request_sent(self):
-        self._requests_sent += 1
+        with self._lock:
+            self._requests_sent += 1
 
     def request_finished_with_status_code(self, status_code, duration_ms):
-        self._requests_count_by_status_code[status_code] += 1
-        self._requests_durations_ms.append(duration_ms)
+        with self._lock:
+            self._requests_count_by_status_code[status_code] += 1
+            self._requests_durations_ms.append(duration_ms)
+
+    def request_retried(self, reason, delay_sec):
+        with self._lock:
+            self._requests_retried_by_reason[reason] += 1
+            self._requests_retry_delays_sec.append(delay_sec)
+
+    def request_body_compressed(self, uncompressed_size, compressed_size):
+        with self._lock:
+            self._request_bodies_uncompressed_size += uncompressed_size
+            self._request_bodies_compressed_size += compressed_size
+
+    def connection_reused(self):
+        with self._lock:
+            self._connections_reused += 1
+
+    def connection_established(self, handshake_duration_ms, tls_session_resumed: bool):
+        with self._lock:
+            self._connections_handshake_durations_ms.append(handshake_duration_ms)
+            if tls_session_resumed:
+                self._connections_tls_session_resumed += 1
+
+    def cache_statistics(self, cache_name, hits, misses):
+        self._cache_hits_by_name[cache_name] += hits
+        self._cache_misses_by_name[cache_name] += misses
 
     def _generate_metrics(self):
         metrics = []
@@ -111,6 +169,10 @@ class SelfMonitoringContext:
             self._record_data_decompressed_size
         ))
 
+        for result_name, records_count in self._records_count_by_result.items():
+            metrics.append(_prepare_cloudwatch_metric("Kinesis records with result", "None", common_dimensions + [
+                {"Name": "result", "Value": result_name}], records_count))
+
         metrics.append(
             _prepare_cloudwatch_metric("Batches prepared", "None", common_dimensions, self._batches_prepared))
         metrics.append(
@@ -125,6 +187,9 @@ class SelfMonitoringContext:
         metrics.append(_prepare_cloudwatch_metric("Data volume delivered", "Bytes", common_dimensions,
                                                   self._data_volume_delivered))
 
+        if self._batches_split:
+            metrics.append(_prepare_cloudwatch_metric("Batches split", "None", common_dimensions, self._batches_split))
+
         for issue, count in self._issue_count_by_type.items():
             metrics.append(
                 _prepare_cloudwatch_metric("Issues", "None", common_dimensions + [{"Name": "type", "Value": issue}],
@@ -152,6 +217,36 @@ class SelfMonitoringContext:
             metrics.append(_prepare_cloudwatch_metric("Requests status code count", "None", common_dimensions + [
                 {"Name": "status_code", "Value": str(status_code)}], count))
 
+        for reason, count in self._requests_retried_by_reason.items():
+            metrics.append(_prepare_cloudwatch_metric("Requests retried", "None", common_dimensions + [
+                {"Name": "reason", "Value": reason}], count))
+        if self._requests_retry_delays_sec:
+            metrics.append(_prepare_cloudwatch_metric("Requests retry delay", "Seconds", common_dimensions,
+                                                      self._requests_retry_delays_sec))
+
+        if self._request_bodies_compressed_size:
+            metrics.append(_prepare_cloudwatch_metric("Request data uncompressed size", "Bytes", common_dimensions,
+                                                      self._request_bodies_uncompressed_size))
+            metrics.append(_prepare_cloudwatch_metric("Request data compressed size", "Bytes", common_dimensions,
+                                                      self._request_bodies_compressed_size))
+
+        if self._connections_reused or self._connections_handshake_durations_ms:
+            metrics.append(_prepare_cloudwatch_metric("Connections reused", "None", common_dimensions,
+                                                      self._connections_reused))
+            metrics.append(_prepare_cloudwatch_metric("Connections established", "None", common_dimensions,
+                                                      len(self._connections_handshake_durations_ms)))
+        if self._connections_handshake_durations_ms:
+            metrics.append(_prepare_cloudwatch_metric("Connections handshake duration", "Milliseconds",
+                                                      common_dimensions, self._connections_handshake_durations_ms))
+            metrics.append(_prepare_cloudwatch_metric("Connections TLS session resumed", "None", common_dimensions,
+                                                      self._connections_tls_session_resumed))
+
+        for cache_name, hits in self._cache_hits_by_name.items():
+            cache_dimensions = common_dimensions + [{"Name": "cache", "Value": cache_name}]
+            metrics.append(_prepare_cloudwatch_metric("Cache hits", "None", cache_dimensions, hits))
+            metrics.append(_prepare_cloudwatch_metric("Cache misses", "None", cache_dimensions,
+                                                      self._cache_misses_by_name[cache_name]))
+
         return metrics
 
     def push_sfm_to_cloudwatch(self):
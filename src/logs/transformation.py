@@ -13,15 +13,24 @@
 #   limitations under the License.
 
 import json
+import re
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import List, Dict, Optional, Union
 
-from logs.metadata_engine.metadata_engine import MetadataEngine
+from logs.metadata_engine.metadata_engine import MetadataEngine, PreparedRule
 from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import LogEntry, RecordAttributes
 from util.context import Context
 
 metadata_engine = MetadataEngine()
 
+# JSON strings can't contain unescaped quotes, so this matches only the "message" keys (of log events)
+MESSAGE_START_PATTERN = re.compile(rb'"message"[ \t\n\r]*:[ \t\n\r]*"')
+QUOTE = ord('"')
+BACKSLASH = ord('\\')
+# finding the end of a message with many escaped quotes costs more than escaping it again
+ESCAPED_MESSAGE_MAX_ESCAPED_QUOTES = 8
+
 
 @dataclass
 class RecordMetadata:
@@ -31,7 +40,7 @@ class RecordMetadata:
 
 
 def extract_dt_logs_from_single_record(
-    record_data_decoded: str, batch_metadata: BatchMetadata, context: Context) -> List[Dict]:
+    record_data_decoded: Union[bytes, str], batch_metadata: BatchMetadata, context: Context) -> List[Dict]:
     logs: List[Dict] = []
     record = json.loads(record_data_decoded)
 
@@ -40,16 +49,94 @@ def extract_dt_logs_from_single_record(
 
     record_metadata = RecordMetadata(record["logGroup"], record["logStream"], record["owner"])
 
-    for log_event in record["logEvents"]:
-        log_entry = transform_single_log_entry(log_event, batch_metadata, record_metadata, context)
+    # all log events in the record share the metadata engine input apart from log content,
+    # so the rule and attributes not depending on the content are resolved once
+    prepared_rule = metadata_engine.prepare_rule(prepare_metadata_engine_input(batch_metadata, record_metadata))
+    record_attributes = prepare_record_attributes(batch_metadata, record_metadata, context, prepared_rule)
+
+    log_events = record["logEvents"]
+    escaped_messages = None
+    if record_attributes.serialized_attributes_valid:
+        if isinstance(record_data_decoded, str):
+            record_data_decoded = record_data_decoded.encode("utf-8")
+        escaped_messages = find_escaped_messages(record_data_decoded, len(log_events))
+
+    for log_event_index, log_event in enumerate(log_events):
+        log_entry = transform_single_log_entry(log_event, batch_metadata, record_metadata, context, prepared_rule,
+                                               record_attributes)
+        if escaped_messages:
+            # the message is spliced into the log entry sent as it is in the record, without escaping it again
+            log_entry.escaped_content = (log_event["message"], escaped_messages[log_event_index])
         logs.append(log_entry)
 
     return logs
 
 
-def transform_single_log_entry(log_event, batch_metadata, record_metadata, context: Context) -> Dict:
-    parsed_record = {
-        'content': log_event["message"],
+def transform_single_log_entry(log_event, batch_metadata, record_metadata, context: Context,
+                               prepared_rule: Optional[PreparedRule] = None,
+                               record_attributes: Optional[RecordAttributes] = None) -> Dict:
+    shared_attributes = record_attributes or prepare_record_attributes(batch_metadata, record_metadata, context)
+
+    # entries with record attributes can be serialized splicing in the ones already serialized for the record
+    parsed_record = LogEntry(record_attributes)
+    parsed_record['content'] = log_event["message"]
+    parsed_record.update(shared_attributes.leading_attributes)
+    parsed_record['severity'] = 'INFO'
+    parsed_record.update(shared_attributes.trailing_attributes)
+
+    if "timestamp" in log_event:
+        parsed_record["timestamp"] = log_event["timestamp"]
+
+    record = prepare_metadata_engine_input(batch_metadata, record_metadata)
+
+    # record here is different than Kinesis request record
+    # here it is single log entry, in Kinesis request it is a bunch of logs from one logStream
+
+    # record is input for metadata engine (you can use values from record in json configs)
+    # parsed_record is output (engine will add generated attributes there)
+    metadata_engine.apply(record, parsed_record, prepared_rule)
+
+    return parsed_record
+
+
+def find_escaped_messages(record_data_decoded: bytes, log_events_count: int) -> Optional[List[memoryview]]:
+    # JSON strings of log event messages (with quotes) as found in the record, as views of its bytes (not copied).
+    # Returns None if the messages found don't correspond to the log events, or once a message isn't worth looking
+    # for - messages in a record come from a single log stream and are usually alike.
+    escaped_messages: List[memoryview] = []
+    record_data_view = memoryview(record_data_decoded)
+
+    for message_start_match in MESSAGE_START_PATTERN.finditer(record_data_decoded):
+        message_start = message_start_match.end() - 1
+        message_end = _find_closing_quote(record_data_decoded, message_start)
+        if message_end == -1:
+            return None
+        escaped_messages.append(record_data_view[message_start:message_end + 1])
+
+    if len(escaped_messages) != log_events_count:
+        return None
+    return escaped_messages
+
+
+def _find_closing_quote(record_data_decoded: bytes, string_start: int) -> int:
+    # UTF-8 multi-byte sequences never contain ASCII bytes, so the quotes and backslashes can be looked for in bytes
+    quote_index = string_start
+    for _ in range(ESCAPED_MESSAGE_MAX_ESCAPED_QUOTES + 1):
+        quote_index = record_data_decoded.find(QUOTE, quote_index + 1)
+        if quote_index == -1:
+            return -1
+
+        backslash_index = quote_index - 1
+        while record_data_decoded[backslash_index] == BACKSLASH:
+            backslash_index -= 1
+        if (quote_index - 1 - backslash_index) % 2 == 0:
+            return quote_index
+    return -1
+
+
+def prepare_record_attributes(batch_metadata, record_metadata, context: Context,
+                              prepared_rule: Optional[PreparedRule] = None) -> RecordAttributes:
+    leading_attributes = {
         'cloud.provider': 'aws',
         'cloud.account.id': record_metadata.account_id,
         'cloud.region': batch_metadata.region,
@@ -57,26 +144,25 @@ def transform_single_log_entry(log_event, batch_metadata, record_metadata, conte
         'aws.log_stream': record_metadata.log_stream,
         'aws.region': batch_metadata.region,
         'aws.account.id': record_metadata.account_id,
-        'severity': 'INFO',
+    }
+    trailing_attributes = {
         'cloud.log_forwarder': context.cloud_log_forwarder
     }
 
-    if "timestamp" in log_event:
-        parsed_record["timestamp"] = log_event["timestamp"]
+    rule_attributes = {}
+    event_attribute_keys = []
+    if prepared_rule:
+        rule_attributes = prepared_rule.attributes
+        event_attribute_keys = [attribute.key for attribute in prepared_rule.rule.event_attributes]
 
-    record = {
+    return RecordAttributes(leading_attributes, trailing_attributes, rule_attributes, event_attribute_keys)
+
+
+def prepare_metadata_engine_input(batch_metadata, record_metadata) -> Dict:
+    return {
         'log_stream': record_metadata.log_stream,
         'log_group': record_metadata.log_group,
         'region': batch_metadata.region,
         'partition': batch_metadata.partition,
         'account_id': record_metadata.account_id,
     }
-
-    # record here is different than Kinesis request record
-    # here it is single log entry, in Kinesis request it is a bunch of logs from one logStream
-
-    # record is input for metadata engine (you can use values from record in json configs)
-    # parsed_record is output (engine will add generated attributes there)
-    metadata_engine.apply(record, parsed_record)
-
-    return parsed_record
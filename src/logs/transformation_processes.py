@@ -0,0 +1,282 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# Transformation of records in worker processes, for Lambdas given more than one vCPU (from 1769MB of memory).
+# Workers are forked once and kept, with the metadata engine and caches warm, across invocations of the Lambda
+# instance. Lambda has no /dev/shm, so multiprocessing Queue and Pool can't be used there, records and results
+# go through Pipes (socket pairs) instead.
+
+import multiprocessing
+import os
+from collections import deque
+from multiprocessing.connection import Connection
+from typing import Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from logs import logs_sender
+from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import serialize_log_entry
+from logs.transformation import extract_dt_logs_from_single_record
+from util import lru_cache
+from util.context import Context
+from util.logging import log_error_with_stacktrace, log_multiline_message
+
+# fewer records per process don't pay off sending them to other processes
+MIN_RECORDS_PER_TRANSFORMATION_PROCESS = 8
+# Lambda gives a full vCPU from this memory size on, below it reports 2 CPUs but the function gets only a share of
+# one - worker processes would cost forking and pickling with nothing run in parallel
+MIN_LAMBDA_MEMORY_SIZE_MB_FOR_TRANSFORMATION_PROCESSES = 1769
+
+
+class TransformedRecord(NamedTuple):
+    # log entries extracted from a record, serialized to bytes when transformed in a worker process,
+    # None if the record failed to decode or transform
+    logs: Optional[List[Union[Dict, bytes]]]
+    logs_timestamps: List
+
+
+class _WorkerSettings(NamedTuple):
+    # what the worker needs from the context of the invocation to transform records
+    function_name: str
+    debug: bool
+    cloud_log_forwarder: str
+    max_log_length: int
+
+
+class _WorkerResult(NamedTuple):
+    transformed_record: TransformedRecord
+    transformation_failed: bool
+    log_content_trimmed: int
+    log_attr_trimmed: int
+    caches_statistics: List[Tuple[str, int, int]]
+
+
+FAILED_RECORD = TransformedRecord(None, [])
+_END_OF_RECORDS = object()
+
+
+class _Worker:
+
+    def __init__(self):
+        self.connection, worker_connection = multiprocessing.Pipe()
+        self.process = _multiprocessing_context().Process(target=_run_worker,
+                                                          args=(worker_connection, self.connection), daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+    def send(self, record: bytes, batch_metadata: BatchMetadata, settings: _WorkerSettings):
+        self.connection.send((batch_metadata, settings))
+        # record bytes are written as they are, without pickling
+        self.connection.send_bytes(record)
+
+    def receive(self) -> _WorkerResult:
+        return self.connection.recv()
+
+    def stop(self):
+        self.connection.close()
+        self.process.kill()
+        self.process.join()
+
+
+# kept across invocations
+_workers: List[_Worker] = []
+
+
+def transformation_processes_count(records_count: int, context: Context) -> int:
+    # 1 means transforming records in the Lambda process itself
+    if context.transformation_processes is not None:
+        return max(1, context.transformation_processes)
+    lambda_memory_size_mb = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", 0))
+    if lambda_memory_size_mb < MIN_LAMBDA_MEMORY_SIZE_MB_FOR_TRANSFORMATION_PROCESSES:
+        return 1
+    cpu_count = os.cpu_count() or 1
+    return max(1, min(cpu_count, records_count // MIN_RECORDS_PER_TRANSFORMATION_PROCESS))
+
+
+def transform_records_in_processes(decoded_records: Iterable[Optional[bytes]], batch_metadata: BatchMetadata,
+                                   context: Context, processes_count: int) -> Iterator[TransformedRecord]:
+    # Records are transformed in order of the records given. Every worker has a single record sent to it at a time,
+    # so that neither the worker nor this process block on writing to a pipe the other one doesn't read.
+    settings = _WorkerSettings(context.function_name, context.debug, context.cloud_log_forwarder,
+                               context.max_log_length)
+    idle_workers = deque(_get_workers(processes_count))
+    # workers with a record sent to them and records already transformed, in order of the records
+    pending_results = deque()
+    records_iterator = iter(decoded_records)
+    records_left = True
+
+    try:
+        while True:
+            if records_left:
+                records_left = _send_records(records_iterator, idle_workers, pending_results, batch_metadata,
+                                             settings, context)
+            if not pending_results:
+                return
+            yield _next_result(pending_results, idle_workers, context)
+    finally:
+        # results not consumed would otherwise be received for records sent in the next invocation
+        for pending_result in pending_results:
+            if isinstance(pending_result, _Worker):
+                _receive_result(pending_result, context)
+
+
+def stop_workers():
+    for worker in _workers:
+        worker.stop()
+    _workers.clear()
+
+
+def _multiprocessing_context():
+    # forked workers get the metadata engine already loaded, spawning isn't supported everywhere (and slower)
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def _get_workers(processes_count: int) -> List[_Worker]:
+    for worker in [worker for worker in _workers if not worker.process.is_alive()]:
+        log_multiline_message(f"Transformation process {worker.process.pid} exited with code "
+                              f"{worker.process.exitcode}, starting a new one", "transformation-process-exited")
+        worker.stop()
+        _workers.remove(worker)
+
+    while len(_workers) < processes_count:
+        _workers.append(_Worker())
+    return _workers[:processes_count]
+
+
+def _send_records(records_iterator: Iterator[Optional[bytes]], idle_workers: Deque[_Worker], pending_results: Deque,
+                  batch_metadata: BatchMetadata, settings: _WorkerSettings, context: Context) -> bool:
+    # sends records to all idle workers, or takes a single record when there are none left at all,
+    # returns whether there are records left
+    while idle_workers or not pending_results:
+        record = next(records_iterator, _END_OF_RECORDS)
+        if record is _END_OF_RECORDS:
+            return False
+        if record is None:
+            # failed to decode
+            pending_results.append(FAILED_RECORD)
+        elif idle_workers:
+            pending_results.append(_send_record(idle_workers.popleft(), record, batch_metadata, settings, context))
+        else:
+            # no workers left
+            pending_results.append(_transform_record_in_this_process(record, batch_metadata, settings, context))
+    return True
+
+
+def _next_result(pending_results: Deque, idle_workers: Deque[_Worker], context: Context) -> TransformedRecord:
+    pending_result = pending_results.popleft()
+    if not isinstance(pending_result, _Worker):
+        return pending_result
+    worker = pending_result
+    transformed_record = _receive_result(worker, context)
+    if not worker.connection.closed:
+        idle_workers.append(worker)
+    return transformed_record
+
+
+def _send_record(worker: _Worker, record: Union[bytes, str], batch_metadata: BatchMetadata,
+                 settings: _WorkerSettings, context: Context) -> Union[_Worker, TransformedRecord]:
+    if isinstance(record, str):
+        record = record.encode("utf-8")
+    try:
+        worker.send(record, batch_metadata, settings)
+        return worker
+    except Exception as e:
+        # the worker is gone, it's replaced in the next invocation
+        log_error_with_stacktrace(e, "Failed to send record to transformation process",
+                                  "transformation-process-send-exception")
+        worker.stop()
+        return _transform_record_in_this_process(record, batch_metadata, settings, context)
+
+
+def _receive_result(worker: _Worker, context: Context) -> TransformedRecord:
+    try:
+        worker_result = worker.receive()
+    except Exception as e:
+        # the worker died with the record, it's replaced in the next invocation
+        context.sfm.issue("record_transformation_failed")
+        log_error_with_stacktrace(e, "Failed to receive record transformed in another process",
+                                  "transformation-process-receive-exception")
+        worker.stop()
+        return FAILED_RECORD
+    return _report_worker_result(worker_result, context)
+
+
+def _transform_record_in_this_process(record: bytes, batch_metadata: BatchMetadata, settings: _WorkerSettings,
+                                      context: Context) -> TransformedRecord:
+    return _report_worker_result(_transform_record(record, batch_metadata, settings), context)
+
+
+def _report_worker_result(worker_result: _WorkerResult, context: Context) -> TransformedRecord:
+    if worker_result.transformation_failed:
+        context.sfm.issue("record_transformation_failed")
+    context.sfm.log_content_trimmed(worker_result.log_content_trimmed)
+    context.sfm.log_attr_trimmed(worker_result.log_attr_trimmed)
+    for cache_name, hits, misses in worker_result.caches_statistics:
+        context.sfm.cache_statistics(cache_name, hits, misses)
+    return worker_result.transformed_record
+
+
+def _run_worker(connection: Connection, lambda_process_connection: Connection):
+    _close_inherited_connections(lambda_process_connection)
+    while True:
+        try:
+            batch_metadata, settings = connection.recv()
+            record = connection.recv_bytes()
+        except (EOFError, OSError):
+            return
+        connection.send(_transform_record(record, batch_metadata, settings))
+
+
+def _close_inherited_connections(lambda_process_connection: Connection):
+    # otherwise the worker would keep the pipes open and never see the end of its own when the Lambda process is gone
+    lambda_process_connection.close()
+    for other_worker in _workers:
+        other_worker.connection.close()
+
+
+def _transform_record(record: bytes, batch_metadata: BatchMetadata, settings: _WorkerSettings) -> _WorkerResult:
+    context = Context(settings.function_name, None, None, settings.debug, False, settings.cloud_log_forwarder,
+                      settings.max_log_length)
+    transformation_failed = False
+    try:
+        logs = extract_dt_logs_from_single_record(record, batch_metadata, context)
+        transformed_record = TransformedRecord(_trim_and_serialize_logs(logs, context),
+                                               [log.get("timestamp") for log in logs])
+    except Exception as e:
+        log_error_with_stacktrace(e, "Failed to extract log entries from record", "record-transformation-exception")
+        transformation_failed = True
+        transformed_record = FAILED_RECORD
+
+    log_content_trimmed, log_attr_trimmed = context.sfm.logs_trimmed_counts()
+    return _WorkerResult(transformed_record, transformation_failed, log_content_trimmed, log_attr_trimmed,
+                         _pop_caches_statistics())
+
+
+def _trim_and_serialize_logs(logs: List[Dict], context: Context) -> List[bytes]:
+    # entries are trimmed and serialized here, so the Lambda process only puts them into batches
+    serialized_logs = []
+    for log in logs:
+        logs_sender.ensure_fields_length(log, context)
+        serialized_logs.append(serialize_log_entry(log))
+    return serialized_logs
+
+
+def _pop_caches_statistics() -> List[Tuple[str, int, int]]:
+    caches_statistics = []
+    for cache in lru_cache.all_caches():
+        hits, misses = cache.pop_statistics()
+        if hits or misses:
+            caches_statistics.append((cache.name, hits, misses))
+    return caches_statistics
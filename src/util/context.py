@@ -12,14 +12,18 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-from typing import Text
+from typing import Callable, Optional, Text
 
 from logs.self_monitoring.sfm import SelfMonitoringContext
 
 
 class Context:
     def __init__(self, function_name: Text, dt_url: str, dt_token: str, debug: bool, verify_SSL: bool,
-                 cloud_log_forwarder: str, max_log_content_length: int):
+                 cloud_log_forwarder: str, max_log_content_length: int, upload_concurrency: int = 1,
+                 gzip_compression_level: Optional[int] = None,
+                 get_remaining_time_in_millis: Optional[Callable[[], int]] = None,
+                 minimal_firehose_response: bool = False, decode_concurrency: int = 1,
+                 transformation_processes: Optional[int] = None):
         self.function_name: Text = function_name
         self.dt_url = dt_url
         self.dt_token = dt_token
@@ -28,3 +32,12 @@ class Context:
         self.cloud_log_forwarder = cloud_log_forwarder
         self.sfm = SelfMonitoringContext(function_name)
         self.max_log_length = max_log_content_length
+        self.upload_concurrency = upload_concurrency
+        # None when request bodies are sent uncompressed
+        self.gzip_compression_level: Optional[int] = gzip_compression_level
+        # from the Lambda context, None when not running in Lambda (no time limit then)
+        self.get_remaining_time_in_millis = get_remaining_time_in_millis
+        self.minimal_firehose_response = minimal_firehose_response
+        self.decode_concurrency = decode_concurrency
+        # None when chosen for each invocation from the number of CPUs and records
+        self.transformation_processes: Optional[int] = transformation_processes
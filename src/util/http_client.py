@@ -11,55 +11,236 @@
 #   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
+import base64
+import http.client
 import ssl
+import threading
 import time
-import urllib.error
+import urllib.parse
 import urllib.request
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 from util.context import Context
 from util.logging import log_multiline_message
 
 TIMEOUT_SEC = 10
+MAX_IDLE_CONNECTIONS_PER_HOST = 8
+# ingest endpoints close keep-alive connections idle for about a minute, don't risk sending on those
+CONNECTION_MAX_IDLE_SEC = 50
 
+# errors meaning that the server closed a kept-alive connection before we sent the request on it
+STALE_CONNECTION_ERRORS = (ConnectionError, http.client.BadStatusLine, ssl.SSLEOFError, ssl.SSLZeroReturnError)
 
-def perform_http_request_for_json(url, encoded_body_bytes, method, headers, verify_SSL: bool, context: Context):
-    start_time = time.time()
 
-    print(f"Performing {method} call for URL {url}")
+class ConnectionKey(NamedTuple):
+    scheme: str
+    host: str
+    port: int
+    verify_SSL: bool
+    # from HTTPS_PROXY / HTTP_PROXY, honoured as urllib did
+    proxy: Optional[str] = None
+
+
+class _TlsSessionResumingHTTPSConnection(http.client.HTTPSConnection):
+    # HTTPSConnection doesn't offer session resumption, so the handshake is done here with the last session to the host
+
+    def __init__(self, host, port, timeout, context: ssl.SSLContext, tls_session: Optional[ssl.SSLSession]):
+        super().__init__(host, port, timeout=timeout, context=context)
+        self.tls_session = tls_session
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=self.tls_session)
+
+
+class ConnectionPool:
+    # Keeps connections open across batches and warm Lambda invocations. Connections are taken out of the pool
+    # for the time of a request, so a single connection is never used by two threads at once.
+
+    def __init__(self, max_idle_connections_per_host: int = MAX_IDLE_CONNECTIONS_PER_HOST,
+                 max_idle_sec: float = CONNECTION_MAX_IDLE_SEC):
+        self.max_idle_connections_per_host = max_idle_connections_per_host
+        self.max_idle_sec = max_idle_sec
+        self._idle_connections: Dict[ConnectionKey, List[Tuple[http.client.HTTPConnection, float]]] = {}
+        self._tls_sessions: Dict[ConnectionKey, ssl.SSLSession] = {}
+        self._ssl_contexts: Dict[bool, ssl.SSLContext] = {}
+        self._lock = threading.Lock()
+
+    def take_idle_connection(self, key: ConnectionKey) -> Optional[http.client.HTTPConnection]:
+        now = time.monotonic()
+        with self._lock:
+            idle_connections = self._idle_connections.get(key, [])
+            while idle_connections:
+                connection, idle_since = idle_connections.pop()
+                if now - idle_since <= self.max_idle_sec:
+                    return connection
+                connection.close()
+        return None
+
+    def new_connection(self, key: ConnectionKey) -> http.client.HTTPConnection:
+        host, port = key.host, key.port
+        if key.proxy:
+            split_proxy_url = urllib.parse.urlsplit(key.proxy)
+            host, port = split_proxy_url.hostname, split_proxy_url.port or http.client.HTTP_PORT
+
+        if key.scheme == "http":
+            # plain HTTP requests are sent to the proxy as they are, with the full URL
+            return http.client.HTTPConnection(host, port, timeout=TIMEOUT_SEC)
 
+        with self._lock:
+            ssl_context = self._ssl_contexts.get(key.verify_SSL)
+            if ssl_context is None:
+                ssl_context = self._ssl_contexts[key.verify_SSL] = _create_ssl_context(key.verify_SSL)
+            tls_session = self._tls_sessions.get(key)
+        connection = _TlsSessionResumingHTTPSConnection(host, port, TIMEOUT_SEC, ssl_context, tls_session)
+        if key.proxy:
+            connection.set_tunnel(key.host, key.port, _proxy_authorization_headers(key.proxy))
+        return connection
+
+    def put_back(self, key: ConnectionKey, connection: http.client.HTTPConnection):
+        tls_session = getattr(connection.sock, "session", None)
+        with self._lock:
+            if tls_session is not None:
+                self._tls_sessions[key] = tls_session
+
+            idle_connections = self._idle_connections.setdefault(key, [])
+            if len(idle_connections) < self.max_idle_connections_per_host:
+                idle_connections.append((connection, time.monotonic()))
+                return
+        connection.close()
+
+    def clear(self):
+        with self._lock:
+            for idle_connections in self._idle_connections.values():
+                for connection, _idle_since in idle_connections:
+                    connection.close()
+            self._idle_connections.clear()
+            self._tls_sessions.clear()
+
+
+connection_pool = ConnectionPool()
+
+
+def _find_proxy(scheme: str, host: str) -> Optional[str]:
+    if urllib.request.proxy_bypass(host):
+        return None
+    return urllib.request.getproxies().get(scheme)
+
+
+def _proxy_authorization_headers(proxy: str) -> Dict[str, str]:
+    split_proxy_url = urllib.parse.urlsplit(proxy)
+    if split_proxy_url.username is None:
+        return {}
+    credentials = f"{urllib.parse.unquote(split_proxy_url.username)}:" \
+                  f"{urllib.parse.unquote(split_proxy_url.password or '')}"
+    return {"Proxy-Authorization": "Basic " + base64.b64encode(credentials.encode()).decode()}
+
+
+def _create_ssl_context(verify_SSL: bool) -> ssl.SSLContext:
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
     if verify_SSL:
         ssl_context.verify_mode = ssl.CERT_REQUIRED
     else:
         ssl_context.verify_mode = ssl.CERT_NONE
+    return ssl_context
 
-    context.sfm.request_sent()
 
-    req = urllib.request.Request(
-        url,
-        encoded_body_bytes,
-        headers,
-        method=method
-    )
+def perform_http_request_for_json(url, encoded_body_bytes, method, headers, verify_SSL: bool, context: Context):
+    start_time = time.time()
+
+    print(f"Performing {method} call for URL {url}")
 
-    duration_sec = time.time() - start_time
-    duration_ms = round(duration_sec * 1000, 2)
+    context.sfm.request_sent()
 
     try:
-        with urllib.request.urlopen(req, context=ssl_context, timeout=TIMEOUT_SEC) as response:
-            status = response.code
-            body = response.read().decode("utf-8")
-    except urllib.error.HTTPError as e:
-        status = e.code
-        # body = e.read().decode("utf-8")
-        body = e.read().decode()
+        status, body, response_headers = _perform_request_on_pooled_connection(url, encoded_body_bytes, method,
+                                                                               headers, verify_SSL, context)
     except Exception as e:
         context.sfm.issue("request_failed_without_status_code")
         raise e
 
+    duration_sec = time.time() - start_time
+    duration_ms = round(duration_sec * 1000, 2)
+
     context.sfm.request_finished_with_status_code(status, duration_ms)
 
     log_multiline_message(f"Response: call duration {duration_ms}ms, status code {status}, body '{body}'",
                           "http-response-details")
-    return status, body
+    return status, body, response_headers
+
+
+def _perform_request_on_pooled_connection(url, encoded_body_bytes, method, headers, verify_SSL: bool,
+                                          context: Context):
+    key, path = _connection_key_and_path(url, verify_SSL)
+    if key.proxy and key.scheme == "http":
+        headers = {**headers, **_proxy_authorization_headers(key.proxy)}
+
+    result = _send_request_on_idle_connection(key, path, encoded_body_bytes, method, headers, context)
+    if result is None:
+        result = _send_request_on_new_connection(key, path, encoded_body_bytes, method, headers, context)
+    connection, (status, body, response_headers, keep_alive) = result
+
+    if keep_alive:
+        connection_pool.put_back(key, connection)
+    else:
+        connection.close()
+
+    return status, body, response_headers
+
+
+def _connection_key_and_path(url, verify_SSL: bool) -> Tuple[ConnectionKey, str]:
+    split_url = urllib.parse.urlsplit(url)
+    default_port = http.client.HTTP_PORT if split_url.scheme == "http" else http.client.HTTPS_PORT
+    proxy = _find_proxy(split_url.scheme, split_url.hostname)
+    key = ConnectionKey(split_url.scheme, split_url.hostname, split_url.port or default_port, verify_SSL, proxy)
+    if proxy and split_url.scheme == "http":
+        return key, url
+    path = split_url.path or "/"
+    if split_url.query:
+        path += "?" + split_url.query
+    return key, path
+
+
+def _send_request_on_idle_connection(key: ConnectionKey, path, encoded_body_bytes, method, headers,
+                                     context: Context):
+    # None if there's no idle connection or the server closed it meanwhile
+    connection = connection_pool.take_idle_connection(key)
+    if connection is None:
+        return None
+    try:
+        response = _send_request(connection, path, encoded_body_bytes, method, headers)
+    except STALE_CONNECTION_ERRORS as e:
+        connection.close()
+        log_multiline_message(f"Kept-alive connection to {key.host} was closed by the server ({e!r}), "
+                              f"reconnecting", "http-stale-connection")
+        return None
+    except Exception:
+        connection.close()
+        raise
+    context.sfm.connection_reused()
+    return connection, response
+
+
+def _send_request_on_new_connection(key: ConnectionKey, path, encoded_body_bytes, method, headers,
+                                    context: Context):
+    connection = connection_pool.new_connection(key)
+    try:
+        handshake_start_time = time.time()
+        connection.connect()
+        handshake_duration_ms = round((time.time() - handshake_start_time) * 1000, 2)
+        context.sfm.connection_established(handshake_duration_ms, getattr(connection.sock, "session_reused", False))
+
+        return connection, _send_request(connection, path, encoded_body_bytes, method, headers)
+    except Exception:
+        connection.close()
+        raise
+
+
+def _send_request(connection: http.client.HTTPConnection, path, encoded_body_bytes, method, headers):
+    connection.request(method, path, encoded_body_bytes, headers)
+    response = connection.getresponse()
+    # body must be read completely before sending the next request on the same connection
+    body = response.read().decode("utf-8")
+    return response.status, body, response.headers, not response.will_close
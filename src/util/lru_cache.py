@@ -0,0 +1,73 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Tuple
+
+_MISSING = object()
+
+_all_caches = weakref.WeakSet()
+
+
+class LruCache:
+    # Bounded cache kept on module level, so it survives warm Lambda invocations.
+    # Hits and misses are counted since the last call to pop_statistics, so they can be reported per invocation.
+
+    def __init__(self, name: str, max_size: int):
+        self.name = name
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        _all_caches.add(self)
+
+    def get(self, key: Hashable, default=None) -> Any:
+        value = self._entries.get(key, _MISSING)
+        if value is _MISSING:
+            self._misses += 1
+            return default
+
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def pop_statistics(self) -> Tuple[int, int]:
+        hits, misses = self._hits, self._misses
+        self._hits = 0
+        self._misses = 0
+        return hits, misses
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def all_caches() -> List[LruCache]:
+    return sorted(_all_caches, key=lambda cache: cache.name)
@@ -0,0 +1,108 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import base64
+import gzip
+import json
+import os
+import time
+
+from logs import input_records_decoder
+from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH
+from util.context import Context
+
+FIREHOSE_EVENT_MAX_SIZE = 6 * 1024 * 1024
+
+
+def _create_firehose_records():
+    # CloudWatch records as Firehose gets them, until the event reaches the Lambda payload limit
+    records = []
+    event_size = 0
+    record_number = 0
+    while True:
+        record_data = json.dumps({
+            "messageType": "DATA_MESSAGE",
+            "owner": "444000444",
+            "logGroup": f"/aws/lambda/function-{record_number % 10}",
+            "logStream": "2021/08/10/[$LATEST]3f24b2b8c5a64f2ba1f6a1e3a9d1f5c9",
+            "subscriptionFilters": ["filter"],
+            "logEvents": [{
+                "id": str(event_number),
+                "timestamp": 1628589446077 + event_number,
+                "message": f"2021-08-10T09:57:26.077Z {record_number}-{event_number} INFO request handled "
+                           f"in {event_number % 97}ms, {os.urandom(8).hex()}",
+            } for event_number in range(400)],
+        })
+        record = {"recordId": str(record_number), "approximateArrivalTimestamp": 1628589446077,
+                  "data": base64.b64encode(gzip.compress(record_data.encode())).decode()}
+        event_size += len(record["data"])
+        if event_size > FIREHOSE_EVENT_MAX_SIZE:
+            return records
+        records.append(record)
+        record_number += 1
+
+
+def test_decode_records_concurrently():
+    records = _create_firehose_records()
+    decoded_records_by_concurrency = {}
+    durations_sec = {}
+
+    for decode_concurrency in [1, 2, 4, 6]:
+        context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                          DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH, decode_concurrency=decode_concurrency)
+        start_sec = time.perf_counter()
+        decoded_records_by_concurrency[decode_concurrency] = list(input_records_decoder.decode_records(records, context))
+        durations_sec[decode_concurrency] = time.perf_counter() - start_sec
+
+    decompressed_size_mb = sum(len(record) for record in decoded_records_by_concurrency[1]) / 1024 / 1024
+    print(f"PERF_CHECK decoding {len(records)} records, 6MB event ({decompressed_size_mb:.0f}MB decompressed) "
+          f"on {os.cpu_count()} CPUs: " +
+          ", ".join(f"{duration_sec * 1000:.0f}ms with {decode_concurrency} threads"
+                    for decode_concurrency, duration_sec in durations_sec.items()))
+
+    for decoded_records in decoded_records_by_concurrency.values():
+        assert decoded_records == decoded_records_by_concurrency[1]
+
+
+def test_decode_records_as_bytes():
+    records = _create_firehose_records()
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                      DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH)
+
+    def decode_and_parse_as_str():
+        for record in records:
+            record_data = record["data"]
+            decoded_record_data = gzip.decompress(base64.b64decode(record_data)).decode("utf-8")
+            context.sfm.kinesis_record_decoded(len(record_data.encode("utf-8")),
+                                               len(decoded_record_data.encode("utf-8")))
+            json.loads(decoded_record_data)
+
+    def decode_and_parse_as_bytes():
+        for decoded_record_data in input_records_decoder.decode_records(records, context):
+            json.loads(decoded_record_data)
+
+    durations_sec = {decode_and_parse_as_str: [], decode_and_parse_as_bytes: []}
+    for _ in range(3):
+        for decode_and_parse in durations_sec:
+            start_sec = time.perf_counter()
+            decode_and_parse()
+            durations_sec[decode_and_parse].append(time.perf_counter() - start_sec)
+
+    duration_as_str_sec = min(durations_sec[decode_and_parse_as_str])
+    duration_as_bytes_sec = min(durations_sec[decode_and_parse_as_bytes])
+    print(f"PERF_CHECK decoding and parsing {len(records)} records: {duration_as_str_sec * 1000:.0f}ms as str before, "
+          f"{duration_as_bytes_sec * 1000:.0f}ms as bytes after")
+
+    assert [json.loads(gzip.decompress(base64.b64decode(record["data"]))) for record in records] == \
+        [json.loads(record) for record in input_records_decoder.decode_records(records, context)]
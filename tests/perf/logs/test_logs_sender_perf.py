@@ -0,0 +1,94 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import time
+import tracemalloc
+
+from logs import logs_sender
+from util.context import Context
+
+LOGS_COUNT = 20000
+
+
+def _create_logs():
+    return [{
+        "content": f"2021-08-10T09:57:26.077Z 4b2e1f0a INFO request {number} handled, user zażółć, 200 OK " * 3,
+        "cloud.provider": "aws",
+        "aws.log_group": "/aws/lambda/application-function",
+        "aws.log_stream": "2021/08/10/[$LATEST]3f24b2b8c5a64f2ba1f6a1e3a9d1f5c9",
+        "aws.region": "us-east-1",
+        "aws.account.id": "444000444",
+        "dt.source_entity": "AWS_LAMBDA_FUNCTION-1B2C3D4E5F6A7B8C",
+        "severity": "INFO",
+        "timestamp": 1628589446077 + number,
+    } for number in range(LOGS_COUNT)]
+
+
+def _legacy_prepare_and_encode_batches(logs, context):
+    # previous implementation, kept here as the baseline - batches joined from serialized strings, encoded again
+    # to measure each entry and once more for the request body
+    batches = []
+    logs_for_next_batch = []
+    logs_for_next_batch_total_len = 0
+
+    for log_entry in logs:
+        logs_sender.ensure_fields_length(log_entry, context)
+        next_entry_serialized = json.dumps(log_entry)
+        next_entry_serialized_len = len(next_entry_serialized.encode("utf-8"))
+
+        new_batch_len = logs_for_next_batch_total_len + 2 + len(logs_for_next_batch) - 1
+        batch_length_if_added_entry = new_batch_len + 1 + next_entry_serialized_len
+
+        if batch_length_if_added_entry > logs_sender.DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE or \
+                len(logs_for_next_batch) + 1 > logs_sender.DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT:
+            batches.append("[" + ",".join(logs_for_next_batch) + "]")
+            logs_for_next_batch = []
+            logs_for_next_batch_total_len = 0
+
+        logs_for_next_batch.append(next_entry_serialized)
+        logs_for_next_batch_total_len += next_entry_serialized_len
+
+    if logs_for_next_batch:
+        batches.append("[" + ",".join(logs_for_next_batch) + "]")
+
+    return [batch.encode("utf-8") for batch in batches]
+
+
+def _measure(prepare_request_bodies, logs):
+    tracemalloc.start()
+    start_sec = time.perf_counter()
+    request_bodies = prepare_request_bodies(logs)
+    duration_sec = time.perf_counter() - start_sec
+    _current, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return request_bodies, duration_sec, peak_bytes
+
+
+def test_batch_serialization_memory_and_time_per_mb():
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                      logs_sender.DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH)
+
+    legacy_bodies, legacy_duration_sec, legacy_peak_bytes = _measure(
+        lambda logs: _legacy_prepare_and_encode_batches(logs, context), _create_logs())
+    batches, duration_sec, peak_bytes = _measure(
+        lambda logs: [batch.serialized_json for batch in logs_sender.prepare_batches(logs, context)], _create_logs())
+
+    payload_mb = sum(len(body) for body in batches) / 1024 / 1024
+    print(f"PERF_CHECK batch serialization of {payload_mb:.1f}MB: "
+          f"{legacy_duration_sec / payload_mb * 1000:.1f}ms/MB, peak memory {legacy_peak_bytes / 1024 / 1024:.1f}MB "
+          f"before, {duration_sec / payload_mb * 1000:.1f}ms/MB, peak memory {peak_bytes / 1024 / 1024:.1f}MB after")
+
+    assert [bytes(body) for body in batches] == legacy_bodies
+    assert peak_bytes < legacy_peak_bytes
@@ -0,0 +1,83 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import ctypes
+import struct
+import time
+
+from logs.metadata_engine import me_id
+
+HASHES_COUNT = 20000
+
+ARNS = [f"arn:aws:lambda:us-east-1:444652832050:function:application-function-{number}" for number in range(HASHES_COUNT)]
+
+
+def _legacy_murmurhash2_64A(data: str, seed=me_id.MURMURHASH_DEFAULT_SEED) -> int:
+    # previous implementation, kept here as the baseline - every step wrapped in ctypes.c_int64
+    int64 = ctypes.c_int64
+
+    def zfrs(num, shift):
+        return int64((num & 0xFFFFFFFFFFFFFFFF) >> shift).value
+
+    buf = bytearray(data.encode("UTF-8"))
+    m = int64(0xc6a4a7935bd1e995).value
+    r = 47
+    offset = 0
+    length = len(buf)
+
+    h = int64(seed ^ (length * m)).value
+
+    while (length - offset) >= 8:
+        k = struct.unpack_from('<q', buf, offset)[0]
+        offset += 8
+
+        k = int64(k * m).value
+        k = int64(k ^ zfrs(k, r)).value
+        k = int64(k * m).value
+
+        h = int64(h ^ k).value
+        h = int64(h * m).value
+
+    remaining = length - offset
+    if remaining > 0:
+        finish = bytearray(8)
+        finish[:remaining] = buf[offset:]
+
+        h = int64(h ^ struct.unpack_from('<q', finish)[0]).value
+        h = int64(h * m).value
+
+    h = int64(h ^ zfrs(h, r)).value
+    h = int64(h * m).value
+    h = int64(h ^ zfrs(h, r)).value
+    return h
+
+
+def test_murmurhash_hashes_per_second():
+    start_sec = time.perf_counter()
+    legacy_hashes = [_legacy_murmurhash2_64A(arn) for arn in ARNS]
+    legacy_hashes_per_sec = HASHES_COUNT / (time.perf_counter() - start_sec)
+
+    start_sec = time.perf_counter()
+    hashes = [me_id._murmurhash2_64A(arn) for arn in ARNS]
+    hashes_per_sec = HASHES_COUNT / (time.perf_counter() - start_sec)
+
+    start_sec = time.perf_counter()
+    batch_hashes = me_id.murmurhash2_64A_batch(ARNS)
+    batch_hashes_per_sec = HASHES_COUNT / (time.perf_counter() - start_sec)
+
+    print(f"PERF_CHECK murmurhash2_64A: {legacy_hashes_per_sec:.0f} hashes/s before, {hashes_per_sec:.0f} hashes/s after, "
+          f"{batch_hashes_per_sec:.0f} hashes/s in batch (numpy {'available' if me_id.numpy else 'not available'})")
+
+    assert hashes == legacy_hashes
+    assert batch_hashes == legacy_hashes
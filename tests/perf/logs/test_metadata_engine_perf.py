@@ -0,0 +1,133 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import time
+
+import pytest
+
+from logs.metadata_engine import metadata_engine
+from logs.metadata_engine.jmespath import JMESPATH_OPTIONS, jmespath_parser
+
+EVENTS_COUNT = 5000
+
+CLOUDTRAIL_LOG_CONTENT = json.dumps({
+    "eventVersion": "1.08",
+    "userIdentity": {
+        "type": "AssumedRole",
+        "arn": "arn:aws:iam::444000444:user/somemonitoringuser",
+        "accountId": "444000444",
+    },
+    "eventSource": "rds.amazonaws.com",
+    "eventName": "DescribeEvents",
+    "errorCode": "AccessDenied",
+    "awsRegion": "us-east-1",
+})
+
+
+@pytest.mark.parametrize("testcase", [
+    pytest.param({
+        "log_group": "/aws/lambda/dynatrace-aws-logs-Lambda-1K7HG2Q2LIQKU",
+        "content": "[ERROR] 2021-08-10T09:57:26.077Z Task timed out after 3.00 seconds",
+    }, id="lambda"),
+    pytest.param({
+        "log_group": "aws-cloudtrail-logs-444000444-2b4e4b5a",
+        "content": CLOUDTRAIL_LOG_CONTENT,
+    }, id="cloudtrail"),
+])
+def test_attribute_evaluation_events_per_second(testcase: dict):
+    engine = metadata_engine.MetadataEngine()
+    record = {
+        "log_stream": "2021/08/10/[$LATEST]3f24b2b8c5a64f2ba1f6a1e3a9d1f5c9",
+        "log_group": testcase["log_group"],
+        "region": "us-east-1",
+        "partition": "aws",
+        "account_id": "444000444",
+    }
+    rule = next(rule for rule in engine.rules if metadata_engine._check_if_rule_applies(rule, record, {}))
+
+    evaluation_record = dict(record)
+    if rule.aws_loggroup_pattern:
+        evaluation_record.update(metadata_engine.parse_aws_loggroup_with_grok_pattern(record["log_group"],
+                                                                                      rule.aws_loggroup_pattern))
+    if rule.log_content_parse_type == "json":
+        evaluation_record["log_content"] = json.loads(testcase["content"])
+    else:
+        evaluation_record["log_content"] = testcase["content"]
+
+    def parse_on_each_event():
+        for attribute in rule.attributes:
+            jmespath_parser.parse(attribute.pattern).search(evaluation_record, JMESPATH_OPTIONS)
+
+    def compiled_at_load_time():
+        for attribute in rule.attributes:
+            attribute.expression.search(evaluation_record, JMESPATH_OPTIONS)
+
+    before_events_per_sec = _measure_events_per_second(parse_on_each_event)
+    after_events_per_sec = _measure_events_per_second(compiled_at_load_time)
+    full_apply_events_per_sec = _measure_events_per_second(
+        lambda: engine.apply(dict(record), {"content": testcase["content"]}))
+    prepared_rule = engine.prepare_rule(record)
+    prepared_apply_events_per_sec = _measure_events_per_second(
+        lambda: engine.apply(dict(record), {"content": testcase["content"]}, prepared_rule))
+
+    print(f"PERF_CHECK {rule.entity_type_name}: attribute evaluation {before_events_per_sec:.0f} events/s before, "
+          f"{after_events_per_sec:.0f} events/s after, full rule engine {full_apply_events_per_sec:.0f} events/s, "
+          f"with rule prepared once per record {prepared_apply_events_per_sec:.0f} events/s")
+
+    output = {"content": testcase["content"]}
+    engine.apply(dict(record), output)
+    assert output.get("aws.service") is not None
+
+
+def _measure_events_per_second(evaluate_single_event) -> float:
+    start_sec = time.perf_counter()
+    for _ in range(EVENTS_COUNT):
+        evaluate_single_event()
+    duration_sec = time.perf_counter() - start_sec
+    return EVENTS_COUNT / duration_sec
+
+
+@pytest.mark.parametrize("rules_count", [10, 100, 1000])
+def test_rule_dispatch_scaling(rules_count: int):
+    rules = []
+    for rule_number in range(rules_count):
+        condition = ["$prefix('/aws/custom-{}/')", "$eq('custom-log-group-{}')", "$contains('-custom-{}-')"][rule_number % 3]
+        rules.extend(metadata_engine._create_config_rules({
+            "name": f"CUSTOM_{rule_number}",
+            "rules": [{"sources": [{"source": "log_group", "condition": condition.format(rule_number)}], "attributes": []}],
+        }))
+    rule_index = metadata_engine.RuleIndex(rules)
+
+    # worst case for checking the rules in order - only the last prefix rule or none matching
+    last_prefix_rule_number = (rules_count - 1) // 3 * 3
+    log_groups = [f"/aws/custom-{last_prefix_rule_number}/application", "/aws/lambda/not-matching-any-custom-rule"]
+    lookups_count = 2000
+
+    start_sec = time.perf_counter()
+    for i in range(lookups_count):
+        record = {"log_group": log_groups[i % 2]}
+        linear_rule = next((rule for rule in rules if metadata_engine._check_if_rule_applies(rule, record, {})), None)
+    linear_lookups_per_sec = lookups_count / (time.perf_counter() - start_sec)
+
+    start_sec = time.perf_counter()
+    for i in range(lookups_count):
+        indexed_rule = rule_index.find_first_matching_rule(log_groups[i % 2])
+    indexed_lookups_per_sec = lookups_count / (time.perf_counter() - start_sec)
+
+    print(f"PERF_CHECK {rules_count} rules: {linear_lookups_per_sec:.0f} lookups/s checking rules in order, "
+          f"{indexed_lookups_per_sec:.0f} lookups/s with rule index")
+
+    assert indexed_rule is linear_rule
+    assert rule_index.find_first_matching_rule(log_groups[0]) is rules[last_prefix_rule_number]
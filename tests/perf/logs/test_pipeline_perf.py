@@ -0,0 +1,133 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import base64
+import gzip
+import json
+import multiprocessing
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+import index
+from logs import event_sources, input_records_decoder, logs_sender, main
+from util import http_client
+
+
+class _DelayedIngestRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.response_delay_sec)
+        response_body = b'{"status": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve_ingest(port_connection, response_delay_sec):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _DelayedIngestRequestHandler)
+    server.daemon_threads = True
+    server.response_delay_sec = response_delay_sec
+    port_connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+@pytest.fixture
+def delayed_ingest_server_url(request):
+    # fake ingest server answering after the latency given, in another process like a remote one would be,
+    # so that it doesn't take the GIL from the forwarder
+    port_connection, server_port_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(target=_serve_ingest, args=(server_port_connection, request.param),
+                                             daemon=True)
+    server_process.start()
+    http_client.connection_pool.clear()
+    yield f"http://127.0.0.1:{port_connection.recv()}"
+    http_client.connection_pool.clear()
+    server_process.kill()
+    server_process.join()
+
+
+def _create_firehose_record(record_number):
+    message = "2021-04-26T09:35:17.000Z INFO request handled " + "x" * 200
+    record_data = json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "owner": "444652832050",
+        "logGroup": f"/aws/lambda/function-{record_number}",
+        "logStream": "2021/04/26/[$LATEST]a1b2c3",
+        "subscriptionFilters": ["filter"],
+        "logEvents": [{"id": str(event_number), "timestamp": 1619427317000 + event_number, "message": message}
+                      for event_number in range(500)],
+    })
+    return {"recordId": str(record_number), "approximateArrivalTimestamp": 1619427317606,
+            "data": base64.b64encode(gzip.compress(record_data.encode())).decode()}
+
+
+@pytest.mark.parametrize("delayed_ingest_server_url", [0.025, 0.1], indirect=True,
+                         ids=["25ms latency", "100ms latency"])
+def test_pipeline_overlaps_decoding_and_transformation_with_uploads(delayed_ingest_server_url):
+    records = [_create_firehose_record(record_number) for record_number in range(40)]
+    lambda_event = {
+        "deliveryStreamArn": "arn:aws:firehose:us-east-1:444652832050:deliverystream/b-FirehoseLogStreams",
+        "region": "us-east-1",
+        "records": records,
+    }
+    lambda_context = SimpleNamespace(function_name="my-function-name")
+
+    def run_in_stages():
+        response = index.handler(lambda_event, lambda_context)
+        assert [record["result"] for record in response["records"]] == ["Ok"] * len(records)
+
+    def run_phase_after_phase():
+        # as it used to be: all records decoded, then transformed, then batched and then sent one after another
+        context = index.get_context(lambda_context)
+        decoded_records = list(input_records_decoder.decode_records(records, context))
+        transformed_records = list(main.transform_records(decoded_records, event_sources.read_batch_metadata(lambda_event),
+                                                          context))
+        batches = logs_sender.prepare_batches([log for record in transformed_records for log in record.logs],
+                                              context)
+        full_url = logs_sender.prepare_full_url(context.dt_url, logs_sender.LOGS_API_PATH)
+        headers = {"Authorization": f"Api-Token {context.dt_token}",
+                   "Content-Type": "application/json; charset=utf-8"}
+        for batch_index, batch in enumerate(batches):
+            logs_sender.push_batch(batch, batch_index, full_url, headers, False, context)
+
+    durations_sec = {run_in_stages: [], run_phase_after_phase: []}
+    environment = {"DYNATRACE_ENV_URL": delayed_ingest_server_url, "DYNATRACE_API_KEY": "token"}
+    with mock.patch.dict(os.environ, environment), mock.patch("boto3.client"):
+        # warm up caches of the metadata engine and connections
+        run_in_stages()
+        for _ in range(3):
+            for run in durations_sec:
+                start_sec = time.perf_counter()
+                run()
+                durations_sec[run].append(time.perf_counter() - start_sec)
+
+    duration_in_stages_sec = min(durations_sec[run_in_stages])
+    duration_phase_after_phase_sec = min(durations_sec[run_phase_after_phase])
+    print(f"PERF_CHECK pipeline of {len(records)} records (20000 entries, ~6MB of batches): "
+          f"{duration_phase_after_phase_sec * 1000:.0f}ms phase after phase, "
+          f"{duration_in_stages_sec * 1000:.0f}ms with stages overlapping")
+
+    assert duration_in_stages_sec < duration_phase_after_phase_sec
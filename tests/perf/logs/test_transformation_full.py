@@ -20,6 +20,7 @@ import pytest
 import logs.main
 import logs.transformation
 from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import serialize_log_entry
 from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH
 from util.context import Context
 
@@ -125,3 +126,83 @@ def test_full_transformation(testcase: dict):
         else:
             assert first_log.get(k,
                                  None) == expected_value, f"key={k}, expected value={expected_value}, actual={first_log.get(k, None)}"
+
+
+@pytest.mark.parametrize("log_group", [
+    "/aws/lambda/dynatrace-aws-logs-Lambda-1K7HG2Q2LIQKU",
+    "/aws/rds/cluster/aurora-postresql/postgresql",
+    "custom-application-logs",
+])
+def test_log_entries_serialization(log_group: str):
+    record_data_decoded = json.dumps({
+        "logGroup": log_group,
+        "logStream": "aurora-postresql-instance-1.0",
+        "messageType": "DATA_MESSAGE",
+        "owner": "444000444",
+        "subscriptionFilters": ["filter"],
+        "logEvents": [{
+            "id": str(event_number),
+            "timestamp": 1628589446077 + event_number,
+            "message": f"2021-08-10 09:20:53 UTC::@:[7701]:WARNING:  request {event_number} took 200ms",
+        } for event_number in range(10000)],
+    }).encode()
+    logs_sent = logs.transformation.extract_dt_logs_from_single_record(record_data_decoded, BATCH_METADATA, CONTEXT)
+
+    start_sec = time.perf_counter()
+    serialized_with_json_dumps = [json.dumps(log).encode() for log in logs_sent]
+    json_dumps_duration_sec = time.perf_counter() - start_sec
+
+    start_sec = time.perf_counter()
+    serialized_with_record_attributes = [serialize_log_entry(log) for log in logs_sent]
+    duration_sec = time.perf_counter() - start_sec
+
+    print(f"PERF_CHECK {log_group}: serialization {len(logs_sent) / json_dumps_duration_sec:.0f} entries/s "
+          f"with json.dumps, {len(logs_sent) / duration_sec:.0f} entries/s splicing serialized record attributes")
+
+    assert serialized_with_record_attributes == serialized_with_json_dumps
+
+
+@pytest.mark.parametrize("message_template", [
+    pytest.param("2021-08-10T09:57:26.077Z 4b2e1f0a-5f9d INFO Request handled in 23ms for path /api/v1/items ",
+                 id="plain_text"),
+    pytest.param('{"level": "INFO", "path": "/api/v1/items", "durationMs": 23} ', id="json"),
+])
+def test_multi_kb_messages_passthrough(message_template: str):
+    record_data_decoded = json.dumps({
+        "logGroup": "custom-application-logs",
+        "logStream": "instance-1",
+        "messageType": "DATA_MESSAGE",
+        "owner": "444000444",
+        "subscriptionFilters": ["filter"],
+        "logEvents": [{
+            "id": str(event_number),
+            "timestamp": 1628589446077 + event_number,
+            "message": message_template * 40 + str(event_number),
+        } for event_number in range(2000)],
+    }).encode()
+
+    def extract_and_serialize(passthrough: bool):
+        start_sec = time.perf_counter()
+        logs_sent = logs.transformation.extract_dt_logs_from_single_record(record_data_decoded, BATCH_METADATA,
+                                                                          CONTEXT)
+        if not passthrough:
+            for log in logs_sent:
+                log.escaped_content = None
+        serialized_logs = [serialize_log_entry(log) for log in logs_sent]
+        return serialized_logs, time.perf_counter() - start_sec
+
+    # warm up caches of the metadata engine
+    extract_and_serialize(True)
+
+    durations_sec = {True: [], False: []}
+    for _ in range(5):
+        for passthrough in (False, True):
+            serialized_logs, duration_sec = extract_and_serialize(passthrough)
+            durations_sec[passthrough].append(duration_sec)
+
+    print(f"PERF_CHECK {len(message_template) * 40}B messages: extraction and serialization "
+          f"{min(durations_sec[False]) * 1000:.1f}ms escaping messages again, "
+          f"{min(durations_sec[True]) * 1000:.1f}ms passing through escaped messages")
+
+    logs_sent = logs.transformation.extract_dt_logs_from_single_record(record_data_decoded, BATCH_METADATA, CONTEXT)
+    assert serialized_logs == [json.dumps(log).encode() for log in logs_sent]
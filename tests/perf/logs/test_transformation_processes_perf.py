@@ -0,0 +1,91 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import os
+import platform
+import time
+
+from logs import main, transformation_processes
+from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH, ensure_fields_length
+from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import serialize_log_entry
+from util.context import Context
+
+BATCH_METADATA = BatchMetadata("444000444", "us-east-1", "aws")
+
+
+def _create_records():
+    # records of a Firehose event close to the Lambda payload limit, from Lambda and RDS log groups
+    return [json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "owner": "444000444",
+        "logGroup": f"/aws/lambda/function-{record_number % 10}" if record_number % 2 else
+                    "/aws/rds/cluster/aurora-postresql/postgresql",
+        "logStream": "2021/08/10/[$LATEST]3f24b2b8c5a64f2ba1f6a1e3a9d1f5c9",
+        "subscriptionFilters": ["filter"],
+        "logEvents": [{
+            "id": str(event_number),
+            "timestamp": 1628589446077 + event_number,
+            "message": f"2021-08-10 09:20:53 UTC::@:[7701]:WARNING:  request {record_number}-{event_number} "
+                       f"handled in {event_number % 97}ms",
+        } for event_number in range(400)],
+    }).encode() for record_number in range(200)]
+
+
+def test_transformation_in_processes_scaling():
+    records = _create_records()
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                      DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH)
+
+    def transform_in_this_process():
+        serialized_logs = []
+        for transformed_record in main.transform_records(records, BATCH_METADATA, context):
+            for log in transformed_record.logs:
+                ensure_fields_length(log, context)
+                serialized_logs.append(serialize_log_entry(log))
+        return serialized_logs
+
+    def transform_in_processes(processes_count):
+        return [serialized_log
+                for transformed_record in transformation_processes.transform_records_in_processes(
+                    records, BATCH_METADATA, context, processes_count)
+                for serialized_log in transformed_record.logs]
+
+    processes_counts = [1, 2, 4]
+    try:
+        # workers are kept warm across invocations, starting them isn't measured
+        transform_in_this_process()
+        transform_in_processes(max(processes_counts))
+
+        start_sec = time.perf_counter()
+        serialized_logs = transform_in_this_process()
+        duration_in_this_process_sec = time.perf_counter() - start_sec
+
+        durations_sec = {}
+        for processes_count in processes_counts:
+            start_sec = time.perf_counter()
+            assert transform_in_processes(processes_count) == serialized_logs
+            durations_sec[processes_count] = time.perf_counter() - start_sec
+    finally:
+        transformation_processes.stop_workers()
+
+    logs_count = len(serialized_logs)
+    print(f"PERF_CHECK transformation of {len(records)} records ({logs_count} entries) on {platform.system()} with "
+          f"{os.cpu_count()} CPUs: {logs_count / duration_in_this_process_sec:.0f} entries/s in the Lambda process, " +
+          ", ".join(f"{logs_count / duration_sec:.0f} entries/s in {processes_count} processes"
+                    for processes_count, duration_sec in durations_sec.items()))
+
+    if (os.cpu_count() or 1) >= 2:
+        assert durations_sec[2] < duration_in_this_process_sec
@@ -0,0 +1,92 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from util import http_client
+
+
+class _FakeIngestRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, avoids delayed ACK waits on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.connections_count += 1
+
+    def do_POST(self):
+        with self.server.lock:
+            self.server.requests_in_flight += 1
+            self.server.max_requests_in_flight = max(self.server.max_requests_in_flight,
+                                                     self.server.requests_in_flight)
+        try:
+            self._respond()
+        finally:
+            with self.server.lock:
+                self.server.requests_in_flight -= 1
+
+    def _respond(self):
+        if self.server.response_delay_sec:
+            time.sleep(self.server.response_delay_sec)
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.bodies.append(body)
+        self.server.paths.append(self.path)
+        self.server.request_headers.append(self.headers)
+        response_body = b'{"status": "ok"}'
+        if self.server.response_status_for_body:
+            self.send_response(self.server.response_status_for_body(body))
+        else:
+            self.send_response(self.server.response_status)
+        self.send_header("Content-Length", str(len(response_body)))
+        for name, value in self.server.response_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(response_body)
+        # closes the socket without announcing it in the response, like a server timing out an idle connection
+        self.close_connection = self.server.close_after_response
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def ingest_server():
+    # local HTTP server standing in for the logs ingest API, it records request bodies and counts connections
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeIngestRequestHandler)
+    server.daemon_threads = True
+    server.connections_count = 0
+    server.lock = threading.Lock()
+    # peak number of requests handled at the same time
+    server.requests_in_flight = 0
+    server.max_requests_in_flight = 0
+    server.bodies = []
+    server.paths = []
+    server.request_headers = []
+    server.response_status = 200
+    server.response_status_for_body = None
+    server.response_headers = {}
+    server.close_after_response = False
+    server.response_delay_sec = 0
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True)
+    thread.start()
+    http_client.connection_pool.clear()
+    yield server
+    http_client.connection_pool.clear()
+    server.shutdown()
+    server.server_close()
@@ -12,14 +12,19 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import base64
+import gzip
 import json
 import os
+import tracemalloc
 import pytest
 from types import SimpleNamespace
 from unittest import mock
 from unittest.mock import patch
 
 import index
+from logs import event_sources, transformation_processes
+from logs.input_records_decoder import BadSchemaError
 
 
 @mock.patch.dict(
@@ -87,7 +92,7 @@ def test_full_flow(testcase: dict):
     number_of_logs_expected = testcase["number_of_logs_expected"]
     lambda_context = SimpleNamespace(function_name="my-function-name")
 
-    client_response = (200, "BODY")
+    client_response = (200, "BODY", {})
 
     with patch('util.http_client.perform_http_request_for_json', return_value=client_response) as mock_http_client:
         with patch('boto3.client'):
@@ -112,3 +117,237 @@ def test_full_flow(testcase: dict):
 
     for log in sent_logs:
         assert log["cloud.log_forwarder"] == "444652832050:us-east-1:log_forwarder"
+
+
+def _firehose_record(record_id, data: bytes, compress=True):
+    if compress:
+        data = gzip.compress(data)
+    return {
+        "recordId": record_id,
+        "approximateArrivalTimestamp": 1619427317606,
+        "data": base64.b64encode(data).decode(),
+    }
+
+
+def _logs_record(record_id, log_group, messages):
+    return _firehose_record(record_id, json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "owner": "444652832050",
+        "logGroup": log_group,
+        "logStream": "2021/04/26/[$LATEST]a1b2c3",
+        "subscriptionFilters": ["filter"],
+        "logEvents": [{"id": str(i), "timestamp": 1619427317000, "message": message}
+                      for i, message in enumerate(messages)],
+    }).encode())
+
+
+MIXED_RECORDS_EVENT = {
+    "invocationId": "1545b29a-10ca-4f7f-a60f-54195607c98d",
+    "deliveryStreamArn": "arn:aws:firehose:us-east-1:444652832050:deliverystream/b-FirehoseLogStreams-lbcTAGyNE8hz",
+    "region": "us-east-1",
+    "records": [
+        _logs_record("delivered", "/aws/lambda/first", ["first 1", "first 2"]),
+        _firehose_record("control", json.dumps({"messageType": "CONTROL_MESSAGE", "logEvents": []}).encode()),
+        _firehose_record("corrupted-gzip", b"\x1f\x8b\x08\x00 not really gzip", compress=False),
+        _firehose_record("not-json", b"{not json"),
+        _logs_record("spanning-batches", "/aws/lambda/second", ["second 1", "second 2", "second 3"]),
+        _logs_record("in-failed-batch", "/aws/lambda/third", ["third 1"]),
+    ]
+}
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+        "CLOUD_LOG_FORWARDER": "444652832050:us-east-1:log_forwarder"
+    })
+@pytest.mark.parametrize("upload_concurrency", ["1", "3"])
+@pytest.mark.parametrize("transformation_processes_count", ["1", "2"])
+def test_full_flow_per_record_results(upload_concurrency, transformation_processes_count):
+    lambda_context = SimpleNamespace(function_name="my-function-name")
+
+    def respond(url, body, *args):
+        # batches of up to 3 entries: [first 1, first 2, second 1], [second 2, second 3, third 1]
+        return (500 if b"third 1" in body else 200), "BODY", {}
+
+    with mock.patch.dict(os.environ, {"UPLOAD_CONCURRENCY": upload_concurrency,
+                                      "TRANSFORMATION_PROCESSES": transformation_processes_count}), \
+            patch("logs.logs_sender.DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 3), \
+            patch("logs.logs_sender.DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE", 1048576), \
+            patch("util.http_client.perform_http_request_for_json", side_effect=respond) as mock_http_client, \
+            patch("boto3.client"):
+        response = index.handler(MIXED_RECORDS_EVENT, lambda_context)
+    transformation_processes.stop_workers()
+
+    assert mock_http_client.call_count == 2
+    assert {record["recordId"]: record["result"] for record in response["records"]} == {
+        "delivered": "Ok",
+        "control": "Dropped",
+        "corrupted-gzip": "ProcessingFailed",
+        "not-json": "ProcessingFailed",
+        "spanning-batches": "ProcessingFailed",
+        "in-failed-batch": "ProcessingFailed",
+    }
+    assert [record["data"] for record in response["records"]] == \
+           [record["data"] for record in MIXED_RECORDS_EVENT["records"]]
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+    })
+def test_full_flow_all_records_failed_on_unrecognized_input():
+    lambda_event = dict(MIXED_RECORDS_EVENT, records=[_firehose_record("plain", b"plain text", compress=False),
+                                                       _logs_record("logs", "/aws/lambda/first", ["first 1"])])
+
+    with patch("util.http_client.perform_http_request_for_json") as mock_http_client, patch("boto3.client"):
+        response = index.handler(lambda_event, SimpleNamespace(function_name="my-function-name"))
+
+    assert mock_http_client.call_count == 0
+    assert [record["result"] for record in response["records"]] == ["ProcessingFailed", "ProcessingFailed"]
+
+
+def _respond_failing_third(url, body, *args):
+    return (500 if b"third 1" in body else 200), "BODY", {}
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+    })
+def test_full_flow_kinesis_data_streams_partial_batch_failures():
+    lambda_event = {"Records": [{
+        "kinesis": {
+            "kinesisSchemaVersion": "1.0",
+            "partitionKey": "7b5e9f2c4d",
+            "sequenceNumber": record["recordId"],
+            "data": record["data"],
+            "approximateArrivalTimestamp": 1619427317.606,
+        },
+        "eventSource": "aws:kinesis",
+        "eventVersion": "1.0",
+        "eventID": f"shardId-000000000000:{record['recordId']}",
+        "eventName": "aws:kinesis:record",
+        "awsRegion": "us-east-1",
+        "eventSourceARN": "arn:aws:kinesis:us-east-1:444652832050:stream/dynatrace-logs",
+    } for record in MIXED_RECORDS_EVENT["records"]]}
+
+    with patch("logs.logs_sender.DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 3), \
+            patch("util.http_client.perform_http_request_for_json", side_effect=_respond_failing_third) \
+            as mock_http_client, patch("boto3.client"):
+        response = index.handler(lambda_event, SimpleNamespace(function_name="my-function-name"))
+
+    assert mock_http_client.call_count == 2
+    assert response == {"batchItemFailures": [{"itemIdentifier": record_id} for record_id in
+                                              ["corrupted-gzip", "not-json", "spanning-batches", "in-failed-batch"]]}
+    sent_logs = json.loads(mock_http_client.call_args_list[0][0][1])
+    assert sent_logs[0]["aws.account.id"] == "444652832050"
+    assert sent_logs[0]["aws.region"] == "us-east-1"
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+    })
+def test_full_flow_sqs_partial_batch_failures():
+    records = [_logs_record("wrapped", "/aws/lambda/first", ["first 1"]),
+               _logs_record("raw", "/aws/lambda/second", ["second 1"]),
+               _logs_record("failed", "/aws/lambda/third", ["third 1"])]
+    bodies = [json.dumps({"awslogs": {"data": records[0]["data"]}}), records[1]["data"],
+              json.dumps({"awslogs": {"data": records[2]["data"]}})]
+    lambda_event = {"Records": [{
+        "messageId": record["recordId"],
+        "receiptHandle": "AQEBwJnKyrHigUMZj6rYigCgxlaS3SLy0a",
+        "body": body,
+        "attributes": {"ApproximateReceiveCount": "1", "SentTimestamp": "1619427317606"},
+        "messageAttributes": {},
+        "eventSource": "aws:sqs",
+        "eventSourceARN": "arn:aws:sqs:us-east-1:444652832050:dynatrace-logs",
+        "awsRegion": "us-east-1",
+    } for record, body in zip(records, bodies)]}
+
+    with patch("logs.logs_sender.DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 1), \
+            patch("util.http_client.perform_http_request_for_json", side_effect=_respond_failing_third) \
+            as mock_http_client, patch("boto3.client"):
+        response = index.handler(lambda_event, SimpleNamespace(function_name="my-function-name"))
+
+    assert mock_http_client.call_count == 3
+    assert response == {"batchItemFailures": [{"itemIdentifier": "failed"}]}
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+    })
+@pytest.mark.parametrize("status_code", [200, 500])
+def test_full_flow_cloudwatch_logs_subscription(status_code):
+    lambda_event = {"awslogs": {"data": _logs_record("logs", "/aws/lambda/first", ["first 1"])["data"]}}
+    lambda_context = SimpleNamespace(
+        function_name="my-function-name",
+        invoked_function_arn="arn:aws:lambda:eu-west-1:444652832050:function:dynatrace-aws-logs")
+
+    with patch("util.http_client.perform_http_request_for_json", return_value=(status_code, "BODY", {})) \
+            as mock_http_client, patch("boto3.client"):
+        if status_code == 200:
+            assert index.handler(lambda_event, lambda_context) is None
+        else:
+            # for Lambda to retry the asynchronous invocation
+            with pytest.raises(event_sources.RecordsProcessingFailedError):
+                index.handler(lambda_event, lambda_context)
+
+    assert mock_http_client.call_count == 1
+    sent_logs = json.loads(mock_http_client.call_args[0][1])
+    assert sent_logs[0]["content"] == "first 1"
+    assert sent_logs[0]["aws.region"] == "eu-west-1"
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+    })
+def test_full_flow_unknown_event_rejected():
+    with pytest.raises(BadSchemaError):
+        index.handler({"Records": [{"eventSource": "aws:s3"}]}, SimpleNamespace(function_name="my-function-name"))
+
+
+@mock.patch.dict(
+    os.environ, {
+        "DYNATRACE_ENV_URL": "https://google.com",
+        "DYNATRACE_API_KEY": "token",
+    })
+@pytest.mark.parametrize("upload_concurrency", ["1", "4"])
+def test_full_flow_memory_bounded_by_batch_size(upload_concurrency):
+    request_max_size = 256 * 1024
+    message = "2021-04-26T09:35:17.000Z INFO request handled " + "x" * 400
+    records = [_logs_record(str(record_number), f"/aws/lambda/function-{record_number}", [message] * 200)
+               for record_number in range(40)]
+    lambda_event = dict(MIXED_RECORDS_EVENT, records=records)
+    sent_logs_count = 0
+
+    def respond(url, body, *args):
+        nonlocal sent_logs_count
+        sent_logs_count += body.count(b'"content"')
+        return 200, "", {}
+
+    # tracemalloc sees only this process, records are transformed in it
+    with mock.patch.dict(os.environ, {"UPLOAD_CONCURRENCY": upload_concurrency, "TRANSFORMATION_PROCESSES": "1"}), \
+            patch("logs.logs_sender.DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 5000), \
+            patch("logs.logs_sender.DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE", request_max_size), \
+            patch("util.http_client.perform_http_request_for_json", new=respond), \
+            patch("boto3.client"):
+        tracemalloc.start()
+        response = index.handler(lambda_event, SimpleNamespace(function_name="my-function-name"))
+        _current, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    assert [record["result"] for record in response["records"]] == ["Ok"] * len(records)
+    assert sent_logs_count == 40 * 200
+    # ~4MB of log entries sent (over 30MB peak when kept in memory all at once), memory needed is for a single record
+    # and the batches being prepared and sent
+    assert peak_bytes < (int(upload_concurrency) + 2) * request_max_size + 2 * 1024 * 1024
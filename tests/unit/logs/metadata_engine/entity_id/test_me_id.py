@@ -12,6 +12,8 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import pytest
+
 from logs.metadata_engine import me_id, jmespath
 from logs.metadata_engine.jmespath import format_required
 
@@ -116,3 +118,44 @@ def test_meid_credentials_v2_supporting_service_lambda__murmurhash():
     assert meid == "CUSTOM_DEVICE-D80AC458A044EBBE"
     assert meid == meid_from_list
 
+
+
+def test_meid_memoized_by_entity_type_input_and_seed():
+    me_id.meid_cache.clear()
+    me_id.meid_cache.pop_statistics()
+    arn = "arn:aws:rds:us-east-1:908047316593:db:belu-metadata-database-1-instance-1"
+
+    assert me_id.meid_murmurhash_awsseed("RELATIONAL_DATABASE_SERVICE", arn) == "RELATIONAL_DATABASE_SERVICE-6589F64CAEB0C298"
+    assert me_id.meid_murmurhash_awsseed("RELATIONAL_DATABASE_SERVICE", arn) == "RELATIONAL_DATABASE_SERVICE-6589F64CAEB0C298"
+    assert me_id.meid_murmurhash("RELATIONAL_DATABASE_SERVICE", arn) == "RELATIONAL_DATABASE_SERVICE-4C1091275954C200"
+    assert me_id.meid_md5("RELATIONAL_DATABASE_SERVICE", arn) != me_id.meid_murmurhash("RELATIONAL_DATABASE_SERVICE", arn)
+    assert me_id.meid_md5("RELATIONAL_DATABASE_SERVICE", None) is None
+
+    assert len(me_id.meid_cache) == 3
+    assert me_id.meid_cache.pop_statistics() == (2, 3)
+
+
+MURMURHASH_BATCH_INPUTS = [
+    "",
+    "a",
+    "lambda",
+    "12345678",
+    "lambdaarn:aws:lambda:us-east-1:444652832050:function:metricstreamprocessorinte-CloudWatchStreamFunction-bpIv5lY7e0k8",
+    "arn:aws:rds:us-east-1:908047316593:db:belu-metadata-database-1-instance-1",
+    "zażółć gęślą jaźń",
+]
+
+
+@pytest.mark.parametrize("numpy_available", [True, False])
+def test_murmurhash_batch_same_as_single(monkeypatch, numpy_available: bool):
+    if numpy_available:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(me_id, "numpy", None)
+
+    for seed in [me_id.MURMURHASH_DEFAULT_SEED, me_id.MURMURHASH_AWS_SEED]:
+        expected = [me_id._murmurhash2_64A(data, seed=seed) for data in MURMURHASH_BATCH_INPUTS]
+        assert me_id.murmurhash2_64A_batch(MURMURHASH_BATCH_INPUTS, seed=seed) == expected
+
+    assert me_id.murmurhash2_64A_batch([]) == []
+    assert me_id.murmurhash2_64A_batch(MURMURHASH_BATCH_INPUTS[4:5]) == [-2879273126824973378]
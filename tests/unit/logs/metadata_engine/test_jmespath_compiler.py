@@ -0,0 +1,137 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import itertools
+import json
+import os
+
+import pytest
+
+from logs.metadata_engine import metadata_engine
+from logs.metadata_engine.jmespath import JMESPATH_OPTIONS, jmespath_parser
+from logs.metadata_engine.jmespath_compiler import compile_expression
+
+CONFIG_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(metadata_engine.__file__)), "../..", "config")
+
+LOG_GROUPS = [
+    "/aws/lambda/my-function",
+    "/aws/apprunner/my-service/0123456789abcdef/application",
+    "/aws/rds/instance/database-1/postgresql",
+    "/aws/rds/instance/database-1/slowquery",
+    "/aws/rds/cluster/aurora-mysql/general",
+    "API-Gateway-Execution-Logs_8zcb3dxf4l/DEV",
+    "sns/us-east-1/444000444/sample-sns-logs-generator/Failure",
+    "aws-cloudtrail-logs-444000444-2b4e4b5a",
+]
+
+LOG_CONTENTS = [
+    "[ERROR] something failed",
+    "ERROR: something failed",
+    "WARN: be careful",
+    "2021-08-10 10:00:00 UTC::@:[1]:WARNING: be careful",
+    "2021-08-10 10:00:00 UTC::@:[1]:ERROR: something failed",
+    "2021-08-10T09:57:26.077268Z 2 [Warning] be careful",
+    "2021-08-10T09:57:26.077268Z 2 [Error] something failed",
+    "",
+    None,
+    {"eventName": "DescribeEvents", "userIdentity": {"arn": "arn:aws:iam::444000444:user/someone"}},
+    {"eventName": "DescribeEvents", "errorCode": "AccessDenied"},
+    {"eventName": "DescribeEvents", "errorCode": 403},
+    ["not", "an", "object"],
+]
+
+
+def _config_attribute_patterns():
+    for config_file in sorted(os.listdir(CONFIG_DIRECTORY)):
+        with open(os.path.join(CONFIG_DIRECTORY, config_file)) as config:
+            config_json = json.load(config)
+        for rule_json in config_json.get("rules", []):
+            for attribute_json in rule_json.get("attributes", []):
+                yield pytest.param(attribute_json["pattern"], id=f"{config_file}:{attribute_json['key']}")
+
+
+def _evaluation_records():
+    for log_group, log_content in itertools.product(LOG_GROUPS, LOG_CONTENTS):
+        record = {
+            "log_stream": "database-1.0",
+            "log_group": log_group,
+            "region": "us-east-1",
+            "partition": "aws",
+            "account_id": "444000444",
+            "log_content": log_content,
+            "aws.arn": "arn:aws:rds:us-east-1:444000444:db:database-1",
+        }
+        for pattern in ["/aws/lambda/%{GREEDYDATA:function_name}",
+                        "/aws/rds/instance/%{DATA:resource_id}/%{GREEDYDATA:log_type}",
+                        "sns/%{DATA}/%{DATA}/(?<resource_id>[^/]+)%{GREEDYDATA:failure_suffix}"]:
+            match = metadata_engine.get_native_regex(pattern).search(log_group)
+            if match:
+                record.update(match.groupdict())
+        yield record
+    yield {}
+    yield {"region": None, "account_id": None, "function_name": "my-function"}
+
+
+def _evaluate(evaluate, record):
+    try:
+        return "value", evaluate(record)
+    except Exception as ex:
+        return "exception", type(ex)
+
+
+@pytest.mark.parametrize("pattern", list(_config_attribute_patterns()))
+def test_compiled_expression_same_as_interpreter_for_configs(pattern):
+    expression = jmespath_parser.parse(pattern)
+    compiled_expression = compile_expression(expression.parsed, JMESPATH_OPTIONS.custom_functions)
+
+    assert compiled_expression is not None, "all expressions used in shipped configs should be compiled"
+
+    for record in _evaluation_records():
+        interpreted = _evaluate(lambda evaluated_record: expression.search(evaluated_record, JMESPATH_OPTIONS), record)
+        compiled = _evaluate(compiled_expression, record)
+        assert compiled == interpreted, f"record: {record}"
+
+
+@pytest.mark.parametrize("pattern", [
+    "items[*].name",
+    "items[?size > `1`].name | [0]",
+    "items[].tags[] | sort(@)",
+    "{first: items[0].name, count: length(items)}",
+    "!missing && (missing || items[-1].name)",
+    "labels.*",
+    "items[1:].name",
+    "join(',', items[*].size)",
+])
+def test_compiled_expression_same_as_interpreter(pattern):
+    record = {
+        "items": [{"name": "a", "size": 1, "tags": ["x"]}, {"name": "b", "size": 2, "tags": ["z", "y"]}],
+        "labels": {"team": "logs"},
+    }
+    expression = jmespath_parser.parse(pattern)
+    compiled_expression = compile_expression(expression.parsed, JMESPATH_OPTIONS.custom_functions)
+
+    assert compiled_expression is not None
+    assert _evaluate(compiled_expression, record) == \
+           _evaluate(lambda evaluated_record: expression.search(evaluated_record, JMESPATH_OPTIONS), record)
+
+
+@pytest.mark.parametrize("pattern", [
+    "sort_by(items, &size)",
+    "merge(labels, labels)",
+    "starts_with(log_content)",
+])
+def test_unsupported_expression_left_to_interpreter(pattern):
+    expression = jmespath_parser.parse(pattern)
+
+    assert compile_expression(expression.parsed, JMESPATH_OPTIONS.custom_functions) is None
@@ -14,7 +14,7 @@
 
 import pytest
 
-from logs.metadata_engine import metadata_engine
+from logs.metadata_engine import jmespath, metadata_engine
 
 
 @pytest.mark.parametrize("testcase", [
@@ -82,3 +82,123 @@ def run_with_clean_engine(input):
     output = {}
     engine.apply(input, output)
     return output
+
+
+def test_attribute_patterns_compiled_at_load_time():
+    attributes = metadata_engine._create_attributes([
+        {"key": "aws.service", "pattern": "'lambda'"},
+        {"key": "aws.arn", "pattern": "format_arn('arn:{}:lambda:{}', [partition, region]"},
+        {"key": "aws.resource.id", "pattern": "not_existing_function(function_name)"},
+        {"key": "faas.id", "pattern": "format_arn('arn:{}:lambda:{}', [partition, region])"},
+    ])
+
+    assert [attribute.key for attribute in attributes] == ["aws.service", "faas.id"]
+    assert attributes[1].expression.search({"partition": "aws", "region": "us-east-1"},
+                                           metadata_engine.JMESPATH_OPTIONS) == "arn:aws:lambda:us-east-1"
+
+
+def test_resolve_rule_once_per_log_group():
+    engine = metadata_engine.MetadataEngine()
+    engine._rule_by_log_group.pop_statistics()
+
+    lambda_rule = engine.resolve_rule({"log_group": "/aws/lambda/my-function"})
+    assert lambda_rule.entity_type_name == "LAMBDA"
+    assert engine.resolve_rule({"log_group": "/aws/lambda/my-function"}) is lambda_rule
+    assert engine.resolve_rule({"log_group": "SOMETHING_NOT_RECOGNIZED"}) is engine.default_rule
+
+    assert engine._rule_by_log_group.pop_statistics() == (1, 2)
+
+
+
+@pytest.mark.parametrize("pattern, expected_fields", [
+    ("'lambda'", set()),
+    ("format_arn('arn:{}:lambda:{}', [partition, region])", {"partition", "region"}),
+    ("log_content.userIdentity.arn", {"log_content"}),
+    ("if( starts_with(log_content, '[ERROR]'), &'ERROR', &'INFO', @)", {"log_content"}),
+    ("if( failure_suffix == '', &'INFO', &'ERROR', @)", {"failure_suffix"}),
+    ("[`Failed`, log_content.errorCode] | [? @!=null ] | join('.', @)", {"log_content"}),
+    ("length(@)", None),
+])
+def test_referenced_fields(pattern, expected_fields):
+    expression = metadata_engine._compile_pattern(pattern)
+
+    assert metadata_engine._referenced_fields(expression.parsed) == expected_fields
+
+
+def test_attributes_split_by_log_content_dependency():
+    attributes = metadata_engine._create_attributes([
+        {"key": "aws.resource.id", "pattern": "function_name"},
+        {"key": "severity", "priority": 1, "pattern": "if(starts_with(log_content, 'E'), &'ERROR', &null, @)"},
+        {"key": "log.level", "priority": 2, "pattern": "severity"},
+        {"key": "severity", "priority": 3, "pattern": "'WARN'"},
+        {"key": "aws.arn", "priority": 4, "pattern": "format_arn('arn:{}:lambda:{}', [partition, region])"},
+    ])
+
+    record_attributes, event_attributes = metadata_engine._split_attributes_by_log_content_dependency(attributes)
+
+    assert [attribute.key for attribute in record_attributes] == ["aws.arn", "aws.resource.id"]
+    assert [attribute.key for attribute in event_attributes] == ["severity", "log.level", "severity"]
+
+
+def test_prepared_rule_applied_to_log_entries():
+    engine = metadata_engine.MetadataEngine()
+    record = {"log_group": "/aws/lambda/my-function", "region": "us-east-1", "partition": "aws",
+              "account_id": "444000444"}
+
+    prepared_rule = engine.prepare_rule(record)
+    assert prepared_rule.record_values == {"function_name": "my-function"}
+    assert prepared_rule.attributes["aws.arn"] == "arn:aws:lambda:us-east-1:444000444:function:my-function"
+
+    error_entry = {"content": "[ERROR] failure"}
+    engine.apply(dict(record), error_entry, prepared_rule)
+    info_entry = {"content": "all good"}
+    engine.apply(dict(record), info_entry, prepared_rule)
+
+    assert error_entry["severity"] == "ERROR"
+    assert info_entry["severity"] == "INFO"
+    assert error_entry["faas.id"] == info_entry["faas.id"] == prepared_rule.attributes["aws.arn"]
+
+
+@pytest.mark.parametrize("log_group", [
+    "/aws/lambda/my-function",
+    "/aws/apprunner/my-service/0123456789abcdef/application",
+    "/aws/rds/instance/database-1/postgresql",
+    "/aws/rds/cluster/aurora-mysql/general",
+    "API-Gateway-Execution-Logs_8zcb3dxf4l/DEV",
+    "sns/us-east-1/444000444/sample-sns-logs-generator/Failure",
+    "SOMETHING_NOT_RECOGNIZED",
+])
+def test_native_regex_matches_grok_for_config_patterns(log_group):
+    engine = metadata_engine.MetadataEngine()
+    patterns = [rule.aws_loggroup_pattern for rule in engine.rules if rule.aws_loggroup_pattern]
+    assert patterns
+
+    for pattern in patterns:
+        native_regex = metadata_engine.get_native_regex(pattern)
+        assert native_regex is not None, f"pattern {pattern} should be translated to native regex"
+
+        native_match = native_regex.search(log_group)
+        assert (native_match.groupdict() if native_match else None) == metadata_engine.get_grok(pattern).match(log_group)
+
+
+def test_parse_aws_loggroup_with_grok_fallback():
+    pattern = "/aws/custom/%{INT:instance_number:int}/%{IPV4:address}"
+
+    assert metadata_engine.get_native_regex(pattern) is None
+    assert metadata_engine.parse_aws_loggroup_with_grok_pattern("/aws/custom/12/10.0.0.1", pattern) == {
+        "instance_number": 12,
+        "address": "10.0.0.1",
+    }
+
+
+def test_replace_regex_compiled_once():
+    custom_functions = jmespath.MappingCustomFunctions()
+    jmespath.replace_regex_cache.clear()
+    jmespath.replace_regex_cache.pop_statistics()
+
+    assert custom_functions._func_replace_regex("database-1.0", r"(.*)\.0$", "$1") == "database-1"
+    assert custom_functions._func_replace_regex("database-2.0", r"(.*)\.0$", "$1") == "database-2"
+    assert custom_functions._func_replace_regex("database-2.0", r"\.0$", "") == "database-2"
+
+    assert len(jmespath.replace_regex_cache) == 2
+    assert jmespath.replace_regex_cache.pop_statistics() == (1, 2)
@@ -0,0 +1,66 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import random
+
+from logs.metadata_engine import metadata_engine
+from logs.metadata_engine.rule_index import AhoCorasickAutomaton, PrefixTrie, RuleIndex
+
+OPERAND_PARTS = ["/aws/", "lambda", "/", "rds", "Cluster", "a", "ab", "ß", "SS", "-logs"]
+
+
+def test_aho_corasick_finds_all_contained_words():
+    automaton = AhoCorasickAutomaton()
+    for output, word in enumerate(["he", "she", "his", "hers"]):
+        automaton.add(word, output)
+    automaton.build()
+
+    assert sorted(set(automaton.matches("ushers"))) == [0, 1, 3]
+    assert list(automaton.matches("xyz")) == []
+
+
+def test_prefix_trie_finds_all_prefixes():
+    trie = PrefixTrie()
+    trie.add("/aws/", 0)
+    trie.add("/aws/lambda/", 1)
+    trie.add("/aws/rds/", 2)
+
+    assert list(trie.matches("/aws/lambda/my-function")) == [0, 1]
+    assert list(trie.matches("/other")) == []
+
+
+def test_rule_index_gives_same_rule_as_checking_rules_in_order():
+    randomizer = random.Random(1234)
+
+    def random_text(max_parts):
+        return "".join(randomizer.choice(OPERAND_PARTS) for _ in range(randomizer.randint(1, max_parts)))
+
+    rules = []
+    for rule_number in range(200):
+        sources = [
+            {"source": "log_group", "condition": f"{randomizer.choice(['$prefix', '$eq', '$contains'])}('{random_text(3)}')"}
+            for _ in range(randomizer.randint(1, 2))
+        ]
+        rules.extend(metadata_engine._create_config_rules({
+            "name": f"rule-{rule_number}",
+            "rules": [{"sources": sources, "attributes": []}],
+        }))
+    rule_index = RuleIndex(rules)
+
+    for _ in range(2000):
+        log_group = random_text(6)
+        expected_rule = next(
+            (rule for rule in rules if metadata_engine._check_if_rule_applies(rule, {"log_group": log_group}, {})), None)
+
+        assert rule_index.find_first_matching_rule(log_group) is expected_rule, f"log group: {log_group}"
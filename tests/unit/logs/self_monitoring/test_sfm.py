@@ -163,3 +163,80 @@ def test_self_monitoring_context():
     ]
 
     assert metrics == expected_metrics
+
+
+def test_self_monitoring_cache_statistics():
+    sfm = SelfMonitoringContext("my-lambda-function")
+    sfm.kinesis_record_age(5)
+    sfm.kinesis_record_decoded(1000, 2000)
+
+    sfm.cache_statistics("metadata_engine_rule_by_log_group", 10, 2)
+    sfm.cache_statistics("metadata_engine_rule_by_log_group", 5, 0)
+
+    metrics = sfm._generate_metrics()
+
+    cache_dimensions = [{'Name': 'function_name', 'Value': 'my-lambda-function'},
+                        {'Name': 'cache', 'Value': 'metadata_engine_rule_by_log_group'}]
+    assert {'MetricName': 'Cache hits', 'Dimensions': cache_dimensions, 'Unit': 'None', 'Value': 15} in metrics
+    assert {'MetricName': 'Cache misses', 'Dimensions': cache_dimensions, 'Unit': 'None', 'Value': 2} in metrics
+
+
+def test_self_monitoring_connections():
+    sfm = SelfMonitoringContext("my-lambda-function")
+    sfm.kinesis_record_age(5)
+    sfm.kinesis_record_decoded(1000, 2000)
+
+    sfm.connection_established(120.5, False)
+    sfm.connection_reused()
+    sfm.connection_reused()
+    sfm.connection_established(40.0, True)
+
+    metrics = sfm._generate_metrics()
+
+    dimensions = [{'Name': 'function_name', 'Value': 'my-lambda-function'}]
+    assert {'MetricName': 'Connections reused', 'Dimensions': dimensions, 'Unit': 'None', 'Value': 2} in metrics
+    assert {'MetricName': 'Connections established', 'Dimensions': dimensions, 'Unit': 'None', 'Value': 2} in metrics
+    assert {'MetricName': 'Connections handshake duration', 'Dimensions': dimensions, 'Unit': 'Milliseconds',
+            'Values': [120.5, 40.0]} in metrics
+    assert {'MetricName': 'Connections TLS session resumed', 'Dimensions': dimensions, 'Unit': 'None',
+            'Value': 1} in metrics
+
+
+def test_self_monitoring_request_bodies_compressed():
+    sfm = SelfMonitoringContext("my-lambda-function")
+    sfm.kinesis_record_age(5)
+    sfm.kinesis_record_decoded(1000, 2000)
+
+    assert not any(metric['MetricName'].startswith("Request data") for metric in sfm._generate_metrics())
+
+    sfm.request_body_compressed(1000000, 90000)
+    sfm.request_body_compressed(500000, 50000)
+
+    metrics = sfm._generate_metrics()
+
+    dimensions = [{'Name': 'function_name', 'Value': 'my-lambda-function'}]
+    assert {'MetricName': 'Request data uncompressed size', 'Dimensions': dimensions, 'Unit': 'Bytes',
+            'Value': 1500000} in metrics
+    assert {'MetricName': 'Request data compressed size', 'Dimensions': dimensions, 'Unit': 'Bytes',
+            'Value': 140000} in metrics
+
+
+def test_self_monitoring_requests_retried():
+    sfm = SelfMonitoringContext("my-lambda-function")
+    sfm.kinesis_record_age(5)
+    sfm.kinesis_record_decoded(1000, 2000)
+
+    sfm.request_retried("429", 0.5)
+    sfm.request_retried("429", 1.2)
+    sfm.request_retried("request_failed_without_status_code", 0.4)
+
+    metrics = sfm._generate_metrics()
+
+    dimensions = [{'Name': 'function_name', 'Value': 'my-lambda-function'}]
+    assert {'MetricName': 'Requests retried', 'Dimensions': dimensions + [{'Name': 'reason', 'Value': '429'}],
+            'Unit': 'None', 'Value': 2} in metrics
+    assert {'MetricName': 'Requests retried',
+            'Dimensions': dimensions + [{'Name': 'reason', 'Value': 'request_failed_without_status_code'}],
+            'Unit': 'None', 'Value': 1} in metrics
+    assert {'MetricName': 'Requests retry delay', 'Dimensions': dimensions, 'Unit': 'Seconds',
+            'Values': [0.5, 1.2, 0.4]} in metrics
@@ -0,0 +1,172 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from logs import event_sources
+from logs.input_records_decoder import BadSchemaError
+from logs.models.batch_metadata import BatchMetadata
+from logs.models.transformation_result import TransformationResult
+
+lambda_event = {
+    "invocationId": "1545b29a-10ca-4f7f-a60f-54195607c98d",
+    "deliveryStreamArn": "arn:aws:firehose:us-east-1:444652832050:deliverystream/b-FirehoseLogStreams-lbcTAGyNE8hz",
+    "region": "us-east-1",
+    "records": [
+        {
+            "recordId": "49615192443673540283798383997441439122248557324429950978000000",
+            "approximateArrivalTimestamp": 1612438967376,
+            "data": "H4sIAAAAAAAAAGWQzWrDMBCEXyXobMNK1urHN0Mc00NODr20ITiOSAy2ZSy5oYS8ezcNOZTCnuabZXfmxgYXQnN2u+/JsZyti11x2JZ1XVQlS5i/jm4mWUqpUJhMAALJvT9Xs18mIm3vl9O1ie3l0C4h+oHY01HH2TUDWQQInoJIQaYkh6ecsLAcQzt3U+z8uOn66ObA8g92TOt/AFL+BusSt0WxeceK7X8PlF9ujI+dG+tOdCdDiwYtIAcUWivNFapMobQKjOFCK4vCaq2NkmiMkBaAyCNQ7KiG2AyUiCsuZGasQq5l8qrnT4wVF7mk0Z+R3li9LPf9/Qf9DEk+TwEAAA=="
+        },
+        {
+            "recordId": "49615192443673540283798383997442648048068174358786342914000000",
+            "approximateArrivalTimestamp": 1612439002747,
+            "data": "H4sIAAAAAAAAAGWQwWrDMBBEfyXobMNqV5Il3wxxTA85OfTShuA4IjXYlrHkhBDy71Ubcii9vpllZufOBut9c7a722RZztbFrjhsy7ouqpIlzF1HO0cshFASNSFIiLh352p2yxSVtnfL6dqE9uvQLj64IWpPRx1m2wzRgoA8BUxBpBH7J06YX46+nbspdG7cdH2ws2f5Bzum9T8BUv4G61Jui2LzLiu2/w0oL3YMPzd31p1iDkkjtTScgKM22nCugIgMlwozNIoUABlEwUGAFllmSGkhdOwSujhDaIb4EVccBRkAUETJa54/b6w45oJyxM8Qa6xelsf+8Q1mxAG9TwEAAA=="
+        },
+        {
+            "recordId": "49615192443673540283798383997443856973887789262838956034000000",
+            "approximateArrivalTimestamp": 1612439006290,
+            "data": "H4sIAAAAAAAAAGVQy2qDQBT9lTBrhTt37qjjToiRLrIydNOGYMyQCuqIMyaEkH/vbUMWpdvz4DzuYrDeN2e7u01W5GJd7IrDtqzroipFJNx1tDPDRJRozBSCBoZ7d65mt0zMtL1bTtcmtF+HdvHBDcw9FXWYbTOwBAFlDBgDxQz7JxwJvxx9O3dT6Ny46fpgZy/yD3GM638ExPIN1qXeFsXmXVdi/xtQXuwYfjx30Z04R2mjM22kyjgQETOSqVEqNWDQUKpAJkCQIaSJIkk8JQWpJHKX0PENoRl4kUwkkjIA7Mbodc+fGSuJOakck8/ANVYvyWP/+AbSuZ1nTwEAAA=="
+        },
+        {
+            "recordId": "49615192443673540283798383997445065899707404304330522626000000",
+            "approximateArrivalTimestamp": 1612439011420,
+            "data": "H4sIAAAAAAAAAGWQwWrDMBBEfyXoHMNqpbW8vhnimB5ycuilDcFxRGqwLWPJDSXk36s25FB6fTPLzM5NDNb75mL3X5MVudgU++K4K+u6qEqxFu462jlirXVKmCkEgoh7d6lmt0xRaXu3nK9NaD+O7eKDG6L2cNRhts0QLQgoE8AEdBKxf+C18MvJt3M3hc6N264PdvYifxOnpP4nQCJfYFPSrii2r1SJw29A+WnH8HNzE9055ihiyoilZmAyBhmMylSapaQptjeGiSRKglRpg8ialUJmjF1CF2cIzRA/kqlErRiApcrWz3n+vLGSmGuVK/keYo3V03I/3L8BezNvmk8BAAA="
+        }
+    ]
+}
+
+
+def test_read_batch_metadata():
+    batch_metadata = event_sources.read_batch_metadata(lambda_event)
+
+    assert vars(batch_metadata) == vars(BatchMetadata("444652832050", "us-east-1", "aws"))
+
+
+def test_kinesis_data_transformation_response():
+    results = [TransformationResult.Ok, TransformationResult.Dropped, TransformationResult.ProcessingFailed,
+               TransformationResult.Ok]
+
+    response = event_sources.kinesis_data_transformation_response(lambda_event["records"], results)
+
+    assert response == {"records": [
+        {"recordId": record["recordId"], "result": result.name, "data": record["data"]}
+        for record, result in zip(lambda_event["records"], results)
+    ]}
+
+
+def test_kinesis_data_transformation_response_minimal_payload_for_forwarded():
+    results = [TransformationResult.Ok, TransformationResult.Dropped, TransformationResult.ProcessingFailed,
+               TransformationResult.Ok]
+
+    response = event_sources.kinesis_data_transformation_response(lambda_event["records"], results, True)
+
+    response_data = [record["data"] for record in response["records"]]
+    assert response_data == [event_sources.FORWARDED_RECORD_PLACEHOLDER_DATA, lambda_event["records"][1]["data"],
+                             lambda_event["records"][2]["data"], event_sources.FORWARDED_RECORD_PLACEHOLDER_DATA]
+    assert json.loads(base64.b64decode(event_sources.FORWARDED_RECORD_PLACEHOLDER_DATA)) == {"forwarded_to_dynatrace": True}
+    assert [record["recordId"] for record in response["records"]] == \
+           [record["recordId"] for record in lambda_event["records"]]
+
+
+def test_find_event_source():
+    assert isinstance(event_sources.find_event_source(lambda_event), event_sources.FirehoseEventSource)
+    assert isinstance(event_sources.find_event_source({"Records": [{"eventSource": "aws:kinesis"}]}),
+                      event_sources.KinesisEventSource)
+    assert isinstance(event_sources.find_event_source({"Records": [{"eventSource": "aws:sqs"}]}),
+                      event_sources.SqsEventSource)
+    assert isinstance(event_sources.find_event_source({"awslogs": {"data": "H4sI"}}),
+                      event_sources.CloudWatchLogsEventSource)
+
+    for event in [{}, {"Records": []}, {"Records": [{"eventSource": "aws:s3"}]}]:
+        with pytest.raises(BadSchemaError):
+            event_sources.find_event_source(event)
+
+
+def test_kinesis_records_read_as_firehose_records():
+    kinesis_event = {"Records": [{
+        "kinesis": {
+            "partitionKey": "7b5e9f2c4d",
+            "sequenceNumber": "49590338271490256608559692538361571095921575989136588898",
+            "data": "H4sIAAAAAAAAAA==",
+            "approximateArrivalTimestamp": 1612438967.376,
+        },
+        "eventSource": "aws:kinesis",
+        "eventSourceARN": "arn:aws-cn:kinesis:cn-north-1:444652832050:stream/dynatrace-logs",
+    }]}
+    event_source = event_sources.KinesisEventSource()
+
+    records = event_source.read_records(kinesis_event)
+
+    assert records == [{"recordId": "49590338271490256608559692538361571095921575989136588898",
+                        "approximateArrivalTimestamp": pytest.approx(1612438967376),
+                        "data": "H4sIAAAAAAAAAA=="}]
+    assert vars(event_source.read_batch_metadata(kinesis_event, None)) == \
+           vars(BatchMetadata("444652832050", "cn-north-1", "aws-cn"))
+
+
+def test_sqs_records_read_as_firehose_records():
+    sqs_event = {"Records": [{
+        "messageId": message_id,
+        "body": body,
+        "attributes": {"SentTimestamp": "1612438967376"},
+        "eventSource": "aws:sqs",
+        "eventSourceARN": "arn:aws:sqs:us-east-1:444652832050:dynatrace-logs",
+    } for message_id, body in [("wrapped", '{"awslogs": {"data": "H4sIAAAAAAAAAA=="}}'),
+                               ("raw", "H4sIAAAAAAAAAA=="),
+                               ("other-json", '{"message": "not logs"}')]]}
+    event_source = event_sources.SqsEventSource()
+
+    records = event_source.read_records(sqs_event)
+
+    assert records == [
+        {"recordId": "wrapped", "approximateArrivalTimestamp": 1612438967376, "data": "H4sIAAAAAAAAAA=="},
+        {"recordId": "raw", "approximateArrivalTimestamp": 1612438967376, "data": "H4sIAAAAAAAAAA=="},
+        # fails to decode like any other record which isn't logs
+        {"recordId": "other-json", "approximateArrivalTimestamp": 1612438967376, "data": '{"message": "not logs"}'},
+    ]
+    assert vars(event_source.read_batch_metadata(sqs_event, None)) == \
+           vars(BatchMetadata("444652832050", "us-east-1", "aws"))
+
+
+def test_batch_item_failures_response():
+    results = [TransformationResult.Ok, TransformationResult.Dropped, TransformationResult.ProcessingFailed,
+               TransformationResult.ProcessingFailed]
+
+    response = event_sources.batch_item_failures_response(lambda_event["records"], results)
+
+    assert response == {"batchItemFailures": [{"itemIdentifier": lambda_event["records"][2]["recordId"]},
+                                              {"itemIdentifier": lambda_event["records"][3]["recordId"]}]}
+    assert event_sources.batch_item_failures_response(lambda_event["records"][:2], results[:2]) == \
+           {"batchItemFailures": []}
+
+
+def test_cloudwatch_logs_subscription():
+    event_source = event_sources.CloudWatchLogsEventSource()
+    lambda_context = SimpleNamespace(
+        invoked_function_arn="arn:aws:lambda:eu-west-1:444652832050:function:dynatrace-aws-logs:live")
+
+    records = event_source.read_records({"awslogs": {"data": "H4sIAAAAAAAAAA=="}})
+
+    assert records == [{"recordId": None, "data": "H4sIAAAAAAAAAA=="}]
+    assert vars(event_source.read_batch_metadata({}, lambda_context)) == \
+           vars(BatchMetadata("444652832050", "eu-west-1", "aws"))
+    assert event_source.response(records, [TransformationResult.Ok], None) is None
+    assert event_source.response(records, [TransformationResult.Dropped], None) is None
+    with pytest.raises(event_sources.RecordsProcessingFailedError):
+        event_source.response(records, [TransformationResult.ProcessingFailed], None)
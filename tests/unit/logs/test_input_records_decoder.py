@@ -12,6 +12,8 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import base64
+import gzip
 from unittest import TestCase
 from logs import input_records_decoder
 from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH
@@ -43,8 +45,8 @@ class Test(TestCase):
         expected_first = r'{"messageType":"DATA_MESSAGE","owner":"444652832050","logGroup":"cloudwatch_customlog","logStream":"2021-02-04-logstream","subscriptionFilters":["b-SubscriptionFilter0-1I0DE5MAAFV5G"],"logEvents":[{"id":"35958590510527767165636549608812769529777864588249006080","timestamp":1612438965174,"message":"2021-02-04 12:42:47\tlog message"}]}'
         expected_second = r'{"messageType":"DATA_MESSAGE","owner":"444652832050","logGroup":"cloudwatch_customlog","logStream":"2021-02-04-logstream","subscriptionFilters":["b-SubscriptionFilter0-1I0DE5MAAFV5G"],"logEvents":[{"id":"35958591301289891160333915627296360039224104084779368448","timestamp":1612439000633,"message":"2021-02-04 12:43:22\tlog message"}]}'
 
-        self.assertEqual(decoded_records[0], expected_first)
-        self.assertEqual(decoded_records[1], expected_second)
+        self.assertEqual(decoded_records[0], expected_first.encode())
+        self.assertEqual(decoded_records[1], expected_second.encode())
 
     def test_check_records_list_if_logs_end_decode_not_logs(self):
         context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
@@ -61,3 +63,60 @@ class Test(TestCase):
         is_logs, decoded_records = input_records_decoder.check_records_list_if_logs_end_decode(records, context)
 
         self.assertFalse(is_logs)
+
+    def test_check_records_list_if_logs_end_decode_corrupted_record(self):
+        context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                          DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH)
+
+        records = [
+            {
+                "approximateArrivalTimestamp": 1612438967376,
+                "data": base64.b64encode(gzip.compress(b'{"messageType": "DATA_MESSAGE"}')).decode()
+            },
+            {
+                "approximateArrivalTimestamp": 1612438967376,
+                "data": base64.b64encode(b"\x1f\x8b\x08\x00 corrupted").decode()
+            },
+        ]
+
+        is_logs, decoded_records = input_records_decoder.check_records_list_if_logs_end_decode(records, context)
+
+        self.assertTrue(is_logs)
+        self.assertEqual(decoded_records, [b'{"messageType": "DATA_MESSAGE"}', None])
+        self.assertEqual(context.sfm._issue_count_by_type["record_decoding_failed"], 1)
+
+    def test_decode_records_concurrently_keeps_order(self):
+        records = [
+            {"data": base64.b64encode(gzip.compress(f'{{"record": {i}}}'.encode() * (i * 100 + 1))).decode()}
+            for i in range(20)
+        ]
+        records[7]["data"] = base64.b64encode(b"\x1f\x8b\x08\x00 corrupted").decode()
+
+        decoded_records_by_concurrency = {}
+        for decode_concurrency in [1, 3]:
+            context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                              DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH, decode_concurrency=decode_concurrency)
+
+            decoded_records_by_concurrency[decode_concurrency] = \
+                list(input_records_decoder.decode_records(records, context))
+
+            self.assertEqual(len(context.sfm._record_data_compressed_size), 19)
+            self.assertEqual(sorted(context.sfm._record_data_decompressed_size),
+                             sorted(len(f'{{"record": {i}}}') * (i * 100 + 1) for i in range(20) if i != 7))
+            self.assertEqual(context.sfm._issue_count_by_type["record_decoding_failed"], 1)
+
+        self.assertEqual(decoded_records_by_concurrency[3], decoded_records_by_concurrency[1])
+        self.assertIsNone(decoded_records_by_concurrency[3][7])
+        self.assertEqual(decoded_records_by_concurrency[3][19], b'{"record": 19}' * 1901)
+
+    def test_gunzip_same_as_gzip_decompress(self):
+        single_member = gzip.compress(b'{"messageType": "DATA_MESSAGE"}')
+        multiple_members_padded = gzip.compress(b'{"first": 1}') + gzip.compress(b'{"second": 2}') + b"\x00" * 4
+
+        for data in [single_member, multiple_members_padded]:
+            self.assertEqual(input_records_decoder.gunzip(data), gzip.decompress(data))
+
+        with self.assertRaises(EOFError):
+            input_records_decoder.gunzip(single_member[:-8])
+        with self.assertRaises(Exception):
+            input_records_decoder.gunzip(single_member + b"garbage")
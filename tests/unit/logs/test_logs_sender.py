@@ -12,11 +12,18 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import gzip
 import json
 import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
 
 from logs import logs_sender
+from util import http_client
 from util.context import Context
 
 DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE = 1048576
@@ -182,3 +189,318 @@ class Test(TestCase):
         self.assertEqual(logs_sender.prepare_full_url("https://jxw.dynatrace.com/e/123", "/api/v1/logs/ingest"), expected)
         self.assertEqual(logs_sender.prepare_full_url("jxw.dynatrace.com/e/123", "/api/v1/logs/ingest"), expected)
         self.assertEqual(logs_sender.prepare_full_url("jxw.dynatrace.com/e/123", "api/v1/logs/ingest"), expected)
+
+
+def _create_context_for_server(server, upload_concurrency):
+    return Context("function-name", f"http://127.0.0.1:{server.server_address[1]}", "dt-token", False, False,
+                   "log.forwarder", logs_sender.DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH,
+                   upload_concurrency=upload_concurrency)
+
+
+def _create_logs(count):
+    return [{"content": f"log message {i}", "severity": "INFO"} for i in range(count)]
+
+
+@pytest.fixture
+def default_batch_limits(monkeypatch):
+    # limits are also overwritten by the tests above
+    monkeypatch.setattr(logs_sender, "DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE", DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE)
+    monkeypatch.setattr(logs_sender, "DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 5000)
+
+
+@pytest.fixture
+def batches_of_ten_entries(default_batch_limits, monkeypatch):
+    monkeypatch.setattr(logs_sender, "DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 10)
+
+
+def test_push_batches_concurrently(ingest_server, batches_of_ten_entries):
+    # requests are held long enough for the concurrent ones to overlap on the server
+    ingest_server.response_delay_sec = 0.05
+
+    for upload_concurrency in [1, 4]:
+        ingest_server.bodies.clear()
+        ingest_server.max_requests_in_flight = 0
+        context = _create_context_for_server(ingest_server, upload_concurrency)
+
+        logs_sender.push_logs_to_dynatrace(_create_logs(80), context)
+
+        delivered_logs = [log for body in ingest_server.bodies for log in json.loads(body)]
+        assert sorted(log["content"] for log in delivered_logs) == sorted(log["content"] for log in _create_logs(80))
+        assert context.sfm._batches_delivered == 8
+        assert context.sfm._log_entries_delivered == 80
+        assert context.sfm._requests_count_by_status_code == {200: 8}
+        if upload_concurrency == 1:
+            assert ingest_server.max_requests_in_flight == 1
+        else:
+            assert 1 < ingest_server.max_requests_in_flight <= upload_concurrency
+
+
+@pytest.mark.parametrize("status, expected_exception", [
+    (429, logs_sender.CallThrottlingException),
+    (500, logs_sender.CallOtherException),
+])
+def test_push_batches_concurrently_error_response(ingest_server, batches_of_ten_entries, monkeypatch, status,
+                                                  expected_exception):
+    monkeypatch.setattr(logs_sender, "RETRY_MAX_ATTEMPTS", 1)
+    ingest_server.response_status = status
+    context = _create_context_for_server(ingest_server, 4)
+
+    with pytest.raises(expected_exception):
+        logs_sender.push_logs_to_dynatrace(_create_logs(80), context)
+
+    assert context.sfm._batches_delivered == 0
+    assert 1 <= len(ingest_server.bodies) < 8
+
+
+def test_push_batches_concurrently_stops_after_failed_batch(ingest_server, batches_of_ten_entries):
+    ingest_server.response_delay_sec = 0.05
+    ingest_server.response_status_for_body = lambda body: 500 if b'"log message 0"' in body else 200
+    context = _create_context_for_server(ingest_server, 2)
+
+    with pytest.raises(logs_sender.CallOtherException):
+        logs_sender.push_logs_to_dynatrace(_create_logs(80), context)
+
+    # batches started before the failure are delivered, the remaining ones are not sent
+    assert len(ingest_server.bodies) < 8
+    assert context.sfm._batches_delivered == len(ingest_server.bodies) - 1
+    assert context.sfm._issue_count_by_type["bad_response_code"] == 1
+
+
+@pytest.mark.parametrize("upload_concurrency", [1, 4])
+def test_push_gzip_compressed_batches(ingest_server, batches_of_ten_entries, upload_concurrency):
+    context = _create_context_for_server(ingest_server, upload_concurrency)
+    context.gzip_compression_level = 5
+
+    logs_sender.push_logs_to_dynatrace(_create_logs(80), context)
+
+    assert len(ingest_server.bodies) == 8
+    assert all(headers["Content-Encoding"] == "gzip" for headers in ingest_server.request_headers)
+    uncompressed_bodies = [gzip.decompress(body) for body in ingest_server.bodies]
+    delivered_logs = [log for body in uncompressed_bodies for log in json.loads(body)]
+    assert sorted(log["content"] for log in delivered_logs) == sorted(log["content"] for log in _create_logs(80))
+
+    assert context.sfm._request_bodies_uncompressed_size == sum(len(body) for body in uncompressed_bodies)
+    assert context.sfm._request_bodies_compressed_size == sum(len(body) for body in ingest_server.bodies)
+    assert context.sfm._batches_delivered == 8
+
+
+def test_request_size_limit_applies_to_uncompressed_payload(default_batch_limits):
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                      logs_sender.DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH, gzip_compression_level=9)
+    logs = [create_log_entry_with_random_len_msg() for _ in range(5000)]
+
+    batches = logs_sender.prepare_batches(logs, context)
+
+    assert all(len(batch.serialized_json) <= logs_sender.DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE
+               for batch in batches)
+    compressed = logs_sender.gzip_compress(batches[0].serialized_json, 9)
+    assert gzip.decompress(compressed) == batches[0].serialized_json
+
+
+@pytest.fixture
+def short_retry_delays(monkeypatch):
+    monkeypatch.setattr(logs_sender, "RETRY_BASE_DELAY_SEC", 0.01)
+
+
+def _statuses_in_order(*statuses):
+    remaining_statuses = list(statuses)
+    return lambda body: remaining_statuses.pop(0) if len(remaining_statuses) > 1 else remaining_statuses[0]
+
+
+@pytest.mark.parametrize("status", [429, 502, 503, 504])
+def test_push_retried_until_delivered(ingest_server, default_batch_limits, short_retry_delays, status):
+    ingest_server.response_status_for_body = _statuses_in_order(status, status, 200)
+    context = _create_context_for_server(ingest_server, 1)
+
+    logs_sender.push_logs_to_dynatrace(_create_logs(10), context)
+
+    assert len(ingest_server.bodies) == 3
+    assert context.sfm._batches_delivered == 1
+    assert context.sfm._requests_count_by_status_code == {status: 2, 200: 1}
+    assert context.sfm._requests_retried_by_reason == {str(status): 2}
+    assert len(context.sfm._requests_retry_delays_sec) == 2
+
+
+def test_push_retries_exhausted(ingest_server, default_batch_limits, short_retry_delays):
+    ingest_server.response_status = 503
+    context = _create_context_for_server(ingest_server, 1)
+
+    with pytest.raises(logs_sender.CallOtherException):
+        logs_sender.push_logs_to_dynatrace(_create_logs(10), context)
+
+    assert len(ingest_server.bodies) == logs_sender.RETRY_MAX_ATTEMPTS
+    assert context.sfm._issue_count_by_type["retries_exhausted"] == 1
+    assert context.sfm._batches_delivered == 0
+
+
+def test_push_not_retried_beyond_remaining_time(ingest_server, default_batch_limits, short_retry_delays):
+    ingest_server.response_status = 429
+    context = _create_context_for_server(ingest_server, 1)
+    context.get_remaining_time_in_millis = lambda: http_client.TIMEOUT_SEC * 1000 + logs_sender.RETRY_SAFETY_MARGIN_MS
+
+    with pytest.raises(logs_sender.CallThrottlingException):
+        logs_sender.push_logs_to_dynatrace(_create_logs(10), context)
+
+    assert len(ingest_server.bodies) == 1
+    assert context.sfm._issue_count_by_type["retry_exceeding_remaining_time"] == 1
+
+
+def test_push_retry_after_respected(ingest_server, default_batch_limits):
+    ingest_server.response_status_for_body = _statuses_in_order(429, 200)
+    ingest_server.response_headers = {"Retry-After": "1"}
+    context = _create_context_for_server(ingest_server, 1)
+
+    with patch("logs.logs_sender.time.sleep") as mock_sleep:
+        logs_sender.push_logs_to_dynatrace(_create_logs(10), context)
+
+    mock_sleep.assert_called_once_with(1)
+    assert len(ingest_server.bodies) == 2
+    assert context.sfm._requests_retry_delays_sec == [1]
+    assert context.sfm._batches_delivered == 1
+
+
+def test_push_retried_on_request_failed_without_status_code(default_batch_limits, short_retry_delays):
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder", 8192)
+    responses = [ConnectionResetError("connection reset"), (200, "", {})]
+
+    with patch("util.http_client.perform_http_request_for_json", side_effect=responses) as mock_http_client:
+        logs_sender.push_logs_to_dynatrace(_create_logs(10), context)
+
+    assert mock_http_client.call_count == 2
+    assert context.sfm._requests_retried_by_reason == {"request_failed_without_status_code": 1}
+    assert context.sfm._batches_delivered == 1
+
+
+def test_retry_delay():
+    assert logs_sender.get_retry_delay_sec(1, "3") == 3
+    assert logs_sender.get_retry_delay_sec(1, "Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert 120 < logs_sender.get_retry_delay_sec(1, format_datetime(datetime.now(timezone.utc) + timedelta(minutes=2.5))) <= 150
+
+    for attempt in range(1, 10):
+        backoff_sec = min(logs_sender.RETRY_MAX_DELAY_SEC, logs_sender.RETRY_BASE_DELAY_SEC * 2 ** (attempt - 1))
+        for retry_after in [None, "", "not a date"]:
+            assert backoff_sec / 2 <= logs_sender.get_retry_delay_sec(attempt, retry_after) <= backoff_sec
+
+
+def _rejecting_entries_count_above(max_entries_count, always_rejected_content=None):
+    def response_status_for_body(body):
+        log_entries = json.loads(body)
+        if len(log_entries) > max_entries_count:
+            return 413
+        if any(log_entry["content"] == always_rejected_content for log_entry in log_entries):
+            return 413
+        return 200
+    return response_status_for_body
+
+
+@pytest.mark.parametrize("upload_concurrency", [1, 4])
+def test_push_split_on_payload_too_large(ingest_server, default_batch_limits, upload_concurrency):
+    ingest_server.response_status_for_body = _rejecting_entries_count_above(3)
+    context = _create_context_for_server(ingest_server, upload_concurrency)
+    logs = _create_logs(20)
+
+    logs_sender.push_logs_to_dynatrace(logs, context)
+
+    delivered_bodies = [body for body in ingest_server.bodies if len(json.loads(body)) <= 3]
+    delivered_logs = [log for body in delivered_bodies for log in json.loads(body)]
+    assert delivered_logs == logs
+    # 20 -> 10 -> 5 -> 3 and 2
+    assert context.sfm._batches_split == 7
+    assert context.sfm._batches_delivered == 8
+    assert context.sfm._log_entries_delivered == 20
+    assert context.sfm._data_volume_delivered == sum(len(body) for body in delivered_bodies)
+
+
+def test_push_split_drops_single_rejected_entries(ingest_server, default_batch_limits):
+    ingest_server.response_status_for_body = _rejecting_entries_count_above(5, always_rejected_content="log message 7")
+    context = _create_context_for_server(ingest_server, 1)
+    logs = _create_logs(20)
+
+    logs_sender.push_logs_to_dynatrace(logs, context)
+
+    delivered_logs = [log for body in ingest_server.bodies if ingest_server.response_status_for_body(body) == 200
+                      for log in json.loads(body)]
+    assert delivered_logs == logs[:7] + logs[8:]
+    assert context.sfm._log_entries_delivered == 19
+    assert context.sfm._issue_count_by_type["log_entry_too_large_dropped"] == 1
+
+
+def test_split_batch():
+    logs = [{"content": "ąę 1", "severity": "INFO", "value": 1.1}, {"content": "2"}, {"content": "3"}]
+    batch = logs_sender.serialize_batch(logs)
+
+    first_half, second_half = logs_sender.split_batch(batch)
+
+    assert json.loads(batch.serialized_json) == logs
+    assert (json.loads(first_half.serialized_json), json.loads(second_half.serialized_json)) == (logs[:1], logs[1:])
+    assert (first_half.log_entries_count, second_half.log_entries_count) == (1, 2)
+    assert first_half.data_volume + second_half.data_volume - 1 == batch.data_volume
+
+
+def test_prepare_batches_accounts_exact_encoded_size(monkeypatch):
+    logs = [{"content": "zażółć gęślą jaźń " + str(i) + " 日本語"} for i in range(10)]
+    entry_size = len(json.dumps(logs[0]).encode("utf-8"))
+    # room for exactly 3 entries, with brackets and commas
+    monkeypatch.setattr(logs_sender, "DYNATRACE_LOG_INGEST_REQUEST_MAX_SIZE", 3 * entry_size + 4)
+    monkeypatch.setattr(logs_sender, "DYNATRACE_LOG_INGEST_MAX_ENTRIES_COUNT", 100)
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder",
+                      logs_sender.DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH)
+
+    batches = logs_sender.prepare_batches(logs, context)
+
+    assert [batch.log_entries_count for batch in batches] == [3, 3, 3, 1]
+    assert [batch.first_log_entry_index for batch in batches] == [0, 3, 6, 9]
+    assert batches[0].data_volume == len(batches[0].serialized_json) == 3 * entry_size + 4
+    assert [entry for batch in batches for entry in json.loads(batch.serialized_json)] == logs
+
+
+@pytest.mark.parametrize("upload_concurrency", [1, 2])
+def test_deliver_logs_stops_consuming_logs_after_failed_batch(ingest_server, batches_of_ten_entries,
+                                                               upload_concurrency):
+    ingest_server.response_status_for_body = lambda body: 500 if b'"log message 0"' in body else 200
+    context = _create_context_for_server(ingest_server, upload_concurrency)
+    consumed_logs_count = 0
+
+    def generate_logs():
+        nonlocal consumed_logs_count
+        for log in _create_logs(1000):
+            consumed_logs_count += 1
+            yield log
+
+    delivery_outcome = logs_sender.deliver_logs_to_dynatrace(generate_logs(), context)
+
+    assert isinstance(delivery_outcome.exception, logs_sender.CallOtherException)
+    assert delivery_outcome.undelivered_batches[0].first_log_entry_index == 0
+    # batches are prepared only as they can be sent, at most one more than the ones in flight
+    assert consumed_logs_count <= (upload_concurrency + 2) * 10 + 1
+    assert delivery_outcome.unbatched_log_entries_start_index == \
+           max(batch.first_log_entry_index + batch.log_entries_count
+               for batch in delivery_outcome.undelivered_batches)
+
+
+def test_deliver_logs_prepares_next_batch_while_sending_one_after_another(ingest_server, batches_of_ten_entries):
+    ingest_server.response_delay_sec = 0.2
+    context = _create_context_for_server(ingest_server, 1)
+    consumed_logs_count = 0
+    consumed_logs_count_when_first_batch_delivered = None
+
+    def generate_logs():
+        nonlocal consumed_logs_count
+        for log in _create_logs(30):
+            consumed_logs_count += 1
+            yield log
+
+    def respond(body):
+        nonlocal consumed_logs_count_when_first_batch_delivered
+        if consumed_logs_count_when_first_batch_delivered is None:
+            consumed_logs_count_when_first_batch_delivered = consumed_logs_count
+        return 200
+
+    ingest_server.response_status_for_body = respond
+
+    delivery_outcome = logs_sender.deliver_logs_to_dynatrace(generate_logs(), context)
+
+    assert delivery_outcome.exception is None
+    assert len(ingest_server.bodies) == 3
+    # the second batch was prepared (and the first entry of the third one taken) while the first one was sent
+    assert consumed_logs_count_when_first_batch_delivered == 21
@@ -19,6 +19,8 @@ import logs.main
 import logs.transformation
 from logs.metadata_engine.metadata_engine import MetadataEngine
 from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import RecordAttributes, serialize_log_entry
+from logs import logs_sender
 from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH
 from util.context import Context
 
@@ -114,3 +116,110 @@ def test_log_forwarder_setup():
 
     # then
     assert actual_output[0]['cloud.log_forwarder'] == forwarder_setup
+
+
+def _create_record(log_group, log_events):
+    return json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "owner": "444652832050",
+        "logGroup": log_group,
+        "logStream": "2021-02-04-logstream",
+        "subscriptionFilters": ["b-SubscriptionFilter0-1I0DE5MAAFV5G"],
+        "logEvents": log_events,
+    })
+
+
+def test_serialized_log_entries_same_as_json_dumps():
+    record = _create_record("/aws/rds/cluster/aurora-postresql/postgresql", [
+        {"id": "1", "timestamp": 1628589446077, "message": "2021-08-10 09:20:53 UTC::@:[7701]:WARNING:  zażółć \"\u65e5\""},
+        {"id": "2", "timestamp": "1628589446078", "message": "no severity\ttab"},
+        {"id": "3", "message": "2021-08-10 09:20:53 UTC::@:[7701]:ERROR:  without timestamp"},
+    ])
+
+    parsed_logs = logs.transformation.extract_dt_logs_from_single_record(record, BATCH_METADATA, get_context())
+
+    assert parsed_logs[0]["severity"] == "WARNING"
+    assert [serialize_log_entry(log) for log in parsed_logs] == [json.dumps(log).encode() for log in parsed_logs]
+
+
+def test_serialized_log_entry_same_as_json_dumps_after_trimming(monkeypatch):
+    monkeypatch.setattr(logs_sender, "DYNATRACE_LOG_INGEST_ATTRIBUTE_MAX_LENGTH", 10)
+    context = get_context()
+    record = _create_record("API-Gateway-Execution-Logs", [{"id": "1", "timestamp": 1, "message": "x" * 100}])
+    log_entry = logs.transformation.extract_dt_logs_from_single_record(record, BATCH_METADATA, context)[0]
+
+    logs_sender.ensure_fields_length(log_entry, context)
+
+    assert log_entry["aws.log_group"] == "API-Gatewa"
+    assert serialize_log_entry(log_entry) == json.dumps(log_entry).encode()
+
+
+def test_record_attributes_not_spliced_when_overwritten_by_rule():
+    leading_attributes = {"cloud.provider": "aws", "aws.log_group": "log-group"}
+    trailing_attributes = {"cloud.log_forwarder": "log.forwarder"}
+
+    def serialized_attributes_valid(rule_attributes, event_attribute_keys):
+        return RecordAttributes(leading_attributes, trailing_attributes, rule_attributes,
+                                event_attribute_keys).serialized_attributes_valid
+
+    assert serialized_attributes_valid({"aws.service": "rds"}, ["severity", "content", "aws.resource.id"])
+    assert serialized_attributes_valid({"severity": "ERROR"}, [])
+    assert not serialized_attributes_valid({"aws.log_group": "overwritten"}, [])
+    assert not serialized_attributes_valid({}, ["aws.log_group"])
+    assert not serialized_attributes_valid({}, ["timestamp"])
+    assert not serialized_attributes_valid({"aws.service": "rds"}, ["aws.service"])
+
+
+def test_escaped_messages_passed_through():
+    log_events = [
+        {"id": "1", "timestamp": 1, "message": "plain text, zażółć 日"},
+        {"id": "2", "timestamp": 2, "message": 'escaped \\"quotes\\" and \\\\ "message": backslash\\\\'},
+        {"id": "3", "message": "last\n"},
+    ]
+    # CloudWatch doesn't escape non-ASCII characters
+    record = json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "owner": "444652832050",
+        "logGroup": "API-Gateway-Execution-Logs",
+        "logStream": "2021-02-04-logstream",
+        "subscriptionFilters": ["b-SubscriptionFilter0-1I0DE5MAAFV5G"],
+        "logEvents": log_events,
+    }, ensure_ascii=False, separators=(",", ":")).encode()
+
+    parsed_logs = logs.transformation.extract_dt_logs_from_single_record(record, BATCH_METADATA, get_context())
+
+    assert [log.escaped_content[1] for log in parsed_logs] == [
+        json.dumps(log_event["message"], ensure_ascii=False).encode() for log_event in log_events]
+    serialized_logs = [serialize_log_entry(log) for log in parsed_logs]
+    assert serialized_logs[0] == json.dumps(parsed_logs[0], ensure_ascii=False).encode()
+    assert serialized_logs[1:] == [json.dumps(log).encode() for log in parsed_logs[1:]]
+
+
+def test_escaped_messages_not_passed_through_with_many_quotes():
+    log_events = [{"id": "1", "message": "plain text"}, {"id": "2", "message": '{"key": "value"}' * 3}]
+    record = _create_record("API-Gateway-Execution-Logs", log_events)
+
+    parsed_logs = logs.transformation.extract_dt_logs_from_single_record(record, BATCH_METADATA, get_context())
+
+    assert [log.escaped_content for log in parsed_logs] == [None, None]
+    assert [serialize_log_entry(log) for log in parsed_logs] == [json.dumps(log).encode() for log in parsed_logs]
+
+
+def test_escaped_message_not_passed_through_when_trimmed():
+    context = Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder", 20)
+    record = _create_record("API-Gateway-Execution-Logs", [{"id": "1", "timestamp": 1, "message": "x" * 100}])
+    log_entry = logs.transformation.extract_dt_logs_from_single_record(record, BATCH_METADATA, context)[0]
+
+    logs_sender.ensure_fields_length(log_entry, context)
+
+    assert serialize_log_entry(log_entry) == json.dumps(log_entry).encode()
+    assert len(log_entry["content"]) == 20
+
+
+def test_escaped_messages_not_found_when_not_matching_log_events():
+    log_events = [{"id": "1", "message": "first"}, {"id": "2", "message": None}]
+    record = _create_record("API-Gateway-Execution-Logs", log_events).encode()
+
+    assert logs.transformation.find_escaped_messages(record, len(log_events)) is None
+    assert logs.transformation.find_escaped_messages(_create_record("group", log_events[:1]).encode(), 1) == \
+        [b'"first"']
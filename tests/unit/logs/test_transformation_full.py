@@ -19,6 +19,7 @@ import pytest
 import logs.main
 import logs.transformation
 from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import serialize_log_entry
 from logs.logs_sender import DYNATRACE_LOG_INGEST_CONTENT_DEFAULT_MAX_LENGTH
 from util.context import Context
 
@@ -1007,6 +1008,7 @@ def test_full_transformation(testcase: dict):
         json.dumps(record_data_decoded), BATCH_METADATA, CONTEXT)
 
     assert len(logs_sent) == len(record_data_decoded["logEvents"])
+    assert [serialize_log_entry(log) for log in logs_sent] == [json.dumps(log).encode() for log in logs_sent]
 
     first_log = logs_sent[0]
 
@@ -0,0 +1,149 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from logs import logs_sender, main, transformation_processes
+from logs.models.batch_metadata import BatchMetadata
+from logs.models.log_entry import serialize_log_entry
+from util.context import Context
+
+BATCH_METADATA = BatchMetadata("444000444", "us-east-1", "aws")
+
+
+def get_context(transformation_processes=None):
+    return Context("function-name", "dt-url", "dt-token", False, False, "log.forwarder", 20,
+                   transformation_processes=transformation_processes)
+
+
+@pytest.fixture
+def stopped_workers():
+    yield
+    transformation_processes.stop_workers()
+
+
+def _create_record(log_group, messages) -> bytes:
+    return json.dumps({
+        "messageType": "DATA_MESSAGE",
+        "owner": "444652832050",
+        "logGroup": log_group,
+        "logStream": "2021-02-04-logstream",
+        "subscriptionFilters": ["b-SubscriptionFilter0-1I0DE5MAAFV5G"],
+        "logEvents": [{"id": str(i), "timestamp": 1612438965174 + i, "message": message}
+                      for i, message in enumerate(messages)],
+    }).encode()
+
+
+RECORDS = [
+    _create_record("/aws/lambda/first", ["first 1", "first 2 longer than the content limit"]),
+    None,
+    b"{not json",
+    json.dumps({"messageType": "CONTROL_MESSAGE", "logEvents": []}).encode(),
+] + [_create_record(f"/aws/lambda/function-{i}", [f"message {i}"] * i) for i in range(1, 10)]
+
+
+def test_records_transformed_in_processes_same_as_in_this_process(stopped_workers):
+    context = get_context()
+    in_this_process = list(main.transform_records(RECORDS, BATCH_METADATA, context))
+    for logs in in_this_process:
+        for log in logs.logs or []:
+            logs_sender.ensure_fields_length(log, context)
+
+    processes_context = get_context()
+    in_processes = list(transformation_processes.transform_records_in_processes(RECORDS, BATCH_METADATA,
+                                                                                processes_context, 3))
+
+    assert [record.logs for record in in_processes] == \
+           [None if record.logs is None else [serialize_log_entry(log) for log in record.logs]
+            for record in in_this_process]
+    assert [record.logs_timestamps for record in in_processes] == \
+           [record.logs_timestamps for record in in_this_process]
+    assert processes_context.sfm._issue_count_by_type == context.sfm._issue_count_by_type == \
+           {"record_transformation_failed": 1}
+    assert processes_context.sfm.logs_trimmed_counts() == context.sfm.logs_trimmed_counts() == (1, 0)
+
+
+def test_workers_kept_and_replaced_across_invocations(stopped_workers):
+    list(transformation_processes.transform_records_in_processes(RECORDS, BATCH_METADATA, get_context(), 2))
+    first_processes = [worker.process for worker in transformation_processes._workers]
+
+    first_processes[0].kill()
+    first_processes[0].join()
+    in_processes = list(transformation_processes.transform_records_in_processes(RECORDS, BATCH_METADATA,
+                                                                                get_context(), 2))
+
+    assert len(transformation_processes._workers) == 2
+    assert transformation_processes._workers[0].process is first_processes[1]
+    assert transformation_processes._workers[1].process not in first_processes
+    assert [record.logs is None for record in in_processes] == [False, True, True] + [False] * (len(RECORDS) - 3)
+
+
+def test_records_transformed_in_this_process_when_workers_are_gone(stopped_workers):
+    records = [_create_record(f"/aws/lambda/function-{i}", [f"message {i}"]) for i in range(6)]
+    context = get_context()
+    transformed_records = transformation_processes.transform_records_in_processes(records, BATCH_METADATA, context, 2)
+    first_record = next(transformed_records)
+    for worker in transformation_processes._workers:
+        worker.process.kill()
+        worker.process.join()
+
+    remaining_records = list(transformed_records)
+
+    assert first_record.logs is not None
+    assert len(remaining_records) == len(records) - 1
+    # a record can fail only if the worker was killed before sending its result, the others are transformed here
+    failed_records_count = sum(record.logs is None for record in remaining_records)
+    assert failed_records_count <= 1
+    assert context.sfm._issue_count_by_type.get("record_transformation_failed", 0) == failed_records_count
+
+
+def test_workers_started_and_stopped(stopped_workers):
+    list(transformation_processes.transform_records_in_processes(RECORDS, BATCH_METADATA, get_context(), 2))
+    processes = [worker.process for worker in transformation_processes._workers]
+    assert len(processes) == 2
+    assert all(process.is_alive() for process in processes)
+
+    transformation_processes.stop_workers()
+
+    assert transformation_processes._workers == []
+    assert not any(process.is_alive() for process in processes)
+
+
+@pytest.mark.parametrize("transformation_processes_setting, lambda_memory_size, records_count, cpu_count, "
+                         "expected_processes_count", [
+    (None, "3008", 100, 1, 1),
+    (None, "3008", 100, 4, 4),
+    (None, "3008", 20, 4, 2),
+    (None, "3008", 3, 4, 1),
+    (None, "1769", 100, 2, 2),
+    # 2 CPUs reported, but less than a single full vCPU given
+    (None, "256", 100, 2, 1),
+    (None, "1768", 100, 2, 1),
+    # not in Lambda
+    (None, None, 100, 4, 1),
+    (1, "3008", 100, 4, 1),
+    (3, "256", 1, 1, 3),
+])
+def test_transformation_processes_count(transformation_processes_setting, lambda_memory_size, records_count,
+                                        cpu_count, expected_processes_count, monkeypatch):
+    if lambda_memory_size is None:
+        monkeypatch.delenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", raising=False)
+    else:
+        monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", lambda_memory_size)
+    with patch("os.cpu_count", return_value=cpu_count):
+        assert transformation_processes.transformation_processes_count(
+            records_count, get_context(transformation_processes_setting)) == expected_processes_count
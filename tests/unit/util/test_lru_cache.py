@@ -0,0 +1,41 @@
+#   Copyright 2021 Dynatrace LLC
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from util.lru_cache import LruCache, all_caches
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LruCache("test-cache", 2)
+
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_statistics():
+    cache = LruCache("test-cache-statistics", 10)
+
+    assert cache.get_or_compute("key", lambda: None) is None
+    assert cache.get_or_compute("key", lambda: "not computed again") is None
+    assert cache.get("other") is None
+
+    assert cache in all_caches()
+    assert cache.pop_statistics() == (1, 2)
+    assert cache.pop_statistics() == (0, 0)